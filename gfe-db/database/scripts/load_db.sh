@@ -23,6 +23,7 @@ NEO4J_CYPHER_PATH=$NEO4J_HOME/cypher
 NEO4J_IMPORT_PATH=$NEO4J_HOME/import
 S3_NEO4J_CYPHER_PATH=config/neo4j/cypher
 S3_CSV_PATH=data/$RELEASE/csv
+S3_IMPORT_PATH=data/$RELEASE/import
 
 if [[ -z $AWS_REGION ]]; then
     export AWS_REGION=$(curl --silent http://169.254.169.254/latest/dynamic/instance-identity/document | jq -r '.region')
@@ -55,50 +56,211 @@ else
     echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Found S3 bucket: $DATA_BUCKET_NAME"
 fi
 
-# Get most recent Cypher scripts
-echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Fetching most recent Cypher scripts"
-aws s3 cp --recursive s3://$DATA_BUCKET_NAME/$S3_NEO4J_CYPHER_PATH/ $NEO4J_CYPHER_PATH
+# Checks the CSVs in a directory against a build manifest, which records the
+# size and SHA-256 of the uncompressed CSVs
+verify_manifest() {
+    MANIFEST_PATH=$(mktemp)
+    aws s3 cp "$1" $MANIFEST_PATH || return 1
+    python3 - $MANIFEST_PATH "$2" <<'EOF'
+import os
+import sys
+import gzip
+import json
+from hashlib import sha256
+
+manifest_path, csv_dir = sys.argv[1:]
+with open(manifest_path) as f:
+    files = json.load(f)["files"]
+
+failed = 0
+for schema, expected in files.items():
+    path = os.path.join(csv_dir, expected["file"])
+    if not os.path.isfile(path) and os.path.isfile(f'{path}.gz'):
+        path = f'{path}.gz'
+    if not os.path.isfile(path):
+        print(f'ERROR: {expected["file"]} is missing')
+        failed += 1
+        continue
 
-# Download data to NEO4J_HOME/import
-echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Downloading CSV data for release $RELEASE"
-aws s3 cp --recursive s3://$DATA_BUCKET_NAME/$S3_CSV_PATH/ $NEO4J_IMPORT_PATH/
+    num_bytes, digest = 0, sha256()
+    with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 ** 2), b""):
+            num_bytes += len(chunk)
+            digest.update(chunk)
 
-# Update Cypher load query for correct release
-mkdir -p $NEO4J_CYPHER_PATH/tmp/$RELEASE/
-cat $NEO4J_CYPHER_PATH/load.cyp | sed "s/RELEASE/$RELEASE/g" > $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp
+    if num_bytes != expected["bytes"] or digest.hexdigest() != expected["sha256"]:
+        print(f'ERROR: {path} does not match the manifest')
+        failed += 1
 
-echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Executing query"
-echo "****** Begin Cypher ******"
-printf "$(cat $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp)\n"
-echo "****** End Cypher ******"
+sys.exit(1 if failed else 0)
+EOF
+    VERIFY_EXIT_STATUS=$?
+    rm -f $MANIFEST_PATH
+    return $VERIFY_EXIT_STATUS
+}
 
-# Run Cypher load query
-echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Loading data for release $RELEASE into Neo4j..."
+# Parallel ranged downloads with checksum verification. If the transfer tool
+# fails, the files are downloaded again with the AWS CLI, which is only
+# accepted when they can be verified against the manifest given as third
+# argument. Compressed CSVs are kept compressed, LOAD CSV and neo4j-admin
+# import read them directly.
+download() {
+    python3 $EC2_USER_HOME/s3_transfer.py download "$1" "$2" && return 0
 
-if [[ "$USE_PRIVATE_SUBNET" = true ]]; then
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - ERROR: s3_transfer.py failed to download $1"
+    if [[ -z $3 ]]; then
+        echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - ERROR: No manifest to verify a download of $1 with the AWS CLI"
+        return 1
+    fi
 
-    # # With SSL/TLS policy disabled for private instance
-    cat $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp | \
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - WARNING: Downloading $1 with the AWS CLI and verifying it against $3"
+    aws s3 cp --recursive "$1" "$2/" && verify_manifest "$3" "$2"
+}
+
+# Runs Cypher from stdin against the database
+cypher() {
+    if [[ "$USE_PRIVATE_SUBNET" = true ]]; then
+        # With SSL/TLS policy disabled for private instance
         $NEO4J_HOME/bin/cypher-shell \
             --address bolt://127.0.0.1:7687 \
             --encryption false \
             --username $NEO4J_USERNAME \
             --password $NEO4J_PASSWORD \
-            --format verbose
-    LOAD_EXIT_STATUS=$?
-
-else
-
-    # With SSL/TLS policy enabled
-    cat $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp | \
+            "$@"
+    else
+        # With SSL/TLS policy enabled
         $NEO4J_HOME/bin/cypher-shell \
             --address neo4j://$SUBDOMAIN.$HOST_DOMAIN:7687 \
             --encryption true \
             --username $NEO4J_USERNAME \
             --password $NEO4J_PASSWORD \
-            --format verbose
+            "$@"
+    fi
+}
+
+# Returns the single value of a Cypher query
+query_value() {
+    echo "$1" | cypher --format plain | tail -n 1
+}
+
+# Backfills the keys and release statistics of a database loaded before
+# load.cyp merged on seq_id and feature_id and maintained ReleaseStats. The
+# node counts are read from the counts store and the key indexes, so a
+# migrated database is not scanned.
+migrate_db() {
+    for KEY in Sequence:seq_id Feature:feature_id; do
+        LABEL=${KEY%%:*}
+        PROPERTY=${KEY##*:}
+        NUM_NODES=$(query_value "MATCH (n:$LABEL) RETURN count(n);")
+        NUM_KEYED=$(query_value "MATCH (n:$LABEL) WHERE n.$PROPERTY IS NOT NULL RETURN count(n);")
+        if [[ "$NUM_NODES" != "$NUM_KEYED" ]]; then
+            echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Setting $PROPERTY on $(($NUM_NODES - $NUM_KEYED)) $LABEL nodes"
+            cat $NEO4J_CYPHER_PATH/migrate_keys.cyp | cypher --format verbose || return 1
+            break
+        fi
+    done
+
+    NUM_GFES=$(query_value "MATCH (gfe:GFE) RETURN count(gfe);")
+    NUM_STATS=$(query_value "MATCH (stats:ReleaseStats) RETURN count(stats);")
+    if [[ "$NUM_GFES" != "0" && "$NUM_STATS" = "0" ]]; then
+        echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Creating ReleaseStats of loaded releases"
+        cat $NEO4J_CYPHER_PATH/release_stats.cyp | cypher --format verbose || return 1
+    fi
+}
+
+# Replaces the database with the neo4j-admin import files of the release. Much
+# faster than load.cyp but only valid for an empty database.
+import_db() {
+    NEO4J_BULK_IMPORT_PATH=$NEO4J_IMPORT_PATH/bulk
+    mkdir -p $NEO4J_BULK_IMPORT_PATH
+    download s3://$DATA_BUCKET_NAME/$S3_IMPORT_PATH/ $NEO4J_BULK_IMPORT_PATH || return 1
+    chown -R neo4j:neo4j $NEO4J_BULK_IMPORT_PATH
+
+    IMPORT_ARGS=""
+    for f in $NEO4J_BULK_IMPORT_PATH/*_nodes.$RELEASE.csv*; do
+        IMPORT_ARGS="$IMPORT_ARGS --nodes=$f"
+    done
+    for f in $NEO4J_BULK_IMPORT_PATH/*_rels.$RELEASE.csv*; do
+        IMPORT_ARGS="$IMPORT_ARGS --relationships=$f"
+    done
+
+    systemctl stop neo4j
+    sudo -u neo4j $NEO4J_HOME/bin/neo4j-admin database import full \
+        $IMPORT_ARGS \
+        --overwrite-destination=true \
+        --verbose \
+        $NEO4J_DATABASE_NAME
+    IMPORT_EXIT_STATUS=$?
+    systemctl start neo4j
+
+    # Wait for the database to accept connections
+    for i in $(seq 1 60); do
+        echo "RETURN 1;" | cypher > /dev/null 2>&1 && break
+        sleep 5
+    done
+
+    if [[ $IMPORT_EXIT_STATUS -ne 0 ]]; then
+        return $IMPORT_EXIT_STATUS
+    fi
+
+    # The imported database has no constraints or indexes
+    cat $NEO4J_CYPHER_PATH/init.cyp | cypher --format verbose
+}
+
+# Get most recent Cypher scripts
+echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Fetching most recent Cypher scripts"
+aws s3 cp --recursive s3://$DATA_BUCKET_NAME/$S3_NEO4J_CYPHER_PATH/ $NEO4J_CYPHER_PATH
+
+# LOAD_MODE is auto (default), import or cypher. In auto mode an empty database
+# is bulk imported if the build wrote import files, otherwise load.cyp is run.
+LOAD_MODE=${LOAD_MODE:-auto}
+if [[ "$LOAD_MODE" = auto ]]; then
+    NODE_COUNT=$(echo "MATCH (n) RETURN count(n) AS count;" | cypher --format plain | tail -n 1)
+    if [[ "$NODE_COUNT" = "0" ]] && aws s3 ls s3://$DATA_BUCKET_NAME/$S3_IMPORT_PATH/ > /dev/null; then
+        LOAD_MODE=import
+    else
+        LOAD_MODE=cypher
+    fi
+fi
+echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Load mode: $LOAD_MODE"
+
+if [[ "$LOAD_MODE" = import ]]; then
+
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Importing data for release $RELEASE into Neo4j..."
+    import_db
     LOAD_EXIT_STATUS=$?
 
+else
+
+    # Download data to NEO4J_HOME/import
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Downloading CSV data for release $RELEASE"
+    download s3://$DATA_BUCKET_NAME/$S3_CSV_PATH/ $NEO4J_IMPORT_PATH s3://$DATA_BUCKET_NAME/data/$RELEASE/manifest.json
+    DOWNLOAD_EXIT_STATUS=$?
+
+    # Update Cypher load query for correct release and compressed CSVs
+    if [[ -f $NEO4J_IMPORT_PATH/gfe_sequences.$RELEASE.csv.gz ]]; then
+        CSV_EXTENSION=csv.gz
+    else
+        CSV_EXTENSION=csv
+    fi
+    mkdir -p $NEO4J_CYPHER_PATH/tmp/$RELEASE/
+    cat $NEO4J_CYPHER_PATH/load.cyp | sed "s/RELEASE\.csv/$RELEASE.$CSV_EXTENSION/g" > $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp
+
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Executing query"
+    echo "****** Begin Cypher ******"
+    printf "$(cat $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp)\n"
+    echo "****** End Cypher ******"
+
+    # Run Cypher load query
+    echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - Loading data for release $RELEASE into Neo4j..."
+    if [[ $DOWNLOAD_EXIT_STATUS -ne 0 ]]; then
+        echo "$(date -u +'%Y-%m-%d %H:%M:%S.%3N') - ERROR: CSV data for release $RELEASE could not be downloaded"
+        LOAD_EXIT_STATUS=$DOWNLOAD_EXIT_STATUS
+    else
+        migrate_db && cat $NEO4J_CYPHER_PATH/tmp/$RELEASE/load.$RELEASE.cyp | cypher --format verbose
+        LOAD_EXIT_STATUS=$?
+    fi
+
 fi
 
 if [[ $LOAD_EXIT_STATUS -eq 0 ]]; then
@@ -0,0 +1,143 @@
+"""Fails if a statement of load.cyp is planned with a label or full node scan.
+
+Every statement of load.cyp is explained against a database with the
+constraints of init.cyp: the outer and inner statements of
+apoc.periodic.iterate and the standalone statements. Outer statements must
+stream the release CSVs rather than the graph, so the cost of a load does not
+grow with the size of the graph.
+
+Connects to NEO4J_URI with NEO4J_USERNAME and NEO4J_PASSWORD, or to the
+deployed database through SSM when NEO4J_URI is not set. Explains against the
+database NEO4J_DATABASE_NAME, gfedb by default like the application. Set it
+to neo4j for a Neo4j Community container, which only has the default
+database.
+"""
+import os
+import re
+import sys
+import json
+import logging
+from pathlib import Path
+from neo4j import GraphDatabase
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+CYPHER_DIR = Path(__file__).parents[2] / "neo4j" / "cypher"
+
+DATABASE_NAME = os.environ.get("NEO4J_DATABASE_NAME", "gfedb")
+
+# Operators that read every node of a label or of the graph
+SCAN_OPERATORS = ["NodeByLabelScan", "AllNodesScan"]
+
+ITERATE_PATTERN = re.compile(r"CALL apoc\.periodic\.iterate\(\s*'(.*?)'\s*,\s*'(.*?)'\s*,", re.DOTALL)
+
+
+def get_connection():
+    if "NEO4J_URI" in os.environ:
+        return os.environ["NEO4J_URI"], (os.environ["NEO4J_USERNAME"], os.environ["NEO4J_PASSWORD"])
+
+    import boto3
+
+    stage = os.environ["STAGE"]
+    app_name = os.environ["APP_NAME"]
+    aws_region = os.environ["AWS_REGION"]
+
+    session = boto3.session.Session(region_name=aws_region)
+    ssm = session.client("ssm")
+    secrets = session.client("secretsmanager")
+
+    uri = ssm.get_parameter(Name=f"/{app_name}/{stage}/{aws_region}/Neo4jUri")["Parameter"]["Value"]
+    auth_arn = ssm.get_parameter(Name=f"/{app_name}/{stage}/{aws_region}/Neo4jCredentialsSecretArn")["Parameter"]["Value"]
+    auth = json.loads(secrets.get_secret_value(SecretId=auth_arn)["SecretString"])
+
+    return uri, (auth["NEO4J_USERNAME"], auth["NEO4J_PASSWORD"])
+
+
+def split_statements(cypher):
+    """Splits a Cypher script on the semicolons that end its statements"""
+
+    statements = []
+    for statement in re.split(r";\s*\n", cypher):
+        lines = [line for line in statement.splitlines() if not line.strip().startswith("//")]
+        statement = "\n".join(lines).strip().rstrip(";")
+        if statement:
+            statements.append(statement)
+    return statements
+
+
+def load_statements(load_cypher):
+    """Returns (name, statement, parameters) for each statement of load.cyp,
+    including both statements of apoc.periodic.iterate. The columns returned
+    by an outer statement are parameters of its inner statement, as in
+    apoc.periodic.iterate."""
+
+    statements = []
+
+    for i, statement in enumerate(split_statements(load_cypher)):
+        match = ITERATE_PATTERN.search(statement)
+
+        if match is None:
+            statements.append((f"statement {i}", statement, {}))
+            continue
+
+        outer, inner = match.groups()
+        statements.append((f"statement {i} (outer)", outer.strip(), {}))
+
+        returned = outer.strip().split("RETURN")[-1]
+        columns = [column.strip().split(" AS ")[-1].strip() for column in returned.replace("DISTINCT", "").split(",")]
+        params = ", ".join(f"${column} AS {column}" for column in columns)
+        statements.append((f"statement {i} (iterate)", f"WITH {params}\n{inner.strip()}", dict.fromkeys(columns)))
+
+    return statements
+
+
+def scans(plan):
+    """Yields the scan operators in a query plan"""
+
+    operator = plan["operatorType"].split("@")[0]
+    if operator in SCAN_OPERATORS:
+        yield operator, plan.get("identifiers", [])
+    for child in plan.get("children", []):
+        yield from scans(child)
+
+
+def check_load_plan(driver, database=DATABASE_NAME, release="RELEASE"):
+    """Explains the load statements and returns the scans found"""
+
+    with driver.session(database=database) as session:
+        for statement in split_statements((CYPHER_DIR / "init.cyp").read_text()):
+            session.run(statement).consume()
+        session.run("CALL db.awaitIndexes(300)").consume()
+
+        load_cypher = (CYPHER_DIR / "load.cyp").read_text().replace("RELEASE", release)
+        failures = []
+
+        for name, statement, parameters in load_statements(load_cypher):
+            plan = session.run(f"EXPLAIN {statement}", parameters).consume().plan
+            for operator, identifiers in scans(plan):
+                failures.append({"statement": name, "operator": operator, "identifiers": identifiers})
+                logger.error(f"{operator} on {identifiers} in {name}:\n{statement}")
+
+    return failures
+
+
+def test_load_plan():
+    uri, auth = get_connection()
+
+    with GraphDatabase.driver(uri, auth=auth) as driver:
+        assert check_load_plan(driver) == []
+
+
+if __name__ == "__main__":
+    uri, auth = get_connection()
+    logger.info(f"Neo4j URI: {uri}")
+
+    with GraphDatabase.driver(uri, auth=auth) as driver:
+        failures = check_load_plan(driver)
+
+    if failures:
+        logger.error(f"Found {len(failures)} scans in load.cyp")
+        sys.exit(1)
+
+    logger.info("No scans found in load.cyp")
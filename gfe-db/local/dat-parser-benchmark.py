@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Times the lean and Biopython parsers of hla.RELEASE.dat and measures their
+peak memory. Writes dat-parser-benchmark.tsv.
+
+Usage: python3 dat-parser-benchmark.py [hla.RELEASE.dat] [--repeat N]
+
+Defaults to the DAT sample used by the parity test, use a release DAT file
+for representative numbers.
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+from Bio import SeqIO
+
+BUILD_DIR = Path(__file__).parents[1] / "pipeline" / "jobs" / "build"
+sys.path.insert(0, str(BUILD_DIR / "src"))
+
+import imgt_dat
+
+RESULTS_PATH = "dat-parser-benchmark.tsv"
+
+parsers = {
+    "biopython": lambda dat_file: SeqIO.parse(dat_file, "imgt"),
+    "lean": lambda dat_file: imgt_dat.parse(dat_file),
+}
+
+
+def consume(records):
+    """Reads the fields of each record used by the build, returns the number
+    of records"""
+
+    num_records = 0
+    for num_records, record in enumerate(records, start=1):
+        record.id, record.description, str(record.seq)
+        for feature in record.features:
+            feature.type, feature.location, feature.qualifiers
+    return num_records
+
+
+def benchmark(parser, dat_file, repeat):
+    """Returns (records, best seconds, peak MB) of a parser"""
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_records = consume(parsers[parser](dat_file))
+        seconds.append(time.perf_counter() - start)
+
+    # Measured separately, tracemalloc slows down parsing
+    tracemalloc.start()
+    consume(parsers[parser](dat_file))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return num_records, min(seconds), peak / 1024 ** 2
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("dat_file",
+                        nargs="?",
+                        help="DAT file to parse",
+                        default=str(BUILD_DIR / "tests" / "fixtures" / "hla_3260_sample.imgt"))
+
+    parser.add_argument("-n", "--repeat",
+                        help="Number of timed runs of each parser, the best is reported",
+                        type=int,
+                        default=3)
+
+    args = parser.parse_args()
+
+    rows = [["parser", "records", "seconds", "records_per_second", "peak_mb"]]
+
+    for name in parsers:
+        num_records, seconds, peak_mb = benchmark(name, args.dat_file, args.repeat)
+        rows.append([name, num_records, round(seconds, 3), round(num_records / seconds), round(peak_mb, 1)])
+
+    with open(RESULTS_PATH, "w") as f:
+        for row in rows:
+            f.write("\t".join(str(value) for value in row) + "\n")
+
+    print(open(RESULTS_PATH).read(), end="")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""Times the conversion of the seqann features of real alleles into
+all_features rows, measures the memory held by the rows and times the
+pickling of each allele's rows, as they are sent from the build workers to
+the writer: FeatureRecord against the same class without __slots__, dict
+rows built from the feature attributes and dict rows parsed from the string
+representation, as the build did before FeatureRecord. Writes
+feature-record-benchmark.tsv.
+
+Usage: python3 feature-record-benchmark.py [hla.RELEASE.dat] [--alleles N] [--repeat N]
+
+The features are those of the DAT records, with the terms, ranks and
+sequences the annotation returns for them. Accessions are numbered per
+distinct feature as the feature service does. Defaults to the DAT sample
+used by the parity test, whose alleles are repeated up to --alleles, use a
+release DAT file for representative numbers.
+"""
+import ast
+import sys
+import pickle
+import time
+import argparse
+import tracemalloc
+from itertools import cycle, islice
+from pathlib import Path
+from seqann.feature_client.models.feature import Feature
+
+BUILD_DIR = Path(__file__).parents[1] / "pipeline" / "jobs" / "build"
+sys.path.insert(0, str(BUILD_DIR / "src"))
+
+import imgt_dat
+from records import FeatureRecord
+
+RESULTS_PATH = "feature-record-benchmark.tsv"
+FIXTURE_DAT = BUILD_DIR / "tests" / "fixtures" / "hla_3260_sample.imgt"
+IMGT_RELEASE = "3.26.0"
+
+# FeatureRecord with an instance __dict__, to measure what __slots__ saves
+NoSlotsFeatureRecord = type("NoSlotsFeatureRecord", (), {
+    **{k: v for k, v in vars(FeatureRecord).items() if k not in FeatureRecord.__slots__ + ("__slots__",)},
+    "__module__": __name__})
+
+
+def literal_eval_rows(alleles):
+    rows = []
+    for allele_keys, features in alleles:
+        for feature in features:
+            row = ast.literal_eval(str(feature).replace('\'', '"').replace('\n', ''))
+            row.update(allele_keys)
+            rows.append(row)
+    return rows
+
+
+def dict_rows(alleles):
+    rows = []
+    for allele_keys, features in alleles:
+        for feature in features:
+            rows.append({
+                "accession": feature.accession,
+                "hash_code": feature.hash_code,
+                "locus": feature.locus,
+                "rank": feature.rank,
+                "sequence": feature.sequence,
+                "term": feature.term,
+                **allele_keys,
+            })
+    return rows
+
+
+def record_rows(alleles, record_class=FeatureRecord):
+    rows = []
+    for allele_keys, features in alleles:
+        for feature in features:
+            row = record_class.from_seqann(feature)
+            row.gfe_name = allele_keys["gfe_name"]
+            row.allele_id = allele_keys["allele_id"]
+            row.hla_name = allele_keys["hla_name"]
+            row.imgt_release = allele_keys["imgt_release"]
+            rows.append(row)
+    return rows
+
+
+converters = {
+    "literal_eval": literal_eval_rows,
+    "dict": dict_rows,
+    "FeatureRecord_no_slots": lambda alleles: record_rows(alleles, NoSlotsFeatureRecord),
+    "FeatureRecord": record_rows,
+}
+
+
+def allele_features(record, accessions):
+    """seqann features of the UTRs, exons and introns of a DAT record"""
+
+    locus = record.description.split(",")[0].split("*")[0]
+    parts = [f for f in record.features if f.type in ["UTR", "exon", "intron"] and f.location is not None]
+
+    features = []
+    for i, f in enumerate(parts):
+        if f.type == "UTR":
+            term, rank = ("five_prime_UTR" if i == 0 else "three_prime_UTR"), 1
+        else:
+            term, rank = f.type, int(f.qualifiers.get("number", ["1"])[0])
+        sequence = str(f.location.extract(record.seq))
+        accession = accessions.setdefault((locus, term, rank, sequence), len(accessions) + 1)
+        features.append(Feature(
+            locus=locus, term=term, rank=rank, accession=accession, sequence=sequence, hash_code=None))
+
+    return features
+
+
+def make_alleles(dat_file, num_alleles):
+    """(foreign keys, features) of `num_alleles` alleles of the DAT file,
+    repeating its records if it has fewer"""
+
+    accessions = {}
+    alleles = []
+
+    for record in islice(cycle(list(imgt_dat.parse(dat_file))), num_alleles):
+        features = allele_features(record, accessions)
+        locus = record.description.split(",")[0].split("*")[0]
+        allele_keys = {
+            # Workshop number and feature accessions, like a GFE name
+            "gfe_name": f'{locus}w{len(alleles)}' + "".join(f'-{feature.accession}' for feature in features),
+            "allele_id": record.id,
+            "hla_name": record.description.split(",")[0],
+            "imgt_release": IMGT_RELEASE,
+        }
+        alleles.append((allele_keys, features))
+
+    return alleles
+
+
+def benchmark(converter, alleles, repeat):
+    """Returns (best seconds, MB held by the rows, best seconds to pickle
+    and unpickle the rows of each allele, MB pickled) of a converter"""
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        converters[converter](alleles)
+        seconds.append(time.perf_counter() - start)
+
+    # Measured separately, tracemalloc slows down the conversion. The
+    # features are allocated before tracing, only the rows are counted.
+    tracemalloc.start()
+    rows = converters[converter](alleles)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+
+    batches = [converters[converter]([allele]) for allele in alleles]
+    pickle_seconds = []
+    for _ in range(repeat):
+        pickled = 0
+        start = time.perf_counter()
+        for batch in batches:
+            data = pickle.dumps(batch)
+            pickle.loads(data)
+            pickled += len(data)
+        pickle_seconds.append(time.perf_counter() - start)
+
+    return min(seconds), held / 1024 ** 2, min(pickle_seconds), pickled / 1024 ** 2
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("dat_file",
+                        help="DAT file of the alleles",
+                        nargs="?",
+                        default=str(FIXTURE_DAT))
+
+    parser.add_argument("-a", "--alleles",
+                        help="Number of alleles whose features are converted",
+                        type=int,
+                        default=5000)
+
+    parser.add_argument("-n", "--repeat",
+                        help="Number of timed runs of each conversion, the best is reported",
+                        type=int,
+                        default=3)
+
+    args = parser.parse_args()
+
+    alleles = make_alleles(args.dat_file, args.alleles)
+    num_features = sum(len(features) for _, features in alleles)
+
+    rows = [["rows", "alleles", "features", "seconds", "features_per_second", "held_mb", "bytes_per_row",
+             "pickle_seconds", "pickled_mb"]]
+
+    for name in converters:
+        seconds, held_mb, pickle_seconds, pickled_mb = benchmark(name, alleles, args.repeat)
+        rows.append([
+            name, len(alleles), num_features, round(seconds, 3), round(num_features / seconds),
+            round(held_mb, 1), round(held_mb * 1024 ** 2 / num_features),
+            round(pickle_seconds, 3), round(pickled_mb, 1)])
+
+    with open(RESULTS_PATH, "w") as f:
+        for row in rows:
+            f.write("\t".join(str(value) for value in row) + "\n")
+
+    print(open(RESULTS_PATH).read(), end="")
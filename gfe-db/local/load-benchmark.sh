@@ -0,0 +1,51 @@
+#!/bin/bash -eu
+
+# Times load.cyp for a release against a local Neo4j container
+# Usage: bash load-benchmark.sh <release> <csv dir> [load.cyp path]
+
+RELEASE=$1
+CSV_DIR=$(cd "$2" && pwd)
+CYPHER_DIR=$(cd "$(dirname "$0")/../database/neo4j/cypher" && pwd)
+LOAD_CYPHER=${3:-$CYPHER_DIR/load.cyp}
+CONTAINER_NAME=gfe-db-load-benchmark
+NEO4J_PASSWORD=benchmark
+RESULTS_PATH=load-benchmark.$RELEASE.tsv
+
+docker rm --force $CONTAINER_NAME > /dev/null 2>&1 || true
+
+docker run --detach --rm \
+    --name $CONTAINER_NAME \
+    --platform=linux/amd64 \
+    --env NEO4J_AUTH=neo4j/$NEO4J_PASSWORD \
+    --env NEO4J_PLUGINS='["apoc"]' \
+    --volume="$CSV_DIR":/import \
+    neo4j:5.15.0 > /dev/null
+
+cleanup() {
+    docker rm --force $CONTAINER_NAME > /dev/null 2>&1 || true
+}
+trap cleanup EXIT
+
+cypher() {
+    docker exec --interactive $CONTAINER_NAME cypher-shell -u neo4j -p $NEO4J_PASSWORD "$@"
+}
+
+echo "Waiting for Neo4j..."
+until echo "RETURN 1;" | cypher > /dev/null 2>&1; do
+    sleep 2
+done
+
+cypher < "$CYPHER_DIR/init.cyp"
+
+echo "Loading release $RELEASE with $LOAD_CYPHER"
+start=$(date +%s.%N)
+sed "s/RELEASE/$RELEASE/g" "$LOAD_CYPHER" | cypher --format plain > /dev/null
+end=$(date +%s.%N)
+seconds=$(echo "$end - $start" | bc)
+
+counts=$(echo "MATCH (n) WITH count(n) AS nodes MATCH ()-[r]->() RETURN nodes, count(r) AS relationships;" \
+    | cypher --format plain | tail -n 1)
+
+echo -e "release\tload_cypher\tseconds\tnodes, relationships" > $RESULTS_PATH
+echo -e "$RELEASE\t$(basename "$LOAD_CYPHER")\t$seconds\t$counts" >> $RESULTS_PATH
+cat $RESULTS_PATH
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Times the sequence hashing of a build: the original
+`str(int(md5(seq).hexdigest(), 16))[:n]` against seq_hasher, with and
+without its cache, and seq_hasher_batch. Writes seq-hasher-benchmark.tsv.
+
+The sequences repeat as in a release build: each allele sequence is hashed
+twice, features and CDS sequences are shared between alleles.
+
+Usage: python3 seq-hasher-benchmark.py [--alleles N] [--repeat N]
+"""
+import sys
+import time
+import random
+import hashlib
+import argparse
+from pathlib import Path
+
+BUILD_DIR = Path(__file__).parents[1] / "pipeline" / "jobs" / "build"
+sys.path.insert(0, str(BUILD_DIR / "src"))
+
+from hashing import md5_id, cached_md5_id, seq_hasher, seq_hasher_batch
+
+RESULTS_PATH = "seq-hasher-benchmark.tsv"
+
+
+def md5_hex_hasher(seqs, n=32):
+    return [str(int(hashlib.md5(seq).hexdigest(), 16))[:n] for seq in seqs]
+
+
+def uncached_hasher(seqs, n=32):
+    return [md5_id(seq, n) for seq in seqs]
+
+
+def cached_hasher(seqs, n=32):
+    return [seq_hasher(seq, n) for seq in seqs]
+
+
+hashers = {
+    "md5_hex": md5_hex_hasher,
+    "seq_hasher_uncached": uncached_hasher,
+    "seq_hasher": cached_hasher,
+    "seq_hasher_batch": seq_hasher_batch,
+}
+
+
+def random_sequence(length, alphabet="ACGT"):
+    return "".join(random.choices(alphabet, k=length)).encode("utf-8")
+
+
+def make_sequences(num_alleles, variants=20):
+    """Sequences hashed for `num_alleles` alleles of one locus. Each feature
+    and CDS has `variants` distinct sequences shared by the alleles."""
+
+    random.seed(0)
+    features = [[random_sequence(random.randint(30, 600)) for _ in range(variants)] for _ in range(17)]
+    cds = [(random_sequence(1098), random_sequence(365, "ACDEFGHIKLMNPQRSTVWY")) for _ in range(variants)]
+
+    seqs = []
+    for _ in range(num_alleles):
+        allele_features = [random.choice(feature) for feature in features]
+        seq = b"".join(allele_features)
+        seqs += [seq, seq] + allele_features + list(random.choice(cds))
+
+    return seqs
+
+
+def benchmark(hasher, seqs, repeat):
+    """Returns (hashes, best seconds) of a hasher, starting each run with an
+    empty cache"""
+
+    seconds = []
+    for _ in range(repeat):
+        cached_md5_id.cache_clear()
+        start = time.perf_counter()
+        hashes = hashers[hasher](seqs)
+        seconds.append(time.perf_counter() - start)
+
+    return hashes, min(seconds)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-a", "--alleles",
+                        help="Number of alleles whose sequences are hashed",
+                        type=int,
+                        default=5000)
+
+    parser.add_argument("-n", "--repeat",
+                        help="Number of timed runs of each hasher, the best is reported",
+                        type=int,
+                        default=3)
+
+    args = parser.parse_args()
+
+    seqs = make_sequences(args.alleles)
+    results = {name: benchmark(name, seqs, args.repeat) for name in hashers}
+    expected, baseline = results["md5_hex"]
+
+    rows = [["hasher", "sequences", "distinct", "seconds", "sequences_per_second", "speedup"]]
+
+    for name, (hashes, seconds) in results.items():
+        if hashes != expected:
+            sys.exit(f'{name} returned different hashes than md5_hex')
+        rows.append([name, len(seqs), len(set(seqs)), round(seconds, 3), round(len(seqs) / seconds),
+                     round(baseline / seconds, 2)])
+
+    with open(RESULTS_PATH, "w") as f:
+        for row in rows:
+            f.write("\t".join(str(value) for value in row) + "\n")
+
+    print(open(RESULTS_PATH).read(), end="")
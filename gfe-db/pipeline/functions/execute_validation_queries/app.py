@@ -4,10 +4,13 @@ If USE_PRIVATE_SUBNET is true, this function will run inside a VPC and private s
 If USE_PRIVATE_SUBNET is false, this function will run outside a VPC and in a public subnet.
 """
 import os
+import time
+import random
+import asyncio
 import logging
 import json
 import boto3
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase, RoutingControl
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -16,6 +19,10 @@ AWS_REGION = os.environ["AWS_REGION"]
 STAGE = os.environ["STAGE"]
 APP_NAME = os.environ["APP_NAME"]
 
+# Number of releases whose ReleaseStats are cross-checked against a scan of
+# their relationships, 0 to only read ReleaseStats
+RELEASE_STATS_SAMPLE_SIZE = int(os.environ.get("RELEASE_STATS_SAMPLE_SIZE", "0"))
+
 # get neo4j uri and password from SSM Parameter Store
 session = boto3.session.Session(region_name=AWS_REGION)
 ssm = session.client("ssm")
@@ -29,36 +36,15 @@ logger.info(f"Found uri: {uri}")
 auth = json.loads(secrets.get_secret_value(SecretId=f'/{APP_NAME}/{STAGE}/{AWS_REGION}/Neo4jCredentials')["SecretString"])
 logger.info(f'Found auth: {auth["NEO4J_USERNAME"]}')
 
-logger.info(f"Connecting to Neo4j at {uri}")
-graphdb = GraphDatabase.driver(uri, auth=(auth["NEO4J_USERNAME"], auth["NEO4J_PASSWORD"]))
-
 # TODO get database name from SSM Parameter Store
 def lambda_handler(event, context):
 
     logger.info(json.dumps(event))
 
-    with graphdb as driver:
-
-        # node counts
-        node_counts = []
-        for node in nodes:
-            records, _, _ = driver.execute_query(f'MATCH (n:{node}) RETURN count(n) as count;', database_="gfedb")
-            node_counts.append({
-                "node": node,
-                "count": records[0].data()['count']
-            })
-
-        # HAS_IPD_ALLELE relationship releases property release counts
-        has_ipd_allele_release_counts = execute_query(driver, has_ipd_allele_release_counts_cql)
+    # The async driver is bound to the event loop of the invocation
+    payload = asyncio.run(run_validation(sample_size=RELEASE_STATS_SAMPLE_SIZE))
+    logger.info(f"Query latencies: {json.dumps(payload['latencies'])}")
 
-        # IPD_Accession node release counts
-        ipd_accession_release_counts = execute_query(driver, ipd_accession_release_counts_cql)
-
-    payload = {
-        "node_counts": node_counts,
-        "has_ipd_allele_release_counts": has_ipd_allele_release_counts,
-        "ipd_accession_release_counts": ipd_accession_release_counts
-    }
     return payload
 
 nodes = [
@@ -70,14 +56,37 @@ nodes = [
     "Submitter",
 ]
 
-has_ipd_allele_release_counts_cql = """MATCH (:GFE)-[r:HAS_IPD_ALLELE]->(:IPD_Allele)
-WITH r, apoc.coll.toSet(r.releases) as releases
-UNWIND toIntegerList(releases) as release_version
-RETURN DISTINCT release_version, count(release_version) as count
+# Node counts by label are read from the count store
+node_count_cql = """MATCH (n:{node}) RETURN count(n) as count;"""
+
+# One node per loaded release, maintained by load.cyp
+release_stats_cql = """MATCH (stats:ReleaseStats)
+RETURN stats.release as release, stats.imgt_release as imgt_release, stats.gfes as gfes, stats.alleles as alleles, stats.accessions as accessions
+ORDER BY release;"""
+
+# Full aggregations, only used for databases loaded before ReleaseStats.
+# Relationships are found by type without checking the labels of their nodes.
+# load.cyp keeps releases sorted and without duplicates.
+has_ipd_allele_release_counts_cql = """MATCH ()-[r:HAS_IPD_ALLELE]->()
+UNWIND r.releases as release
+RETURN toInteger(release) as release_version, count(*) as count
 ORDER BY release_version;"""
 
 ipd_accession_release_counts_cql = """MATCH ()-[r:HAS_IPD_ACCESSION]->() RETURN DISTINCT r.release as release_version, count(r.release) as count;"""
 
+# Counts of one release from its relationships, compared with its ReleaseStats
+release_stats_check_cql = """CALL {
+    MATCH (gfe:GFE)-[r:HAS_IPD_ALLELE]->()
+    WHERE $release IN r.releases
+    RETURN count(r) as alleles, count(DISTINCT gfe) as gfes
+}
+CALL {
+    MATCH ()-[r:HAS_IPD_ACCESSION]->()
+    WHERE r.release = $imgt_release
+    RETURN count(r) as accessions
+}
+RETURN gfes, alleles, accessions;"""
+
 # # too slow
 # node_counts_cql = """MATCH (gfe:GFE)
 # MATCH (ipd:IPD_Accession)
@@ -93,9 +102,122 @@ ipd_accession_release_counts_cql = """MATCH ()-[r:HAS_IPD_ACCESSION]->() RETURN
 #     count(f),
 #     count(sub);"""
 
-def execute_query(driver, query, database="gfedb"):
-    records, _, _ = driver.execute_query(query, database_=database)
-    return [record.data() for record in records]
+def validation_queries():
+    """Returns {name: (query, parameters)} of the independent validation queries"""
+
+    queries = { f"node_count:{node}": (node_count_cql.format(node=node), {}) for node in nodes }
+    queries["release_stats"] = (release_stats_cql, {})
+
+    return queries
+
+
+def release_counts(release_stats):
+    """Release counts in the shape of the full aggregations, from ReleaseStats"""
+
+    has_ipd_allele_release_counts = [
+        { "release_version": int(stats["release"]), "count": stats["alleles"] }
+        for stats in release_stats
+    ]
+    ipd_accession_release_counts = [
+        { "release_version": stats["imgt_release"], "count": stats["accessions"] }
+        for stats in release_stats
+    ]
+
+    return has_ipd_allele_release_counts, ipd_accession_release_counts
+
+
+async def execute_query(driver, query, parameters=None, database="gfedb"):
+    """Returns the records of a read query and its latency in seconds"""
+
+    start = time.perf_counter()
+    records, _, _ = await driver.execute_query(
+        query, parameters_=parameters, database_=database, routing_=RoutingControl.READ)
+    return [record.data() for record in records], round(time.perf_counter() - start, 3)
+
+
+async def execute_queries(driver, queries, database="gfedb"):
+    """Runs the queries concurrently, each on its own session, and returns
+    ({name: records}, {name: latency in seconds})"""
+
+    results = await asyncio.gather(*[
+        execute_query(driver, query, parameters, database) for query, parameters in queries.values()])
+
+    records = { name: result[0] for name, result in zip(queries, results) }
+    latencies = { name: result[1] for name, result in zip(queries, results) }
+
+    return records, latencies
+
+
+async def check_release_stats(driver, release_stats, sample_size, database="gfedb"):
+    """Compares the ReleaseStats of a random sample of releases with the
+    counts of their relationships. Returns (checks, latencies)."""
+
+    sample = random.sample(release_stats, min(sample_size, len(release_stats)))
+    queries = {
+        f"release_stats_check:{stats['release']}": (
+            release_stats_check_cql,
+            { "release": stats["release"], "imgt_release": stats["imgt_release"] })
+        for stats in sample
+    }
+
+    records, latencies = await execute_queries(driver, queries, database)
+
+    checks = []
+    for stats, actual in zip(sample, records.values()):
+        actual = actual[0]
+        mismatches = {
+            k: { "expected": stats[k], "actual": actual[k] }
+            for k in ["gfes", "alleles", "accessions"] if stats[k] != actual[k]
+        }
+        if mismatches:
+            logger.warning(f"ReleaseStats of release {stats['release']} do not match the graph: {json.dumps(mismatches)}")
+        checks.append({ "release": stats["release"], "is_valid": not mismatches, "mismatches": mismatches })
+
+    return checks, latencies
+
+
+async def run_validation(sample_size=0, database="gfedb"):
+    """Runs the validation queries and returns the payload of the function"""
+
+    start = time.perf_counter()
+
+    async with AsyncGraphDatabase.driver(uri, auth=(auth["NEO4J_USERNAME"], auth["NEO4J_PASSWORD"])) as driver:
+        logger.info(f"Connected to Neo4j at {uri}")
+
+        records, latencies = await execute_queries(driver, validation_queries(), database)
+        release_stats = records["release_stats"]
+
+        if release_stats:
+            has_ipd_allele_release_counts, ipd_accession_release_counts = release_counts(release_stats)
+        else:
+            logger.info("No ReleaseStats found, aggregating release counts from relationships")
+            counts, count_latencies = await execute_queries(driver, {
+                "has_ipd_allele_release_counts": (has_ipd_allele_release_counts_cql, {}),
+                "ipd_accession_release_counts": (ipd_accession_release_counts_cql, {}),
+            }, database)
+            latencies.update(count_latencies)
+            has_ipd_allele_release_counts = counts["has_ipd_allele_release_counts"]
+            ipd_accession_release_counts = counts["ipd_accession_release_counts"]
+
+        payload = {
+            "node_counts": [
+                { "node": node, "count": records[f"node_count:{node}"][0]["count"] }
+                for node in nodes
+            ],
+            "has_ipd_allele_release_counts": has_ipd_allele_release_counts,
+            "ipd_accession_release_counts": ipd_accession_release_counts,
+            "release_stats": release_stats,
+        }
+
+        if sample_size and release_stats:
+            payload["release_stats_check"], check_latencies = await check_release_stats(
+                driver, release_stats, sample_size, database)
+            latencies.update(check_latencies)
+
+    latencies["total"] = round(time.perf_counter() - start, 3)
+    payload["latencies"] = latencies
+
+    return payload
 
 if __name__ == "__main__":
     from pathlib import Path
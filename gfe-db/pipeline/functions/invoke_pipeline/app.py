@@ -71,6 +71,10 @@ def lambda_handler(event, context):
             except ValueError:
                 raise ValueError("limit must be an integer")
 
+            # shards is a positive integer, the number of Batch array jobs per release
+            if "shards" in event and not (event["shards"].isdecimal() and int(event["shards"]) >= 1):
+                raise ValueError("shards must be a positive integer")
+
             # release is a string that matches regex
             if not all(
                 [
@@ -3,10 +3,13 @@ import logging
 from datetime import datetime
 from dateutil import tz
 import re
+import csv
+import zlib
 import json
-import s3fs
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-import polars as pl
+from botocore.exceptions import ClientError
+from validation import ValidationEngine
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,8 +18,6 @@ STAGE = os.environ["STAGE"]
 APP_NAME = os.environ["APP_NAME"]
 AWS_REGION = os.environ["AWS_REGION"]
 
-fs = s3fs.S3FileSystem()
-
 session = boto3.Session(region_name=AWS_REGION)
 ssm = session.client("ssm")
 s3 = session.client("s3")
@@ -71,8 +72,8 @@ def lambda_handler(event, context):
         # continue
         raise e
 
-    # Validate that all expected files are present
-    if set(csv_file_objs.keys()) != set(release_report["expected_artifacts"]):
+    # Validate that all expected files are present, compressed or not
+    if set(csv_name(key) for key in csv_file_objs.keys()) != set(release_report["expected_artifacts"]):
         error_msg = f"CSV files do not match expected artifacts: {csv_dir}"
         logger.error(error_msg)
         release_report["errors"].append(error_msg)
@@ -81,69 +82,47 @@ def lambda_handler(event, context):
         errors.append(error_msg)
         # continue
 
-    for key, obj in csv_file_objs.items():
-        obj_errors = []
-
-        obj['data'] = pl.read_csv(f"s3://{data_bucket_name}/{csv_dir}/{key}", infer_schema_length=0)
-        obj["details"] = {}
-
-        # # Note: the state machine can now use existing CSV files as input, so the timestamp validation is no longer needed
-        # # Validate the file's timestamp is after the execution start time
-        # obj["details"]["is_valid_csv_timestamp"] = obj['created_utc'] > execution_start_time
-        # if not obj["details"]["is_valid_csv_timestamp"]:
-        #     error_msg = f"CSV file timestamp ({str(obj['created_utc'])}) preceeds execution start time ({execution_start_time}): {key}"
-        #     logger.error(error_msg)
-        #     obj_errors.append(error_msg)
-
-        # Validate the file name is correct
-        obj["details"]["is_valid_csv_filename"] = is_valid_csv_filename(key, release)
-        if not obj["details"]["is_valid_csv_filename"]:
-            error_msg = f"CSV file name is incorrect: {key}"
-            logger.error(error_msg)
-            obj_errors.append(error_msg)
-
-        # Validate the headers are correct
-        obj["details"]["is_valid_csv_header"] = set(obj['data'].columns) == set(csv_headers[key.split('.')[0]])
-        if not obj["details"]["is_valid_csv_header"]:
-            error_msg = f"CSV file headers are incorrect: {key}\n\tExpected: {csv_headers[key.split('.')[0]]}\n\tActual: {obj['data'].columns}"
-            logger.error(error_msg)
-            obj_errors.append(error_msg)
-
-        # Validate rows are present
-        obj["details"]["is_valid_csv_rows"] = obj['data'].shape[0] > 0
-        if not obj["details"]["is_valid_csv_rows"]:
-            error_msg = f"CSV file has no rows: {key}"
+    # The manifest is written by the build job after all CSVs, with their row
+    # counts, sizes and checksums
+    manifest = read_manifest(data_bucket_name, f"data/{release}/manifest.json")
+    release_report["manifest"] = {k: v for k, v in (manifest or {}).items() if k != "files"} or None
+
+    # Deep checks stream every file once: dtypes, required values, sequence IDs,
+    # GFE name references and row counts against the build manifest
+    engine = ValidationEngine(
+        s3,
+        data_bucket_name,
+        csv_dir,
+        release,
+        manifest=manifest,
+        limit=event['input'].get('LIMIT'))
+    release_report["checks"] = engine.run(key for key in csv_file_objs.keys() if key.split('.')[0] in csv_headers)
+
+    # Files are validated concurrently from their header and the row counts of
+    # the engine's pass, so no file is streamed a second time
+    with ThreadPoolExecutor(max_workers=max(len(csv_file_objs), 1)) as executor:
+        results = executor.map(
+            lambda item: validate_csv(item[0], item[1], release, csv_dir, manifest, engine.num_rows),
+            csv_file_objs.items())
+
+        for obj_report, obj_errors in results:
+            if obj_errors:
+                errors.extend(obj_errors)
+
+            release_report["details"].append(obj_report)
+            if obj_errors:
+                release_report["errors"].append(obj_errors)
+
+    for check in release_report["checks"]:
+        if not check["is_valid"]:
+            error_msg = f"Validation check failed: {check['check']} ({check['failures']} failures)"
             logger.error(error_msg)
-            obj_errors.append(error_msg)
+            release_report["errors"].append(error_msg)
+            errors.append(error_msg)
 
-        # TODO get the expected total number of rows from hla.dat and validate the row count against that
-        # # # Validate expected number of rows and replace is_valid_csv_rows
-        # obj["details"]["is_valid_csv_num_rows"] = None
-
-        # TODO Validate the data types of each column
-        # # # Validate data types
-        # obj["details"]["is_valid_csv_data_types"] = None
-
-        obj_report = {
-            "schema": key.split('.')[0],
-            "release": release,
-            "file_path": f"s3://{data_bucket_name}/{csv_dir}/{key}",
-            "cols": obj['data'].columns,
-            "num_rows": len(obj['data']),
-            **{k: v.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]+"Z" if isinstance(v, datetime) else v for k, v in obj.items() if k != 'data'},
-            "num_errors": len(obj_errors),
-            "is_valid_csv": all(obj["details"].values()),
-        }
-        if obj_errors:
-            obj_report["errors"] = obj_errors
-            obj_report["num_errors"] = len(obj_errors)
-            errors.extend(obj_errors)
-
-        release_report["details"].append(obj_report)
-        if obj_errors:
-            release_report["errors"].append(obj_errors)
-
-    release_report["is_valid_build"] = all([obj_report["is_valid_csv"] for obj_report in release_report["details"]])
+    release_report["is_valid_build"] = \
+        all([obj_report["is_valid_csv"] for obj_report in release_report["details"]]) and \
+        all([check["is_valid"] for check in release_report["checks"]])
     # reports.append(release_report)
 
     logger.info(json.dumps(release_report))
@@ -160,21 +139,120 @@ def lambda_handler(event, context):
 
     return payload
 
+def validate_csv(key, obj, release, csv_dir, manifest=None, num_rows=None):
+    """Validates one CSV from its header, its row count in `num_rows` (rows
+    per schema counted by ValidationEngine) and its size against the build
+    manifest. Returns the object report and its errors."""
+
+    obj_errors = []
+    s3_key = f"{csv_dir}/{key}"
+
+    obj["cols"] = read_csv_header(data_bucket_name, s3_key)
+    obj["num_rows"] = (num_rows or {}).get(key.split('.')[0], 0)
+    obj["details"] = {}
+
+    # # Note: the state machine can now use existing CSV files as input, so the timestamp validation is no longer needed
+    # # Validate the file's timestamp is after the execution start time
+    # obj["details"]["is_valid_csv_timestamp"] = obj['created_utc'] > execution_start_time
+    # if not obj["details"]["is_valid_csv_timestamp"]:
+    #     error_msg = f"CSV file timestamp ({str(obj['created_utc'])}) preceeds execution start time ({execution_start_time}): {key}"
+    #     logger.error(error_msg)
+    #     obj_errors.append(error_msg)
+
+    # Validate the file name is correct
+    obj["details"]["is_valid_csv_filename"] = is_valid_csv_filename(key, release)
+    if not obj["details"]["is_valid_csv_filename"]:
+        error_msg = f"CSV file name is incorrect: {key}"
+        logger.error(error_msg)
+        obj_errors.append(error_msg)
+
+    # Validate the headers are correct
+    obj["details"]["is_valid_csv_header"] = set(obj["cols"]) == set(csv_headers.get(key.split('.')[0], []))
+    if not obj["details"]["is_valid_csv_header"]:
+        error_msg = f"CSV file headers are incorrect: {key}\n\tExpected: {csv_headers.get(key.split('.')[0])}\n\tActual: {obj['cols']}"
+        logger.error(error_msg)
+        obj_errors.append(error_msg)
+
+    # Validate rows are present
+    obj["details"]["is_valid_csv_rows"] = obj["num_rows"] > 0
+    if not obj["details"]["is_valid_csv_rows"]:
+        error_msg = f"CSV file has no rows: {key}"
+        logger.error(error_msg)
+        obj_errors.append(error_msg)
+
+    # Validate the size against the manifest, which needs only the object listing.
+    # The manifest has the size of the uncompressed file.
+    if manifest is not None and not key.endswith(".gz"):
+        expected_size = manifest["files"].get(key.split('.')[0], {}).get("bytes")
+        obj["details"]["is_valid_csv_size"] = expected_size == obj["size"]
+        if not obj["details"]["is_valid_csv_size"]:
+            error_msg = f"CSV file size does not match the build manifest: {key}\n\tExpected: {expected_size}\n\tActual: {obj['size']}"
+            logger.error(error_msg)
+            obj_errors.append(error_msg)
+
+    # Row counts against hla.dat, checksums and column data types are validated by ValidationEngine
+
+    obj_report = {
+        "schema": key.split('.')[0],
+        "release": release,
+        "file_path": f"s3://{data_bucket_name}/{s3_key}",
+        **{k: v.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]+"Z" if isinstance(v, datetime) else v for k, v in obj.items()},
+        "num_errors": len(obj_errors),
+        "is_valid_csv": all(obj["details"].values()),
+    }
+    if obj_errors:
+        obj_report["errors"] = obj_errors
+        obj_report["num_errors"] = len(obj_errors)
+
+    return obj_report, obj_errors
+
+
+def read_csv_header(bucket_name: str, key: str, chunk_size: int = 64 * 1024) -> list:
+    """Returns the column names of a CSV in S3 using ranged reads of its
+    first bytes, decompressing them for .gz files"""
+
+    raw = b""
+    head = b""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if key.endswith(".gz") else None
+
+    while b"\n" not in head:
+        try:
+            chunk = s3.get_object(
+                Bucket=bucket_name,
+                Key=key,
+                Range=f"bytes={len(raw)}-{len(raw) + chunk_size - 1}",
+            )["Body"].read()
+        except ClientError as e:
+            # Ranges past the end of the object, including empty objects
+            if e.response["Error"]["Code"] != "InvalidRange":
+                raise e
+            break
+        raw += chunk
+        head += decompressor.decompress(chunk) if decompressor else chunk
+        if len(chunk) < chunk_size:
+            break
+
+    line = head.split(b"\n")[0].decode("utf-8").rstrip("\r")
+
+    return next(csv.reader([line]), [])
+
+
 # TODO implement Pydantic classes for managing and validating CSV schemas
 # Schema map
 csv_headers = {
-    "all_cds": ["gfe_name", "bp_seq_id", "bp_sequence", "aa_seq_id", "aa_sequence"],
+    "all_cds": ["gfe_name", "bp_seq_id", "aa_seq_id"],
     "all_features": [
         "accession",
         "hash_code",
         "locus",
         "rank",
-        "sequence",
+        "seq_id",
         "term",
         "gfe_name",
         "allele_id",
         "hla_name",
         "imgt_release",
+        "feature_id",
     ],
     "all_groups": [
         "gfe_name",
@@ -191,15 +269,33 @@ csv_headers = {
         "locus",
         "hla_name",
         "seq_id",
-        "sequence",
         "length",
         "imgt_release",
     ],
+    "sequences": ["seq_id", "sequence"],
 }
 
 
+def csv_name(key):
+    """File name of a CSV without the .gz extension of compressed uploads"""
+    name = key.split("/")[-1]
+    return name[:-len(".gz")] if name.endswith(".gz") else name
+
+
 def is_valid_csv_filename(key, release):
-    return re.match(re.compile(f'^{key.split("/")[-1].split(".")[0]}.{release}.csv$'), key.split("/")[-1]) is not None
+    return re.match(re.compile(f'^{key.split("/")[-1].split(".")[0]}.{release}.csv(.gz)?$'), key.split("/")[-1]) is not None
+
+
+def read_manifest(bucket_name: str, key: str):
+    """Returns the build manifest or None for builds that did not write one"""
+
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=key)["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ["NoSuchKey", "AccessDenied"]:
+            raise e
+        logger.warning(f"No build manifest found at s3://{bucket_name}/{key}")
+        return None
 
 
 def list_s3_objects(bucket_name: str, prefix: str) -> list:
@@ -209,7 +305,7 @@ def list_s3_objects(bucket_name: str, prefix: str) -> list:
             Bucket=bucket_name,
             Prefix=prefix,
     )['Contents']
-    return { obj['Key'].split('/')[-1]: {"created_utc": obj['LastModified']} for obj in objs }
+    return { obj['Key'].split('/')[-1]: {"created_utc": obj['LastModified'], "size": obj['Size']} for obj in objs }
 
 # Needed to serialize datetime objects in JSON responses
 class DatetimeEncoder(json.JSONEncoder):
@@ -0,0 +1,209 @@
+"""Runs the build output validation against release CSVs in a moto S3
+stand-in: ranged header reads, the streaming ValidationEngine over plain and
+gzip objects, and the reconciliation with the build manifest.
+
+    pip install -r requirements.txt
+    python3 -m pytest test_validate_build_output.py
+"""
+import os
+import io
+import csv
+import sys
+import gzip
+import json
+import importlib
+from hashlib import sha256
+from pathlib import Path
+import boto3
+import pytest
+from moto import mock_aws
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from validation import seq_hasher
+
+BUCKET = "gfe-bucket"
+RELEASE = "3510"
+GROUPS = ["G", "lg", "lgx"]
+CSV_DIR = f"data/{RELEASE}/csv"
+EVENT = {
+    "execution_id": "test",
+    "execution_start_time": "2026-01-01T00:00:00.000Z",
+    "input": {"RELEASES": RELEASE, "LIMIT": ""},
+}
+
+
+def release_csvs(num_alleles=10):
+    """Contents of valid build CSVs, {schema: CSV text}"""
+
+    tables = {
+        "gfe_sequences": [["gfe_name", "acc_name", "locus", "hla_name", "seq_id", "length", "imgt_release"]],
+        "all_features": [["accession", "hash_code", "locus", "rank", "seq_id", "term", "gfe_name", "allele_id",
+                          "hla_name", "imgt_release", "feature_id"]],
+        "all_groups": [["gfe_name", "allele_id", "hla_name", "ard_id", "ard_name", "locus", "imgt_release"]],
+        "all_cds": [["gfe_name", "bp_seq_id", "aa_seq_id"]],
+        "sequences": [["seq_id", "sequence"]],
+    }
+    sequences = {}
+
+    def seq_id(sequence):
+        sequences[seq_hasher(sequence.encode("utf-8"))] = sequence
+        return seq_hasher(sequence.encode("utf-8"))
+
+    for i in range(num_alleles):
+        gfe_name, allele_id, hla_name = f'HLA-Aw{i}-1-1', f'HLA{i:05d}.1', f'HLA-A*01:{i:02d}'
+        sequence = "ACGT" * (i + 3)
+        tables["gfe_sequences"].append([gfe_name, allele_id, "HLA-A", hla_name, seq_id(sequence), len(sequence), "3.51.0"])
+        for rank in [1, 2]:
+            tables["all_features"].append(["1", "none", "HLA-A", rank, seq_id("GG" * rank), "exon", gfe_name, allele_id,
+                                           hla_name, "3.51.0", seq_hasher(f'HLA-A|{rank}|exon|1'.encode("utf-8"))])
+        for ard_name in GROUPS:
+            tables["all_groups"].append([gfe_name, allele_id, hla_name, f'{hla_name}{ard_name}', ard_name, "HLA-A", "3.51.0"])
+        tables["all_cds"].append([gfe_name, seq_id("ATG" * (i + 1)), seq_id("M" * (i + 1))])
+
+    tables["sequences"] += [[key, sequence] for key, sequence in sequences.items()]
+
+    contents = {}
+    for schema, rows in tables.items():
+        f = io.StringIO()
+        csv.writer(f, lineterminator="\n").writerows(rows)
+        contents[schema] = f.getvalue()
+
+    return contents
+
+
+def release_manifest(contents, num_alleles=10):
+    """Build manifest of the CSVs, as written by the build job"""
+
+    return {
+        "release": RELEASE,
+        "limit": None,
+        "groups": GROUPS,
+        "complete": True,
+        "dat_records": num_alleles,
+        "alleles_processed": num_alleles,
+        "alleles_failed": 0,
+        "files": {
+            schema: {
+                "file": f'{schema}.{RELEASE}.csv',
+                "rows": text.count("\n") - 1,
+                "bytes": len(text.encode("utf-8")),
+                "sha256": sha256(text.encode("utf-8")).hexdigest(),
+            }
+            for schema, text in contents.items()
+        },
+    }
+
+
+@pytest.fixture
+def s3():
+    os.environ.update(
+        AWS_DEFAULT_REGION="us-east-1",
+        AWS_REGION="us-east-1",
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        STAGE="test",
+        APP_NAME="gfe-db")
+
+    with mock_aws():
+        boto3.client("ssm").put_parameter(
+            Name="/gfe-db/test/us-east-1/DataBucketName", Value=BUCKET, Type="String")
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def app(s3):
+    # The Lambda creates its clients and reads the bucket name on import
+    import app
+    return importlib.reload(app)
+
+
+def upload_release(s3, contents, manifest, compress=False):
+    for schema, text in contents.items():
+        body = text.encode("utf-8")
+        key = f'{CSV_DIR}/{schema}.{RELEASE}.csv'
+        if compress:
+            body, key = gzip.compress(body), f'{key}.gz'
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+    s3.put_object(Bucket=BUCKET, Key=f'data/{RELEASE}/manifest.json', Body=json.dumps(manifest))
+
+
+def failed_checks(report):
+    return [check["check"] for check in report["checks"] if not check["is_valid"]]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_read_csv_header(app, s3, compress):
+    """Headers are read with ranged requests smaller than the header line"""
+
+    text = release_csvs()["all_features"]
+    body, key = text.encode("utf-8"), "header.csv"
+    if compress:
+        body, key = gzip.compress(body), "header.csv.gz"
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+    assert app.read_csv_header(BUCKET, key, chunk_size=16) == text.split("\n")[0].split(",")
+
+
+def test_read_csv_header_empty(app, s3):
+    s3.put_object(Bucket=BUCKET, Key="empty.csv", Body=b"")
+    assert app.read_csv_header(BUCKET, "empty.csv") == []
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_valid_build(app, s3, compress):
+    contents = release_csvs()
+    upload_release(s3, contents, release_manifest(contents), compress=compress)
+
+    report = app.lambda_handler(EVENT, None)
+
+    assert failed_checks(report) == []
+    assert report["is_valid_build"]
+    assert {detail["schema"]: detail["num_rows"] for detail in report["details"]} == \
+        {schema: text.count("\n") - 1 for schema, text in contents.items()}
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_checksum_mismatch(app, s3, compress):
+    contents = release_csvs()
+    manifest = release_manifest(contents)
+    manifest["files"]["all_cds"]["sha256"] = "0" * 64
+    upload_release(s3, contents, manifest, compress=compress)
+
+    report = app.lambda_handler(EVENT, None)
+
+    assert failed_checks(report) == ["checksums:manifest"]
+    assert not report["is_valid_build"]
+
+
+def test_group_rows(app, s3):
+    """all_groups must have a row per allele and group recorded in the
+    manifest"""
+
+    contents = release_csvs()
+    manifest = release_manifest(contents)
+    manifest["groups"] = ["G", "lg"]
+    upload_release(s3, contents, manifest)
+
+    report = app.lambda_handler(EVENT, None)
+
+    assert failed_checks(report) == ["alleles:rows"]
+    assert not report["is_valid_build"]
+
+
+def test_row_count_mismatch(app, s3):
+    """A CSV missing its last rows fails the manifest row count and checksum"""
+
+    contents = release_csvs()
+    manifest = release_manifest(contents)
+    contents["sequences"] = "".join(contents["sequences"].splitlines(keepends=True)[:-2])
+    upload_release(s3, contents, manifest)
+
+    report = app.lambda_handler(EVENT, None)
+
+    assert "row_counts:manifest" in failed_checks(report)
+    assert "checksums:manifest" in failed_checks(report)
+    assert not report["is_valid_build"]
@@ -0,0 +1,313 @@
+import csv
+import zlib
+import time
+import logging
+from hashlib import md5, blake2b, sha256
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Sequences and alignments are longer than the default field size limit
+csv.field_size_limit(2 ** 31 - 1)
+
+# Columns that must parse as integers
+int_columns = {
+    "gfe_sequences": ["length"],
+    "all_features": ["rank"],
+}
+
+# Columns that may be empty, all other columns must have a value
+nullable_columns = {
+    "all_groups": ["ard_id", "ard_name"],
+}
+
+# Columns whose value must be the hash of another column, {id column: sequence column}
+hashed_columns = {
+    "sequences": {"seq_id": "sequence"},
+}
+
+# Columns whose sequence ID must exist in sequences
+sequence_references = {
+    "gfe_sequences": ["seq_id"],
+    "all_features": ["seq_id"],
+    "all_cds": ["bp_seq_id", "aa_seq_id"],
+}
+
+# Files whose gfe_name must exist in gfe_sequences
+gfe_name_references = ["all_features", "all_groups", "all_cds"]
+
+max_examples = 5
+
+
+def seq_hasher(seq, n=32):
+    """Same sequence ID as the build job"""
+    return str(int(md5(seq).hexdigest(), 16))[:n]
+
+
+def gunzip_chunks(chunks):
+    """Decompresses a stream of gzip chunks, including files of several
+    gzip members"""
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _key(value):
+    # Compact digest so the sets of GFE names and sequence IDs stay small
+    return blake2b(value.encode("utf-8"), digest_size=8).digest()
+
+
+class Check:
+    """Result of one validation check with its failure examples and the time
+    spent in it"""
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.examples = []
+        self.seconds = 0.0
+        self.skipped = None
+
+    def fail(self, example):
+        self.failures += 1
+        if len(self.examples) < max_examples:
+            self.examples.append(example)
+
+    def to_dict(self):
+        report = {
+            "check": self.name,
+            "is_valid": self.failures == 0,
+            "failures": self.failures,
+            "seconds": round(self.seconds, 3),
+        }
+        if self.examples:
+            report["examples"] = self.examples
+        if self.skipped:
+            report["skipped"] = self.skipped
+        return report
+
+
+class ValidationEngine:
+    """Streams the build CSVs of a release from S3 once each, checking column
+    types, required values, sequence IDs and references to sequences and
+    gfe_sequences, and reconciles the row counts and checksums with the build
+    manifest. Memory is bounded by one row per file plus compact sets of
+    sequence IDs and GFE names."""
+
+    def __init__(self, s3, bucket_name, csv_dir, release, manifest=None, limit=None):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.csv_dir = csv_dir
+        self.release = release
+        self.manifest = manifest
+        self.limit = limit
+        self.gfe_names = set()
+        self.seq_ids = set()
+        self.num_rows = {}
+        self.digests = {}
+        self.checks = []
+
+    def _check(self, name):
+        check = Check(name)
+        self.checks.append(check)
+        return check
+
+    def _lines(self, schema, key):
+        # Hashes the raw bytes while splitting them into lines, so the
+        # checksum costs no extra read. Compressed files are hashed after
+        # decompression, like the manifest.
+        body = self.s3.get_object(Bucket=self.bucket_name, Key=f"{self.csv_dir}/{key}")["Body"]
+        chunks = body.iter_chunks(chunk_size=1024 ** 2)
+        if key.endswith(".gz"):
+            chunks = gunzip_chunks(chunks)
+
+        digest = sha256()
+        num_bytes = 0
+        pending = b""
+
+        for chunk in chunks:
+            digest.update(chunk)
+            num_bytes += len(chunk)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode("utf-8")
+
+        if pending:
+            yield pending.decode("utf-8")
+
+        self.digests[schema] = {"bytes": num_bytes, "sha256": digest.hexdigest()}
+
+    def scan(self, key, collect_gfe_names=False, collect_seq_ids=False):
+        """Validates one CSV in a single streaming pass"""
+
+        schema = key.split(".")[0]
+        rows = csv.reader(self._lines(schema, key))
+        header = next(rows, [])
+        index = {col: i for i, col in enumerate(header)}
+
+        dtype_check = self._check(f"dtypes:{schema}")
+        not_null_check = self._check(f"not_null:{schema}")
+        hash_check = self._check(f"seq_id:{schema}") if schema in hashed_columns else None
+        ref_check = self._check(f"gfe_name_ref:{schema}") if schema in gfe_name_references else None
+        seq_ref_check = self._check(f"seq_id_ref:{schema}") if schema in sequence_references else None
+        unique_check = self._check(f"unique:{schema}") if collect_seq_ids else None
+
+        int_cols = [index[col] for col in int_columns.get(schema, []) if col in index]
+        required_cols = [(col, i) for col, i in index.items() if col not in nullable_columns.get(schema, [])]
+        hash_cols = [(index[id_col], index[seq_col]) for id_col, seq_col in hashed_columns.get(schema, {}).items()
+                     if id_col in index and seq_col in index]
+        gfe_col = index.get("gfe_name")
+        seq_id_col = index.get("seq_id")
+        seq_ref_cols = [(col, index[col]) for col in sequence_references.get(schema, []) if col in index]
+
+        num_rows = 0
+        for num_rows, row in enumerate(rows, start=1):
+
+            start = time.perf_counter()
+            if len(row) != len(header):
+                dtype_check.fail({"row": num_rows, "error": f"expected {len(header)} columns, found {len(row)}"})
+            else:
+                for i in int_cols:
+                    try:
+                        int(row[i])
+                    except ValueError:
+                        dtype_check.fail({"row": num_rows, "column": header[i], "value": row[i][:100]})
+            dtype_check.seconds += time.perf_counter() - start
+
+            if len(row) != len(header):
+                continue
+
+            start = time.perf_counter()
+            for col, i in required_cols:
+                if row[i] == "":
+                    not_null_check.fail({"row": num_rows, "column": col})
+            not_null_check.seconds += time.perf_counter() - start
+
+            if hash_check:
+                start = time.perf_counter()
+                for id_i, seq_i in hash_cols:
+                    if row[id_i] != seq_hasher(row[seq_i].encode("utf-8")):
+                        hash_check.fail({"row": num_rows, "column": header[id_i], "value": row[id_i]})
+                hash_check.seconds += time.perf_counter() - start
+
+            if collect_seq_ids and seq_id_col is not None:
+                start = time.perf_counter()
+                seq_key = _key(row[seq_id_col])
+                if seq_key in self.seq_ids:
+                    unique_check.fail({"row": num_rows, "seq_id": row[seq_id_col]})
+                self.seq_ids.add(seq_key)
+                unique_check.seconds += time.perf_counter() - start
+
+            if seq_ref_check:
+                start = time.perf_counter()
+                for col, i in seq_ref_cols:
+                    if _key(row[i]) not in self.seq_ids:
+                        seq_ref_check.fail({"row": num_rows, "column": col, "seq_id": row[i]})
+                seq_ref_check.seconds += time.perf_counter() - start
+
+            if collect_gfe_names and gfe_col is not None:
+                self.gfe_names.add(_key(row[gfe_col]))
+
+            if ref_check and gfe_col is not None:
+                start = time.perf_counter()
+                if _key(row[gfe_col]) not in self.gfe_names:
+                    ref_check.fail({"row": num_rows, "gfe_name": row[gfe_col]})
+                ref_check.seconds += time.perf_counter() - start
+
+        self.num_rows[schema] = num_rows
+
+    def reconcile(self):
+        """Compares the row counts and checksums with the manifest, the
+        processed alleles with the DAT records and the per-allele files with
+        gfe_sequences"""
+
+        check = self._check("row_counts:manifest")
+        start = time.perf_counter()
+
+        if self.manifest is None:
+            check.skipped = "No build manifest"
+        else:
+            for schema, num_rows in self.num_rows.items():
+                expected = self.manifest["files"].get(schema, {}).get("rows")
+                if expected != num_rows:
+                    check.fail({"file": schema, "expected": expected, "actual": num_rows})
+        check.seconds = time.perf_counter() - start
+
+        check = self._check("checksums:manifest")
+        start = time.perf_counter()
+        if self.manifest is None:
+            check.skipped = "No build manifest"
+        else:
+            for schema, digest in self.digests.items():
+                expected = self.manifest["files"].get(schema, {})
+                for k in ["bytes", "sha256"]:
+                    if k in expected and expected[k] != digest[k]:
+                        check.fail({"file": schema, k: {"expected": expected[k], "actual": digest[k]}})
+        check.seconds = time.perf_counter() - start
+
+        check = self._check("alleles:dat")
+        start = time.perf_counter()
+        if self.manifest is None:
+            check.skipped = "No build manifest"
+        elif self.limit or self.manifest.get("limit"):
+            check.skipped = "Build was limited"
+        elif self.manifest["alleles_processed"] != self.manifest["dat_records"]:
+            check.fail({
+                "expected": self.manifest["dat_records"],
+                "actual": self.manifest["alleles_processed"]
+            })
+        check.seconds = time.perf_counter() - start
+
+        check = self._check("alleles:rows")
+        start = time.perf_counter()
+        num_alleles = self.num_rows.get("gfe_sequences")
+        if "all_cds" in self.num_rows and self.num_rows["all_cds"] != num_alleles:
+            check.fail({"file": "all_cds", "expected": num_alleles, "actual": self.num_rows["all_cds"]})
+
+        # all_groups has a row per allele and ARD group of the build, older
+        # manifests do not record the groups
+        groups = (self.manifest or {}).get("groups")
+        if "all_groups" in self.num_rows and num_alleles is not None and groups \
+                and self.num_rows["all_groups"] != num_alleles * len(groups):
+            check.fail({"file": "all_groups", "expected": num_alleles * len(groups), "actual": self.num_rows["all_groups"]})
+        check.seconds = time.perf_counter() - start
+
+    def run(self, keys):
+        """Validates the CSVs and returns the check reports. sequences and
+        gfe_sequences are scanned first to collect the sequence IDs and GFE
+        names, the other files concurrently."""
+
+        start = time.time()
+        keys = list(keys)
+        sequence_keys = [key for key in keys if key.split(".")[0] == "sequences"]
+        gfe_keys = [key for key in keys if key.split(".")[0] == "gfe_sequences"]
+        other_keys = [key for key in keys if key not in sequence_keys + gfe_keys]
+
+        for key in sequence_keys:
+            self.scan(key, collect_seq_ids=True)
+
+        for key in gfe_keys:
+            self.scan(key, collect_gfe_names=True)
+
+        with ThreadPoolExecutor(max_workers=max(len(other_keys), 1)) as executor:
+            list(executor.map(self.scan, other_keys))
+
+        self.reconcile()
+
+        reports = [check.to_dict() for check in self.checks]
+        logger.info(f"Ran {len(reports)} checks on {len(keys)} files in {round(time.time() - start, 2)} seconds")
+
+        return reports
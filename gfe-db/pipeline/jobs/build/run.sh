@@ -34,8 +34,70 @@ if [[ -z "${MEM_PROFILE}" ]]; then
 	MEM_PROFILE=False
 fi
 
+if [[ -z "${WORKERS}" ]]; then
+	echo "WORKERS not set"
+	WORKERS=1
+fi
+
+if [[ -z "${SHARDS}" ]]; then
+	echo "SHARDS not set"
+	SHARDS=1
+fi
+
+if [[ -z "${MERGE_SHARDS}" ]]; then
+	MERGE_SHARDS=False
+fi
+
+if [[ -z "${IMPORT_CSV}" ]]; then
+	echo "IMPORT_CSV not set"
+	IMPORT_CSV=False
+fi
+
 echo "Found environment variables:"
-echo -e "GFE_BUCKET: $GFE_BUCKET\nRELEASES: $RELEASES\nALIGN: $ALIGN\nKIR: $KIR\nMEM_PROFILE: $MEM_PROFILE\nLIMIT: $LIMIT"
+echo -e "GFE_BUCKET: $GFE_BUCKET\nRELEASES: $RELEASES\nALIGN: $ALIGN\nKIR: $KIR\nMEM_PROFILE: $MEM_PROFILE\nWORKERS: $WORKERS\nSHARDS: $SHARDS\nIMPORT_CSV: $IMPORT_CSV\nLIMIT: $LIMIT"
+
+# Sharded builds run as an AWS Batch array job, each child builds one shard
+# of the DAT records and uploads part files under the parent job ID. The merge
+# job receives the parent job ID as BUILD_JOB_ID.
+if [ "$SHARDS" -gt 1 ]; then
+	SHARD_INDEX=${AWS_BATCH_JOB_ARRAY_INDEX:-0}
+	BUILD_JOB_ID=${BUILD_JOB_ID:-${AWS_BATCH_JOB_ID%%:*}}
+	if [[ -z "${BUILD_JOB_ID}" ]]; then
+		echo "BUILD_JOB_ID not set. Please specify the build job ID of the shards."
+		exit 1
+	fi
+	# Shards start at byte offsets of the DAT file, which only the lean parser reads
+	SHARD_FLAG="--shard $SHARD_INDEX/$SHARDS --dat-parser lean"
+	LOG_SUFFIX=".part$(printf '%04d' $SHARD_INDEX)"
+	echo "Sharded build: shard $SHARD_INDEX of $SHARDS for build job $BUILD_JOB_ID"
+else
+	SHARD_FLAG=""
+	LOG_SUFFIX=""
+fi
+
+# Builds resume from the checkpoint in S3 if a previous attempt was interrupted
+if [[ -z "${CHECKPOINT_INTERVAL}" ]]; then
+	CHECKPOINT_INTERVAL=5000
+fi
+
+# Build only some loci
+if [[ -z "${LOCI}" ]]; then
+	LOCI_FLAG=""
+else
+	echo "Building loci: $LOCI"
+	LOCI_FLAG="--loci $LOCI"
+fi
+
+# app.py names its logs, metrics and memory profiles after the part it builds
+# (part_name), so shards on the same host write separate files
+PART=""
+if [ "$SHARDS" -gt 1 ]; then
+	PART="part$(printf '%04d' $SHARD_INDEX)"
+fi
+if [[ -n "${LOCI}" ]]; then
+	PART="${PART:-part}-${LOCI//,/_}"
+fi
+PART_SUFFIX=${PART:+.$PART}
 
 # Check limit
 if [[ -z "${LIMIT}" ]]; then
@@ -67,8 +129,8 @@ fi
 if [ "$MEM_PROFILE" == "True" ]; then
 	echo "Memory profiling is set to $MEM_PROFILE."
 	MEM_PROFILE_FLAG="-p"
-	touch "$LOGS_DIR/mem_profile_agg.txt"
-	touch "$LOGS_DIR/mem_profile_diff.txt"
+	touch "$LOGS_DIR/mem_profile_rss$PART_SUFFIX.ndjson"
+	touch "$LOGS_DIR/mem_profile_diff$PART_SUFFIX.txt"
 else
 	MEM_PROFILE_FLAG=""
 fi
@@ -97,6 +159,82 @@ else
 	echo "Using Feature Service: ${FEATURE_SERVICE_URL}"
 fi
 
+# Parallel multipart transfers of the build files with checksum verification
+S3_TRANSFER="python3 $SRC_DIR/s3_transfer.py --workers ${TRANSFER_WORKERS:-4} --concurrency ${TRANSFER_CONCURRENCY:-10}"
+
+# CSVs are compressed while they are uploaded (gzip or none). Builds keep the
+# uncompressed files locally for checkpoints, merging and conversions.
+if [[ -z "${CSV_COMPRESSION}" ]]; then
+	CSV_COMPRESSION=gzip
+fi
+if [ "$CSV_COMPRESSION" == "gzip" ]; then
+	GZIP_FLAG="--gzip"
+else
+	GZIP_FLAG=""
+fi
+echo "CSV compression: $CSV_COMPRESSION"
+
+# Uploads a directory of CSVs, first removing objects of the other format so
+# a release never has both compressed and uncompressed copies
+upload_csv() {
+	if [ "$CSV_COMPRESSION" == "gzip" ]; then
+		aws s3 rm --recursive "$2" --exclude "*" --include "*.csv"
+	else
+		aws s3 rm --recursive "$2" --exclude "*" --include "*.csv.gz"
+	fi
+	$S3_TRANSFER upload "$1" "$2" $GZIP_FLAG "${@:3}"
+}
+
+# Base release to copy unchanged GFEs from
+if [[ -z "${BASE_RELEASE}" ]]; then
+	echo "No BASE_RELEASE set, building all GFEs from scratch"
+	BASE_RELEASE_FLAG=""
+else
+	echo "Reusing unchanged GFEs from base release $BASE_RELEASE"
+	mkdir -p "$DATA_DIR/$BASE_RELEASE/csv"
+	# Base releases built before the sequence table have no sequences CSV
+	for csv_name in gfe_sequences all_features sequences; do
+		if [ ! -f "$DATA_DIR/$BASE_RELEASE/csv/$csv_name.$BASE_RELEASE.csv" ]; then
+			$S3_TRANSFER download s3://$GFE_BUCKET/data/$BASE_RELEASE/csv/ "$DATA_DIR/$BASE_RELEASE/csv" \
+				--include "$csv_name.$BASE_RELEASE.csv*" --decompress || exit 1
+		fi
+	done
+	BASE_RELEASE_FLAG="-b $BASE_RELEASE"
+fi
+
+# Feature and GFE cache shared by all releases and runs
+FEATURE_CACHE_PATH="$DATA_DIR/cache/feature-cache.db"
+mkdir -p "$DATA_DIR/cache"
+if [ ! -f "$FEATURE_CACHE_PATH" ]; then
+	echo "Downloading feature cache from s3://$GFE_BUCKET/cache/feature-cache.db"
+	aws s3 cp s3://$GFE_BUCKET/cache/feature-cache.db "$FEATURE_CACHE_PATH" || echo "No feature cache found, building a new one"
+fi
+
+# Writes typed Parquet copies of the release CSVs and uploads them to S3.
+# The CSVs are the primary output, so a failure here is only a warning.
+upload_parquet() {
+	python3 "$SRC_DIR"/to_parquet.py \
+		-i "$DATA_DIR/$1/csv" \
+		-o "$DATA_DIR/$1/parquet" \
+		-r "$1" && \
+	$S3_TRANSFER upload "$DATA_DIR/$1/parquet" s3://$GFE_BUCKET/data/$1/parquet/ || \
+	echo "WARNING: Failed to write Parquet files for release $1"
+}
+
+# Writes node and relationship files for neo4j-admin import and uploads them
+# to S3. load_db.sh uses them for the first load into an empty database.
+upload_import() {
+	if [ "$IMPORT_CSV" != "True" ]; then
+		return
+	fi
+	python3 "$SRC_DIR"/to_import.py \
+		-i "$DATA_DIR/$1/csv" \
+		-o "$DATA_DIR/$1/import" \
+		-r "$1" && \
+	$S3_TRANSFER upload "$DATA_DIR/$1/import" s3://$GFE_BUCKET/data/$1/import/ $GZIP_FLAG || \
+	echo "WARNING: Failed to write import files for release $1"
+}
+
 # Build csv files
 RELEASES=$(echo "${RELEASES}" | sed s'/"//'g | sed s'/,/ /g')
 
@@ -105,14 +243,41 @@ for release in ${RELEASES}; do
 	release=$(echo "$release" | sed s'/,//g')
 	echo "Processing release: $release"
 
+	# Merge the part files of all shards into the release CSVs
+	if [ "$MERGE_SHARDS" == "True" ]; then
+		echo "Merging shards of build job $BUILD_JOB_ID for release $release"
+		mkdir -p "$DATA_DIR/$release/parts" "$DATA_DIR/$release/csv"
+		$S3_TRANSFER download s3://$GFE_BUCKET/data/$release/parts/$BUILD_JOB_ID/ "$DATA_DIR/$release/parts" --decompress || exit 1
+		python3 "$SRC_DIR"/merge_parts.py \
+			-i "$DATA_DIR/$release/parts" \
+			-o "$DATA_DIR/$release/csv" \
+			-r "$release" || exit 1
+		# The manifest is uploaded last, so it only exists for complete uploads
+		aws s3 rm s3://$GFE_BUCKET/data/$release/manifest.json
+		echo -e "Uploading CSVs to s3://$GFE_BUCKET/data/$release/csv/:\n$(ls $DATA_DIR/$release/csv/)"
+		upload_csv "$DATA_DIR/$release/csv" s3://$GFE_BUCKET/data/$release/csv/ || exit 1
+		aws s3 cp "$DATA_DIR/$release/manifest.json" s3://$GFE_BUCKET/data/$release/manifest.json
+		upload_parquet "$release"
+		upload_import "$release"
+		continue
+	fi
+
+	if [ "$SHARDS" -gt 1 ]; then
+		OUT_DIR="$DATA_DIR/$release/parts"
+		S3_OUT_DIR="s3://$GFE_BUCKET/data/$release/parts/$BUILD_JOB_ID/"
+	else
+		OUT_DIR="$DATA_DIR/$release/csv"
+		S3_OUT_DIR="s3://$GFE_BUCKET/data/$release/csv/"
+	fi
+
 	# Check if data directory exists
-	if [ ! -d "$DATA_DIR/$release/csv" ]; then
+	if [ ! -d "$OUT_DIR" ]; then
 		# TODO: get full path
-		echo "Creating new directory in root: $DATA_DIR/$release/csv..."
-		mkdir -p "$DATA_DIR/$release/csv"
+		echo "Creating new directory in root: $OUT_DIR..."
+		mkdir -p "$OUT_DIR"
 	else
 		# TODO: get full path
-		echo "CSV directory: $DATA_DIR/$release/csv"
+		echo "CSV directory: $OUT_DIR"
 	fi
 
     # Check if DAT file exists
@@ -135,11 +300,19 @@ for release in ${RELEASES}; do
 	
 	# Builds CSV files
 	python3 "$SRC_DIR"/app.py \
-		-o "$DATA_DIR/$release/csv" \
+		-o "$OUT_DIR" \
 		-r "$release" \
+		$SHARD_FLAG \
+		$LOCI_FLAG \
 		$KIRFLAG \
 		$ALIGNFLAG \
 		$MEM_PROFILE_FLAG \
+		-w $WORKERS \
+		-c "$FEATURE_CACHE_PATH" \
+		$BASE_RELEASE_FLAG \
+		--resume \
+		--checkpoint-interval $CHECKPOINT_INTERVAL \
+		--checkpoint-s3 "s3://$GFE_BUCKET/checkpoints/$release" \
 		-v \
 		-l $LIMIT \
 		-u $FEATURE_SERVICE_URL
@@ -157,15 +330,37 @@ for release in ${RELEASES}; do
     exit 1
     fi
 
+	# Shards would overwrite each other's uploads, so only full builds update the cache
+	if [ "$SHARDS" -gt 1 ]; then
+		echo "Sharded build, not uploading feature cache"
+	else
+		echo "Uploading feature cache to s3://$GFE_BUCKET/cache/feature-cache.db"
+		aws s3 cp "$FEATURE_CACHE_PATH" s3://$GFE_BUCKET/cache/feature-cache.db
+	fi
+
+	# The manifest is uploaded last, so it only exists for complete uploads
+	if [ "$SHARDS" -le 1 ]; then
+		aws s3 rm s3://$GFE_BUCKET/data/$release/manifest.json
+	fi
+
 	# TODO: Use this S3 hierarchy: root/release/csv | logs
-	echo -e "Uploading CSVs to s3://$GFE_BUCKET/data/$release/csv/:\n$(ls $DATA_DIR/$release/csv/)"
-	aws s3 --recursive cp "$DATA_DIR/$release/csv/" s3://$GFE_BUCKET/data/$release/csv/ > "$LOGS_DIR/s3Copy$$LOG_FILE"
-	mv "$LOGS_DIR/gfeBuildLogs.txt" "$LOGS_DIR/gfeBuildLogs.$release.txt"
-	mv "$LOGS_DIR/s3Copy$$LOG_FILE" "$LOGS_DIR/s3CopyLog.$release.txt"
+	echo -e "Uploading CSVs to $S3_OUT_DIR:\n$(ls $OUT_DIR/)"
+	upload_csv "$OUT_DIR" $S3_OUT_DIR --exclude "checkpoint.*" > "$LOGS_DIR/s3Copy$$LOG_FILE" || exit 1
+
+	# Shard manifests are uploaded with the part files, shards are converted after they are merged
+	if [ "$SHARDS" -le 1 ]; then
+		aws s3 cp "$DATA_DIR/$release/manifest.json" s3://$GFE_BUCKET/data/$release/manifest.json
+		upload_parquet "$release"
+		upload_import "$release"
+	fi
+
+	mv "$LOGS_DIR/gfeBuildLogs$PART_SUFFIX.txt" "$LOGS_DIR/gfeBuildLogs.$release$LOG_SUFFIX.txt"
+	mv "$LOGS_DIR/gfeBuildMetrics$PART_SUFFIX.json" "$LOGS_DIR/gfeBuildMetrics.$release$LOG_SUFFIX.json"
+	mv "$LOGS_DIR/s3Copy$$LOG_FILE" "$LOGS_DIR/s3CopyLog.$release$LOG_SUFFIX.txt"
 
 	if [ "$MEM_PROFILE" == "True" ]; then
-		mv "$LOGS_DIR/mem_profile_agg.txt" "$LOGS_DIR/mem_profile_agg.$release.txt"
-		mv "$LOGS_DIR/mem_profile_diff.txt" "$LOGS_DIR/mem_profile_diff.$release.txt"
+		mv "$LOGS_DIR/mem_profile_rss$PART_SUFFIX.ndjson" "$LOGS_DIR/mem_profile_rss.$release$LOG_SUFFIX.ndjson"
+		mv "$LOGS_DIR/mem_profile_diff$PART_SUFFIX.txt" "$LOGS_DIR/mem_profile_diff.$release$LOG_SUFFIX.txt"
 	fi
 
 	echo -e "Uploading logs to s3://$GFE_BUCKET/logs/$release/:\n$(ls $LOGS_DIR/)"
@@ -0,0 +1,47 @@
+#!/bin/bash
+
+# Builds one release locally as SHARDS processes in parallel and merges the
+# part files into the release CSVs, the same way the Batch array job does.
+# Usage: DATA_DIR=<data dir> AWS_REGION=<region> bash build_shards_local.sh <release> <shards> [app.py args]
+
+SRC_DIR=$(dirname "$0")/../src
+
+release=$1
+shards=$2
+shift 2
+
+if [[ -z "${release}" ]] || [[ -z "${shards}" ]]; then
+	echo "Usage: $0 <release> <shards> [app.py args]"
+	exit 1
+fi
+
+parts_dir="${DATA_DIR}/${release}/parts"
+mkdir -p "${parts_dir}" "${DATA_DIR}/${release}/csv"
+rm -f "${parts_dir}"/*.${release}.part*.csv
+
+# The shards share the pyard database of the release, it is created once
+# before they start instead of by every shard at the same time
+python3 -c "import sys; sys.path.insert(0, '${SRC_DIR}'); import pyard; from constants import pyard_data_dir; pyard.init('${release}', data_dir=pyard_data_dir, load_mac=False)" || exit 1
+
+pids=""
+for ((i = 0; i < shards; i++)); do
+	python3 "${SRC_DIR}/app.py" -o "${parts_dir}" -r "${release}" --shard "${i}/${shards}" --dat-parser lean "$@" &
+	pids="${pids} $!"
+done
+
+status=0
+for pid in ${pids}; do
+	wait ${pid}
+	exit_code=$?
+	# Exit code 2 means some alleles failed to build
+	if [ ${exit_code} -ne 0 ] && [ ${exit_code} -ne 2 ]; then
+		echo "Shard process ${pid} failed with exit code ${exit_code}"
+		status=1
+	fi
+done
+
+if [ ${status} -ne 0 ]; then
+	exit 1
+fi
+
+python3 "${SRC_DIR}/merge_parts.py" -i "${parts_dir}" -o "${DATA_DIR}/${release}/csv" -r "${release}"
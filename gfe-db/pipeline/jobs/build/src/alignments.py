@@ -0,0 +1,90 @@
+import os
+import mmap
+import json
+import logging
+from Bio import AlignIO
+
+logger = logging.getLogger()
+
+
+class AlignmentStore:
+    """Read-only store of aligned sequences for one alignment type.
+
+    Sequences are kept in a single memory-mapped blob on disk with an index of
+    {"HLA-name": [offset, length]}, so only the index is resident and each
+    sequence is read from the page cache when it is requested. Build the store
+    once per release and alignment type with `AlignmentStore.convert`."""
+
+    def __init__(self, blob_path, index_path):
+        self.blob_path = blob_path
+
+        with open(index_path, "r") as f:
+            self.index = json.load(f)
+
+        self._file = open(blob_path, "rb")
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(blob_path) > 0 else b""
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_bytes(self, name):
+        offset, length = self.index[name]
+        return self._blob[offset:offset + length]
+
+    def __getitem__(self, name):
+        return self.get_bytes(name).decode('ascii')
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+    @staticmethod
+    def paths(alignments_dir, align_type):
+        return f'{alignments_dir}/{align_type}.seq', f'{alignments_dir}/{align_type}.idx.json'
+
+    @classmethod
+    def convert(cls, msf_paths, alignments_dir, align_type):
+        """Converts MSF files into the blob and index for `align_type`. Only
+        one MSF file is parsed into memory at a time. Files that are already
+        newer than all of their MSF sources are reused."""
+
+        blob_path, index_path = cls.paths(alignments_dir, align_type)
+
+        if os.path.isfile(blob_path) and os.path.isfile(index_path):
+            built = min(os.path.getmtime(blob_path), os.path.getmtime(index_path))
+            if all(os.path.getmtime(msf) < built for msf in msf_paths):
+                logging.info(f'Using existing {align_type} alignment store {blob_path}')
+                return cls(blob_path, index_path)
+
+        index = {}
+        offset = 0
+
+        # Write to temporary paths so an interrupted conversion is never reused
+        with open(f'{blob_path}.tmp', "wb") as blob:
+            for msf in msf_paths:
+
+                logging.info(f'Converting {"/".join(msf.split("/")[-3:])}')
+                with open(msf) as f:
+                    align_data = AlignIO.read(f, "msf")
+
+                for a in align_data:
+                    seq = str(a.seq).encode('ascii')
+                    blob.write(seq)
+                    index["HLA-" + a.name] = [offset, len(seq)]
+                    offset += len(seq)
+
+                logging.info(f'{str(len(align_data))} alignments converted')
+                del align_data
+
+        with open(f'{index_path}.tmp', "w") as f:
+            json.dump(index, f)
+
+        os.replace(f'{blob_path}.tmp', blob_path)
+        os.replace(f'{index_path}.tmp', index_path)
+
+        return cls(blob_path, index_path)
@@ -5,14 +5,13 @@ import sys
 import logging
 import traceback
 import argparse
-import ast
 import time
+import multiprocessing
+from collections import deque
+from itertools import islice
 from datetime import datetime
 import json
-import hashlib
-from csv import DictWriter
 import boto3
-from Bio import AlignIO
 from Bio.SeqFeature import SeqFeature
 from Bio.SeqRecord import SeqRecord
 from seqann.models.annotation import Annotation
@@ -20,18 +19,30 @@ from Bio import SeqIO
 import pyard
 from seqann.gfe import GFE
 from constants import *
+from writers import CsvWriterRegistry
+from feature_cache import FeatureCache, checkpoint as checkpoint_feature_cache
+from base_release import BaseReleaseIndex
+from records import FeatureRecord
+from hashing import seq_hasher, seq_hasher_batch, feature_id
+from alignments import AlignmentStore
+from groups import GroupResolver
+from metrics import StageTimer, BuildMetrics, timed
+from profiling import MemoryProfiler
+from checkpoint import Checkpoint
+from manifest import build_manifest, write_manifest
+from sequences import SEQUENCES_CSV, SequenceTable, build_sequence
+from glob import glob
+import imgt_dat
 
 # TODO: Output logs as JSON
-# TODO: Add log_dir as environmental variable
 # TODO: Log numbering for each allele
 logger = logging.getLogger() # .addHandler(logging.StreamHandler(sys.stdout))
-log_dir = os.path.dirname(__file__) + "/../logs"
+log_dir = os.environ.get("LOGS_DIR", os.path.dirname(__file__) + "/../logs")
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S',
     level=logging.INFO,
-    handlers=[    
-        logging.FileHandler(f'{log_dir}/gfeBuildLogs.txt'),    
+    handlers=[
         logging.StreamHandler()
         ])
 
@@ -41,60 +52,31 @@ region = os.environ["AWS_REGION"]
 
 sqs = boto3.client('sqs', region_name=region)
 
-# Outputs memory of objects during execution to check for memory leaks
-if '-p' in sys.argv:
-    from pympler import tracker, muppy, summary
+# Wall time of each build stage for the current allele
+timer = StageTimer()
 
-    tr = tracker.SummaryTracker()
-
-    def memory_profiler(mode='all'):
-
-        # Print a summary of memory usage every n alleles
-        all_objects = muppy.get_objects()
-        obj_sum = summary.summarize(all_objects)
-
-        original_stdout = sys.stdout
-
-        if mode == 'all' or mode == 'agg':
-            with open(f"{log_dir}/mem_profile_agg.txt", "a+") as f:
-                sys.stdout = f
-                summary.print_(obj_sum)
-                sys.stdout = original_stdout;
-
-        if mode == 'all' or mode == 'diff':
-            with open(f"{log_dir}/mem_profile_diff.txt", "a+") as f:
-                sys.stdout = f
-                tr.print_diff()
-                sys.stdout = original_stdout;    
-
-        return
-
-
-def parse_dat(data_dir, dbversion):
+def parse_dat(data_dir, dbversion, dat_parser="biopython", start=0, end=None):
+    """Streams the alleles in hla.RELEASE.dat. The lean parser only reads the
+    fields used by the build and can start at a byte offset, the biopython
+    parser reads the full IMGT records."""
     
     try:
         logging.info("Parsing DAT file...")
         dat_file = ''.join([data_dir, '/hla.', dbversion, ".dat"])
         
-        return SeqIO.parse(dat_file, "imgt")
+        if dat_parser == "biopython":
+            return SeqIO.parse(dat_file, "imgt")
+
+        return imgt_dat.parse(dat_file, start=start, end=end)
     
     except Exception as err:
         logging.error(f'Could not parse file: {dat_file}: {err}')
         # raise err
 
 
-def seq_hasher(seq, n=32):
-    """Takes a nucleotide or amino acid sequence and returns a reproducible
-    integer UUID. Used to create shorter unique IDs since Neo4j cannot index 
-    a full sequence. Can be also be used for any string."""
-
-    m = hashlib.md5()
-    m.update(seq)
-
-    return str(int(m.hexdigest(), 16))[:n]
-
-
 def parse_hla_alignments(dbversion, align_type="gen"):
+    """Returns an `AlignmentStore` of all loci for `align_type`, converting
+    the MSF files on first use"""
     
     if align_type in ["gen", "genomic"]:
         align_type = "gen"
@@ -104,22 +86,12 @@ def parse_hla_alignments(dbversion, align_type="gen"):
         align_type = "prot"
     else:
         raise ValueError(f'Could not recognize align_type = "{align_type}"')
-        
-    alignment = {l: {} for l in hla_loci}
-    
-    for locus in hla_align:
-
-        msf = ''.join([data_dir, "/alignments/", locus.split("-")[1], f"_{align_type}.msf"])
-
-        logging.info(f'Loading {"/".join(msf.split("/")[-3:])}')
-        align_data = AlignIO.read(open(msf), "msf")
 
-        seq = {"HLA-" + a.name: str(a.seq) for a in align_data}
+    msf_paths = [''.join([data_dir, "/alignments/", locus.split("-")[1], f"_{align_type}.msf"]) for locus in hla_align]
 
-        del align_data
+    alignment = AlignmentStore.convert(msf_paths, f'{data_dir}/alignments', align_type)
 
-        logging.info(f'{str(len(seq))} protein alignments loaded')
-        alignment.update({locus: seq})
+    logging.info(f'{str(len(alignment))} {align_type} alignments loaded')
 
     return alignment
 
@@ -175,41 +147,9 @@ def get_cds(allele):
     return bp_seq, aa_seq
 
 
-# Streams dictionaries as rows to a file
-def append_dict_as_row(dict_row, file_path):
-
-    if not dict_row:
-        return
-
-    try:
-        header = list(dict_row.keys())
-
-        # Check if file exists
-        csv_file = Path(file_path)
-        if not csv_file.is_file():
-
-            # Create the file and add the header
-            with open(file_path, 'a+', newline='') as write_obj:
-                dict_writer = DictWriter(write_obj, fieldnames=header)
-                dict_writer.writeheader()
-
-        # Do not add an else statement or the first line will be skipped
-        with open(file_path, 'a+', newline='') as write_obj:
-            dict_writer = DictWriter(write_obj, fieldnames=header)
-            dict_writer.writerow(dict_row)
-
-        del dict_row
-
-        return
-    except Exception as e:
-        logging.error(f'Could not add row: {e}')
-        raise e
-
-
 def get_groups(allele):
-    a_name = allele.description.split(",")[0].split("-")[1]
-    groups = [["HLA-" + ard.redux(a_name, grp), grp] if ard.redux(a_name, grp) != a_name else None for
-                grp in ard_groups]
+    # Each (allele, group) redux is computed once per run by the resolver
+    groups = group_resolver.get_groups(allele.description.split(",")[0])
 
     # expre_chars = ['N', 'Q', 'L', 'S']
     # to_second = lambda a: ":".join(a.split(":")[0:2]) + \
@@ -223,7 +163,7 @@ def get_groups(allele):
 ### Refactor builed gfes
 def build_GFE(allele):
     
-    # Build and stream the GFE rows
+    # Build and stream the GFE rows, the sequence is written to sequences.RELEASE.csv
     try:
         _seq = str(allele.seq)
 
@@ -234,12 +174,11 @@ def build_GFE(allele):
             "hla_name": hla_name,
             #"a_name": hla_name.split("-")[1],
             "seq_id": seq_hasher(_seq.encode('utf-8')),
-            "sequence": _seq,
             "length": len(_seq),
             "imgt_release": imgt_release
         }
 
-        return row
+        return row, [build_sequence(row["seq_id"], _seq)]
                
     except Exception as e:
         logging.error(f'Failed to create GFE record for allele ID {allele.id}: {e}')
@@ -250,14 +189,16 @@ def build_feature(allele, feature):
     
     try:
 
-        feature["gfe_name"] = gfe_name
-        feature["term"] = feature["term"].upper()
-        feature["allele_id"] = allele.id 
-        feature["hla_name"] = hla_name
-        feature["imgt_release"] = imgt_release
+        feature.gfe_name = gfe_name
+        feature.term = feature.term.upper()
+        feature.allele_id = allele.id 
+        feature.hla_name = hla_name
+        feature.imgt_release = imgt_release
+        feature.feature_id = feature_id(feature.locus, feature.rank, feature.term, feature.accession)
+        feature.seq_id = seq_hasher(feature.sequence.encode('utf-8'))
 
         # Avoid null values in CSV for Neo4j import
-        feature["hash_code"] = "none" if not feature["hash_code"] else feature["hash_code"]
+        feature.hash_code = "none" if not feature.hash_code else feature.hash_code
 
         return feature
 
@@ -280,11 +221,11 @@ def build_alignment(allele, alignments, align_type="genomic"):
     else:
         raise ValueError(f'Could not recognize align_type = "{align_type}"')
 
-    if allele.description.split(",")[0] in alignments[align_type][locus]:
+    if allele.description.split(",")[0] in alignments[align_type]:
       
         try:
             
-            alignment = alignments[align_type][locus][allele.description.split(",")[0]]
+            alignment = alignments[align_type][allele.description.split(",")[0]]
 
             row = {
                 "label": label,
@@ -343,25 +284,25 @@ def build_group(group, allele):
 
 
 def build_cds(allele):
-    # Build and stream the CDS rows
+    # Build and stream the CDS rows, the sequences are written to sequences.RELEASE.csv
     try:
         # Build CDS dict for CSV export, foreign key: allele_id, hla_name
         bp_seq, aa_seq = get_cds(allele)
 
         # TODO fix `AttributeError: 'NoneType' object has no attribute 'encode'`
+        bp_seq_id, aa_seq_id = seq_hasher_batch([bp_seq.encode('utf-8'), aa_seq.encode('utf-8')])
+
         row = {
             "gfe_name": gfe_name,
             # "gfe_sequence": str(allele.seq),
             # "allele_id": allele.id,
             # "hla_name": hla_name,
-            "bp_seq_id": seq_hasher(bp_seq.encode('utf-8')),
-            "bp_sequence": bp_seq,
-            "aa_seq_id": seq_hasher(aa_seq.encode('utf-8')),
-            "aa_sequence": aa_seq,
+            "bp_seq_id": bp_seq_id,
+            "aa_seq_id": aa_seq_id,
             # "imgt_release": imgt_release
         }
 
-        return row
+        return row, [build_sequence(bp_seq_id, bp_seq), build_sequence(aa_seq_id, aa_seq)]
 
     except Exception as e:
         logging.error(f'Failed to create CDS data for allele {allele.id}: {e}')
@@ -372,7 +313,19 @@ def gfe_from_allele(allele, gfe_maker):
 
     locus = allele.description.split(",")[0].split("*")[0]
 
-    complete_annotation = get_features(allele)
+    with timer.stage("get_features"):
+        complete_annotation = get_features(allele)
+
+    # Features and GFEs from previous runs and releases are served from the cache
+    if feature_cache:
+        with timer.stage("feature_cache"):
+            cached = feature_cache.get_gfe(locus, complete_annotation)
+        if cached:
+            features, gfe = cached
+            return {
+                "name": gfe,
+                "features": features
+            }
 
     ann = Annotation(annotation=complete_annotation,
             method='match',
@@ -380,7 +333,12 @@ def gfe_from_allele(allele, gfe_maker):
 
     # This process takes a long time
     logging.info(f"Getting GFE data for allele {allele.id}...")
-    features, gfe = gfe_maker.get_gfe(ann, locus)
+    with timer.stage("get_gfe"):
+        features, gfe = gfe_maker.get_gfe(ann, locus)
+
+    if feature_cache:
+        with timer.stage("feature_cache"):
+            feature_cache.put_gfe(locus, complete_annotation, features, gfe)
         
     return { 
         "name": gfe,
@@ -388,23 +346,26 @@ def gfe_from_allele(allele, gfe_maker):
     }
 
 
-def process_allele(allele, alignments_dict, csv_path=None):
-    
-    csv_path = csv_path[:-1] if csv_path[-1] == "/" else csv_path
+def process_allele(allele, alignments_dict):
+    """Builds the CSV rows for an allele and returns them as a list of
+    (csv_name, row) tuples in the order they are written. Every sequence
+    referenced by a row has a sequences row, the writer drops the ones that
+    were already written."""
 
-    # gfe_sequences.RELEASE.csv
-    file_name = f'{csv_path}/gfe_sequences.{dbversion}.csv'
+    rows = []
 
-    append_dict_as_row(
-        build_GFE(allele), 
-        file_name)
+    # gfe_sequences.RELEASE.csv
+    with timer.stage("build_GFE"):
+        gfe_row, sequences = build_GFE(allele)
+        rows.append(("gfe_sequences", gfe_row))
+        rows.extend((SEQUENCES_CSV, row) for row in sequences)
 
     #del gfe_row
 
     # all_features.RELEASE.csv
     
     # features preprocessing steps
-    # 1) Convert seqann type to python dict using literal_eval
+    # 1) Convert seqann type to FeatureRecord
     # 2) add GFE foreign keys: allele_id, hla_name
     # 3) calculate columns: length             
 
@@ -412,55 +373,217 @@ def process_allele(allele, alignments_dict, csv_path=None):
     # Note: Some alleles may have the same feature, but it may not be the same rank, 
     # so a feature should be identified with its allele by allele_id or HLA name
     
-    # features contains list of seqann objects, converts to dict, destructive step
-    features = \
-        [ast.literal_eval(str(feature) \
-            .replace('\'', '"') \
-            .replace('\n', '')) \
-            for feature in gfe_features]  
-
-    file_name = f'{csv_path}/all_features.{dbversion}.csv'
-
-    for feature in features:
-        append_dict_as_row(
-            build_feature(allele=allele, feature=feature), 
-            file_name)
+    # features contains list of seqann objects, read their attributes into records
+    # (features copied from a base release are already records)
+    with timer.stage("build_feature"):
+        features = \
+            [feature if isinstance(feature, FeatureRecord) else \
+                FeatureRecord.from_seqann(feature) \
+                for feature in gfe_features]  
+
+        for feature in features:
+            rows.append(("all_features", build_feature(allele=allele, feature=feature)))
+            rows.append((SEQUENCES_CSV, build_sequence(feature.seq_id, feature.sequence)))
     
     del features
 
     # all_alignments.RELEASE.csv
     if alignments_dict:
-        file_name = f'{csv_path}/all_alignments.{dbversion}.csv'
-        
-        for align_type in ["genomic", "nucleotide", "protein"]:
-            append_dict_as_row(
-                build_alignment(allele=allele, 
-                                alignments=alignments_dict,
-                                align_type=align_type), 
-                file_name)
+        with timer.stage("build_alignment"):
+            for align_type in ["genomic", "nucleotide", "protein"]:
+                rows.append(("all_alignments", build_alignment(
+                    allele=allele, 
+                    alignments=alignments_dict,
+                    align_type=align_type)))
             
     # all_groups.RELEASE.csv
-    groups = get_groups(allele)
+    with timer.stage("build_group"):
+        groups = get_groups(allele)
 
-    file_name = f'{csv_path}/all_groups.{dbversion}.csv'
-
-    for group in groups:
-        append_dict_as_row(
-            build_group(group, allele), 
-            file_name)
+        for group in groups:
+            rows.append(("all_groups", build_group(group, allele)))
 
     del groups
 
     # all_cds.RELEASE.csv
-    file_name = f'{csv_path}/all_cds.{dbversion}.csv'
-    append_dict_as_row(
-        build_cds(allele), 
-        file_name)
-
-    if _mem_profile and idx % 20 == 0:
-        memory_profiler()
+    with timer.stage("build_cds"):
+        cds_row, sequences = build_cds(allele)
+        rows.append(("all_cds", cds_row))
+        rows.extend((SEQUENCES_CSV, row) for row in sequences)
         
-    return
+    return rows
+
+
+def init_worker(feature_service_url, verbose, verbosity, feature_cache_path=None):
+    """Creates the GFE, pyard and feature cache instances used by
+    `build_allele`. Called in the main process for serial builds or in every
+    worker process for parallel builds, so that no sqlite connection or HTTP
+    session is shared across a fork."""
+
+    global ard, gfe_maker, feature_cache, group_resolver
+
+    ard = pyard.init(dbversion, data_dir=pyard_data_dir, load_mac=False)
+
+    # Workers start from the group table precomputed before the fork
+    group_resolver = GroupResolver(ard, table=group_table)
+
+    gfe_maker = GFE(
+        url=feature_service_url,
+        verbose=verbose, 
+        verbosity=verbosity,
+        load_features=False, 
+        store_features=True,
+        loci=load_loci)
+
+    if feature_cache_path:
+        feature_cache = FeatureCache(feature_cache_path, feature_service_url)
+        feature_cache.wrap_feature_api(gfe_maker)
+    else:
+        feature_cache = None
+
+
+def build_allele(item):
+    """Builds all rows for one allele. Runs in the main process for serial
+    builds or in a pool worker for parallel builds, so it returns the rows and
+    any error instead of writing them."""
+
+    global locus, hla_name, gfe_name, gfe_features
+
+    idx, allele = item
+
+    result = {
+        "index": idx,
+        "rows": [],
+        "error": None,
+        "cache_stats": None,
+        "from_base_release": False,
+        "locus": None,
+        "offset": allele.annotations.get("offset"),
+        "timings": None
+    }
+
+    try:
+
+        locus = allele.description.split(",")[0].split("*")[0]
+        hla_name = allele.description.split(",")[0]
+        result["locus"] = locus
+
+        # Construct a condition to determine if allele can be processed
+        allele_can_be_processed = \
+            hasattr(allele, 'seq') and \
+            (locus in hla_loci or locus == "DRB5") and \
+            (len(str(allele.seq)) > 5)
+
+        if allele_can_be_processed:
+
+            # Unchanged alleles reuse the GFE and features of the base release
+            gfe = None
+            if base_release:
+                with timer.stage("base_release"):
+                    gfe = base_release.get(allele.id, seq_hasher(str(allele.seq).encode('utf-8')))
+                result["from_base_release"] = gfe is not None
+
+            if gfe is None:
+                gfe = gfe_from_allele(
+                    allele,
+                    gfe_maker=gfe_maker)
+                
+            gfe_name = gfe["name"]
+            gfe_features = gfe["features"]
+            
+            # Process allele and build rows for CSV
+            result["rows"] = process_allele(
+                allele=allele,
+                alignments_dict=alignments_dict)
+            
+        else:
+            logger.warning(f'Skipping allele {hla_name} for locus {locus}')
+
+    except Exception as e:
+        result["error"] = {
+            "timestamp": datetime.utcnow().isoformat()[:-3],
+            "allele_id": allele.id,
+            "data": { k: v for k, v in allele.__dict__.items() if k in allele_error_fields },
+            "index": idx,
+            "release": dbversion,
+            "error": str(e),
+            "stack_trace": traceback.format_exc(),
+        }
+
+    result["timings"] = timer.pop()
+    result["cache_stats"] = group_resolver.pop_stats()
+
+    if feature_cache:
+        result["cache_stats"].update(feature_cache.pop_stats())
+
+    return result
+
+
+def parse_shard(shard):
+    """Parses a shard spec "i/n" into (i, n)"""
+
+    try:
+        i, n = [int(x) for x in shard.split("/")]
+    except ValueError:
+        raise ValueError(f'Could not parse shard "{shard}", expected i/n')
+
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f'Shard index must be in [0, {n}), got {i}')
+
+    return i, n
+
+
+def shard_offsets(dat_file, i, n):
+    """Returns the DAT byte range [start, end) of shard i of n, splitting the
+    records into n contiguous runs of equal count. The start is None for an
+    empty shard and the end is None for the last shard."""
+
+    offsets = imgt_dat.record_offsets(dat_file)
+    lo, hi = len(offsets) * i // n, len(offsets) * (i + 1) // n
+
+    if lo == hi:
+        return None, None
+
+    return offsets[lo], offsets[hi] if hi < len(offsets) else None
+
+
+def part_name(shard=None, loci=None):
+    """Name of the part files written by a sharded build, None for a full build"""
+
+    if shard is None and not loci:
+        return None
+
+    name = f'part{shard[0]:04d}' if shard else 'part'
+
+    if loci:
+        name += '-' + '_'.join(loci)
+
+    return name
+
+
+def log_path(file_name, part=None):
+    """Path of a log file of the build in log_dir. Sharded builds insert
+    their part name, gfeBuildLogs.part0001.txt, so shards running on the
+    same host do not write to the same file."""
+
+    stem, ext = os.path.splitext(file_name)
+    return f'{log_dir}/{stem}.{part}{ext}' if part else f'{log_dir}/{file_name}'
+
+
+def imap_ordered(pool, func, iterable, window):
+    """Like `Pool.imap` but only keeps `window` tasks in flight, so the DAT
+    file is not read ahead into memory faster than the workers consume it.
+    Results are yielded in input order."""
+
+    pending = deque()
+
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
 
 
 if __name__ == '__main__':
@@ -502,6 +625,20 @@ if __name__ == '__main__':
                         help="Enable memory profiling",
                         action='store_true')
 
+    parser.add_argument("--profile-interval",
+                        required=False,
+                        help="Number of alleles between memory profile samples",
+                        default=100,
+                        type=int,
+                        action="store")
+
+    parser.add_argument("--profile-top",
+                        required=False,
+                        help="Number of allocation sites in each memory profile diff",
+                        default=10,
+                        type=int,
+                        action="store")
+
     parser.add_argument("-v", "--verbosity",
                         help="Option for running in verbose",
                         action="store_true")
@@ -535,8 +672,77 @@ if __name__ == '__main__':
                         nargs='?',
                         action="store")
 
+    parser.add_argument("-c", "--feature-cache",
+                        required=False,
+                        help="Path to a sqlite cache of features and GFEs reused across runs",
+                        default=None,
+                        type=str,
+                        action="store")
+
+    parser.add_argument("-b", "--base-release",
+                        required=False,
+                        help="Previous release whose CSVs are reused for unchanged alleles",
+                        default=None,
+                        type=str,
+                        action="store")
+
+    parser.add_argument("-w", "--workers",
+                        required=False,
+                        help="Number of worker processes used to build GFEs",
+                        default=1,
+                        type=int,
+                        action="store")
+
+    parser.add_argument("--dat-parser",
+                        required=False,
+                        help="Parser used to read hla.RELEASE.dat, --shard requires the lean parser",
+                        choices=["lean", "biopython"],
+                        default="biopython",
+                        type=str,
+                        action="store")
+
+    parser.add_argument("--resume",
+                        required=False,
+                        help="Resume the build from its checkpoint, or start over if there is none",
+                        action='store_true')
+
+    parser.add_argument("--checkpoint-interval",
+                        required=False,
+                        help="Number of alleles between checkpoints",
+                        default=500,
+                        type=int,
+                        action="store")
+
+    parser.add_argument("--checkpoint-s3",
+                        required=False,
+                        help="S3 URI where the checkpoint and CSVs are also saved, for example s3://bucket/checkpoints/3510",
+                        type=str,
+                        action="store")
+
+    parser.add_argument("--loci",
+                        required=False,
+                        help="Comma separated loci to build, for example HLA-A,HLA-B",
+                        type=str,
+                        action="store")
+
+    parser.add_argument("--shard",
+                        required=False,
+                        help="Build only shard i of n of the DAT records, given as i/n with 0 <= i < n",
+                        type=str,
+                        action="store")
+
     args = parser.parse_args()
 
+    loci = args.loci.split(",") if args.loci else None
+    shard = parse_shard(args.shard) if args.shard else None
+    part = part_name(shard, loci)
+
+    # The log file is named after the part, which is known once the
+    # arguments are parsed
+    log_handler = logging.FileHandler(log_path("gfeBuildLogs.txt", part))
+    log_handler.setFormatter(logger.handlers[0].formatter)
+    logger.addHandler(log_handler)
+
     logging.debug(f'Input args: {vars(args)}')
 
     dbversion = args.release #if args.release else pd.read_html(imgt_hla)[0]['Release'][0].replace(".", "")
@@ -578,100 +784,268 @@ if __name__ == '__main__':
         alignments_dict = None
 
     logging.info(f'****** Building graph for IMGTHLA version {imgt_release} ******')
-    
-    alleles = parse_dat(data_dir, dbversion)
 
-    ard = pyard.init(dbversion, data_dir="/tmp/gfe-pyard", load_mac=False)
+    if shard:
+        if args.dat_parser != "lean":
+            raise ValueError("--shard requires the lean DAT parser")
 
-    gfe_maker = GFE(
-        url=args.feature_service_url,
-        verbose=verbose, 
-        verbosity=verbosity,
-        load_features=False, 
-        store_features=True,
-        loci=load_loci)
+        start_offset, end_offset = shard_offsets(
+            ''.join([data_dir, '/hla.', dbversion, ".dat"]), *shard)
+        logging.info(f'Building shard {shard[0]}/{shard[1]}, DAT bytes [{start_offset}, {end_offset})')
+    else:
+        start_offset, end_offset = 0, None
+
+    if start_offset is None:
+        alleles = iter([])
+        dat_records = 0
+    else:
+        alleles = parse_dat(data_dir, dbversion, dat_parser=args.dat_parser, start=start_offset, end=end_offset)
+
+        # Number of records this build should process, reconciled against the
+        # output by validate_build_output through the manifest
+        dat_records = sum(
+            1 for name in imgt_dat.allele_names(
+                ''.join([data_dir, '/hla.', dbversion, ".dat"]), start=start_offset, end=end_offset)
+            if not loci or name.split("*")[0] in loci)
+
+    if loci:
+        logging.info(f'Building loci {", ".join(loci)}')
+        alleles = (allele for allele in alleles if allele.description.split(",")[0].split("*")[0] in loci)
+
+    # Resume after the last allele of the checkpoint. With the lean parser
+    # parsing restarts at that allele, otherwise all previous alleles are skipped.
+    checkpoint_path = f'{out_dir}/checkpoint.{dbversion}.{part}.json' if part else f'{out_dir}/checkpoint.{dbversion}.json'
+    checkpoint = Checkpoint(checkpoint_path, args.checkpoint_s3)
+    state = checkpoint.load() if args.resume else None
+    first_index = 0
+
+    if state and state["complete"]:
+        logging.info(f'Checkpoint {checkpoint_path} is complete, nothing to resume')
+
+        # run.sh uploads the metrics with the logs of every build
+        BuildMetrics(dbversion).write(
+            log_path("gfeBuildMetrics.json", part),
+            workers=args.workers,
+            shard=args.shard,
+            errors=len(state["errors"]),
+            resumed_complete=True)
+        sys.exit(2 if state["errors"] else 0)
+
+    if state and state["index"] > 0:
+        logging.info(f'Resuming from checkpoint {checkpoint_path} after {state["index"]} alleles')
+        CsvWriterRegistry(out_dir, dbversion, part=part).truncate(state["files"])
+        first_index = state["index"]
+
+        if args.dat_parser == "lean" and state["dat_offset"] is not None:
+            start_offset = state["dat_offset"]
+            alleles = parse_dat(data_dir, dbversion, dat_parser=args.dat_parser, start=start_offset, end=end_offset)
+            if loci:
+                alleles = (allele for allele in alleles if allele.description.split(",")[0].split("*")[0] in loci)
+            alleles = islice(alleles, 1, None)
+        else:
+            alleles = islice(alleles, first_index, None)
+    elif args.resume:
+        logging.info(f'No checkpoint found at {checkpoint_path}, building from the first allele')
+        CsvWriterRegistry(out_dir, dbversion, part=part).truncate({})
+
+    # Parsing runs in the main process, serial builds pop its time with the
+    # allele, parallel builds with the next result
+    alleles = timed(alleles, timer, "parse_dat")
+
+    # Load before starting workers so the index is shared through fork
+    if args.base_release:
+        base_release = BaseReleaseIndex(
+            os.environ["DATA_DIR"] + f"/{args.base_release}/csv",
+            args.base_release)
+    else:
+        base_release = None
 
-    errors = []
+    errors = state["errors"] if state else []
     allele_error_fields = ["annotations", "molecule_type", "data_file_division", "accessions", "keywords", "organism", "taxonomy", "comment", "dbxrefs", "description", "id", "name"]
     max_errors = 10
-    for idx, allele in enumerate(alleles):
-        if idx == limit:
-            break
-        
-        try:
 
-            locus = allele.description.split(",")[0].split("*")[0]
-            hla_name = allele.description.split(",")[0]
+    workers = max(args.workers, 1)
+    worker_args = (args.feature_service_url, verbose, verbosity, args.feature_cache)
+    pool = None
+    group_table = None
+    feature_cache = None
+
+    # Names of the alleles in this build, used to precompute the group table
+    if args.dat_parser == "lean" and start_offset is not None:
+        group_names = imgt_dat.allele_names(
+            ''.join([data_dir, '/hla.', dbversion, ".dat"]), start=start_offset, end=end_offset)
+        group_names = islice(
+            (name for name in group_names if name.split("*")[0] in (loci or hla_loci)), limit)
+    else:
+        group_names = []
 
-            # Construct a condition to determine if allele can be processed
-            allele_can_be_processed = \
-                hasattr(allele, 'seq') and \
-                (locus in hla_loci or locus == "DRB5") and \
-                (len(str(allele.seq)) > 5)
+    remaining = max(limit - first_index, 0) if limit is not None else None
+    allele_items = enumerate(islice(alleles, remaining), start=first_index)
 
-            if allele_can_be_processed:
-                
-                gfe = gfe_from_allele(
-                    allele,
-                    gfe_maker=gfe_maker)
-                    
-                gfe_name = gfe["name"]
-                gfe_features = gfe["features"]
-                
-                # Process allele and output rows to CSV
-                process_allele(
-                    allele=allele,
-                    alignments_dict=alignments_dict,
-                    csv_path=out_dir)
-                
-            else:
-                logger.warning(f'Skipping allele {hla_name} for locus {locus}')
+    if workers > 1:
+        logging.info(f'Building GFEs with {workers} worker processes')
 
-        except Exception as e:
-            errors.append({
-                "timestamp": datetime.utcnow().isoformat()[:-3],
-                "allele_id": allele.id,
-                "data": { k: v for k, v in allele.__dict__.items() if k in allele_error_fields },
-                "index": idx,
-                "release": dbversion,
-                "error": str(e),
-                "stack_trace": traceback.format_exc(),
-            })
-            
-            # try:
-            #     logger.info(f'Sending message to {failed_alleles_queue_name}')
-            #     response = sqs.send_message(
-            #         QueueUrl=failed_alleles_queue,
-            #         MessageBody=json.dumps({
-            #             "allele_id": allele.id,
-            #             "release": dbversion,
-            #             "params": {
-            #                 "align": align,
-            #                 "kir": kir
-            #             }
-            #         }))
-                    
-            #     if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-            #         logger.error(json.dumps(response))
-            #         raise Exception("Failed to process message")
-            #     else:
-            #         logger.info(json.dumps(
-            #             response['ResponseMetadata']))
-
-            # except Exception as err:
-            #     logger.error("Failed to send message")
-            #     raise err
+        # Create the pyard database before any workers open it and resolve
+        # the release's groups once, workers inherit the table through fork
+        group_table = GroupResolver(pyard.init(dbversion, data_dir=pyard_data_dir, load_mac=False)) \
+            .precompute(group_names)
+
+        # Workers inherit the parsed arguments and alignments through fork,
+        # then create their own GFE, pyard and feature cache instances
+        pool = multiprocessing.get_context("fork").Pool(
+            workers,
+            initializer=init_worker,
+            initargs=worker_args)
+
+        results = imap_ordered(pool, build_allele, allele_items, window=workers * 4)
+    else:
+        init_worker(*worker_args)
+        group_resolver.precompute(group_names)
+        results = map(build_allele, allele_items)
+
+    cache_stats = {}
+    num_from_base_release = 0
+    num_alleles = first_index
+    dat_offset = state["dat_offset"] if state else None
+    profiler = MemoryProfiler(log_dir, args.profile_interval, args.profile_top, part=part) if _mem_profile else None
+    metrics = BuildMetrics(dbversion)
+
+    # One open handle per CSV for the whole build, closed on exit or abort
+    writers = CsvWriterRegistry(out_dir, dbversion, part=part)
+    sizes = {}
+    aborted = False
+
+    # Each distinct sequence is written once, a resumed build starts from the
+    # sequences kept by the checkpoint
+    sequence_table = SequenceTable()
+    if state and state["index"] > 0:
+        sequence_table.load(writers.path(SEQUENCES_CSV))
+
+    try:
+        # Results arrive in input order so the CSVs are identical to a serial build
+        for result in results:
+
+            num_alleles = result["index"] + 1
+            dat_offset = result["offset"]
+
+            with timer.stage("write_csv"):
+                for csv_name, row in result["rows"]:
+                    if csv_name == SEQUENCES_CSV and not sequence_table.add(row["seq_id"]):
+                        continue
+                    writers.write(csv_name, row)
+
+            timings = result["timings"] or {}
+            for stage, seconds in timer.pop().items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            metrics.add(result["locus"], timings)
+
+            if result["from_base_release"]:
+                num_from_base_release += 1
+
+            if result["cache_stats"]:
+                for k, v in result["cache_stats"].items():
+                    cache_stats[k] = cache_stats.get(k, 0) + v
+
+            if profiler:
+                profiler.step(num_alleles)
+
+            if result["error"]:
+                errors.append(result["error"])
             
+                # try:
+                #     logger.info(f'Sending message to {failed_alleles_queue_name}')
+                #     response = sqs.send_message(
+                #         QueueUrl=failed_alleles_queue,
+                #         MessageBody=json.dumps({
+                #             "allele_id": allele.id,
+                #             "release": dbversion,
+                #             "params": {
+                #                 "align": align,
+                #                 "kir": kir
+                #             }
+                #         }))
+                        
+                #     if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+                #         logger.error(json.dumps(response))
+                #         raise Exception("Failed to process message")
+                #     else:
+                #         logger.info(json.dumps(
+                #             response['ResponseMetadata']))
+
+                # except Exception as err:
+                #     logger.error("Failed to send message")
+                #     raise err
+
+            # After the allele's error is recorded, so a resumed build keeps it
+            if num_alleles % args.checkpoint_interval == 0:
+                checkpoint.save(num_alleles, dat_offset, writers.sizes(), errors)
+
             if len(errors) > max_errors:
                 logger.error(f'Max errors ({max_errors}) reached. Exiting...')
+                aborted = True
                 break
 
-    logging.info(f'Finished build for version {imgt_release}')
+        sizes = writers.sizes()
+    finally:
+        writers.close()
+
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+        # Workers are terminated without closing the feature cache, their
+        # committed entries are still in the write-ahead log
+        if feature_cache:
+            feature_cache.close()
+        if args.feature_cache:
+            checkpoint_feature_cache(args.feature_cache)
+
+        if profiler:
+            profiler.close(num_alleles)
+
+    # A build stopped by max_errors is not complete, the next run resumes
+    # from this checkpoint and no manifest is written, so its partial CSVs are
+    # never taken for a finished build
+    checkpoint.save(num_alleles, dat_offset, sizes, errors, complete=not aborted)
+
+    if not aborted:
+        # Shard manifests are uploaded with the part files and combined by merge_parts.py
+        manifest_path = f'{out_dir}/manifest.{dbversion}.{part}.json' if part else f'{Path(out_dir).parent}/manifest.json'
+        write_manifest(manifest_path, build_manifest(
+            dbversion,
+            glob(writers.path("*")),
+            part=part,
+            limit=limit,
+            groups=ard_groups,
+            dat_records=dat_records,
+            alleles_processed=num_alleles,
+            alleles_failed=len(errors)))
+
+        logging.info(f'Finished build for version {imgt_release}')
+    logging.info(f'Wrote {len(sequence_table)} distinct sequences to {writers.path(SEQUENCES_CSV)}')
+
+    # Stage timings are written next to gfeBuildLogs.txt and uploaded by run.sh
+    metrics.write(
+        log_path("gfeBuildMetrics.json", part),
+        workers=workers,
+        shard=args.shard,
+        errors=len(errors),
+        from_base_release=num_from_base_release,
+        cache_stats=cache_stats)
+
+    logging.info(f'Group stats: {json.dumps({k: v for k, v in cache_stats.items() if k.startswith("group_")})}')
+
+    if args.feature_cache:
+        logging.info(f'Feature cache stats: {json.dumps({k: v for k, v in cache_stats.items() if not k.startswith("group_")})}')
+
+    if base_release:
+        logging.info(f'Reused {num_from_base_release} GFEs from base release {args.base_release}')
 
     if len(errors) > 0:
         logging.error(f'{len(errors)} errors: {[ error["allele_id"] for error in errors ]}')
         # write errors to file as ndjson
-        with open(f'{errors_dir}/errors.{dbversion}.ndjson', 'w') as f:
+        errors_file = f'errors.{dbversion}.{part}.ndjson' if part else f'errors.{dbversion}.ndjson'
+        with open(f'{errors_dir}/{errors_file}', 'w') as f:
             for error in errors:
                 try:
                     f.write(json.dumps(error) + '\n')
@@ -682,6 +1056,11 @@ if __name__ == '__main__':
                     logger.info('Success')
 
         exit_code = 2
+
+    if aborted:
+        logging.error(f'Build for version {imgt_release} stopped after {num_alleles} alleles, it resumes from {checkpoint_path}')
+        exit_code = 1
+
     end = time.time()
     errors_msg_fragment = f'with {len(errors)} error(s)' if len(errors) > 0 else ''
     logging.info(f'****** Build finished {errors_msg_fragment} in {round(end - start, 2)} seconds ******')
@@ -0,0 +1,100 @@
+import os
+import csv
+import logging
+from records import FeatureRecord
+from sequences import SEQUENCES_CSV, read_sequences
+
+logger = logging.getLogger()
+
+# Feature columns produced by seqann, in the order they are written
+feature_fields = ["accession", "hash_code", "locus", "rank", "sequence", "term"]
+
+
+class BaseReleaseIndex:
+    """Index of the GFEs and features built for a previous release, keyed by
+    accession name and sequence ID. Alleles whose sequence has not changed
+    since the base release can reuse its GFE and features instead of going
+    through `gfe_from_allele`. Feature sequences are resolved from
+    sequences.RELEASE.csv, or read from all_features for releases built
+    before the sequence table."""
+
+    def __init__(self, csv_dir, release):
+        self.csv_dir = csv_dir[:-1] if csv_dir[-1] == "/" else csv_dir
+        self.release = release
+        self.index = {}
+
+        gfe_sequences = f'{self.csv_dir}/gfe_sequences.{release}.csv'
+        all_features = f'{self.csv_dir}/all_features.{release}.csv'
+        sequences_path = f'{self.csv_dir}/{SEQUENCES_CSV}.{release}.csv'
+
+        for file_path in [gfe_sequences, all_features]:
+            if not os.path.isfile(file_path):
+                raise FileNotFoundError(f'Base release file not found: {file_path}')
+
+        logging.info(f'Loading base release {release} from {self.csv_dir}')
+
+        with open(gfe_sequences, newline='') as f:
+            for row in csv.DictReader(f):
+                self.index[(row["acc_name"], row["seq_id"])] = {
+                    "name": row["gfe_name"],
+                    "features": []
+                }
+
+        # all_features has no allele seq_id, so features are matched to the GFE rows
+        # by accession name and GFE name
+        gfes = {acc_name: (seq_id, gfe["name"]) for (acc_name, seq_id), gfe in self.index.items()}
+
+        with open(all_features, newline='') as f:
+            reader = csv.DictReader(f)
+
+            # Features reference their sequence by ID since the sequence table
+            # was added, the IDs are resolved below
+            resolve_sequences = "sequence" not in reader.fieldnames
+            columns = ["seq_id" if k == "sequence" else k for k in feature_fields] \
+                if resolve_sequences else feature_fields
+
+            if resolve_sequences and not os.path.isfile(sequences_path):
+                raise FileNotFoundError(f'Base release file not found: {sequences_path}')
+
+            for row in reader:
+                if row["allele_id"] not in gfes:
+                    continue
+
+                seq_id, gfe_name = gfes[row["allele_id"]]
+                if row["gfe_name"] != gfe_name:
+                    continue
+
+                self.index[(row["allele_id"], seq_id)]["features"].append(
+                    tuple(row[k] for k in columns))
+
+        del gfes
+
+        # Replace the sequence IDs of the features with their sequences
+        if resolve_sequences:
+            position = feature_fields.index("sequence")
+            seq_ids = {feature[position] for gfe in self.index.values() for feature in gfe["features"]}
+            sequences = read_sequences(sequences_path, seq_ids)
+
+            for gfe in self.index.values():
+                gfe["features"] = [
+                    (*feature[:position], sequences[feature[position]], *feature[position + 1:])
+                    for feature in gfe["features"]]
+
+            del seq_ids, sequences
+
+        logging.info(f'Loaded {len(self.index)} GFEs from base release {release}')
+
+    def get(self, acc_name, seq_id):
+        """Returns the base release GFE as {"name": ..., "features": [...]}
+        or None if the allele is new or its sequence changed"""
+
+        gfe = self.index.get((acc_name, seq_id))
+
+        # A GFE without features cannot be copied forward
+        if gfe is None or not gfe["features"]:
+            return None
+
+        return {
+            "name": gfe["name"],
+            "features": [FeatureRecord(*feature) for feature in gfe["features"]]
+        }
@@ -0,0 +1,132 @@
+import os
+import json
+import logging
+from datetime import datetime
+import boto3
+
+logger = logging.getLogger()
+
+
+class Checkpoint:
+    """Progress of a release build, saved periodically so an interrupted
+    build can resume where it stopped.
+
+    Records the number of alleles fully written, the DAT byte offset of the
+    last written allele and the size of each CSV at that point. On resume the
+    CSVs are truncated back to those sizes, which drops partial rows and rows
+    of alleles that will be built again. When an S3 URI is given, the CSVs
+    and the checkpoint are also uploaded there so a build can resume on a
+    new host. Each checkpoint uploads only the bytes appended to each CSV
+    since the previous one, as a segment named after its start offset, and
+    the CSVs are restored by concatenating their segments. The S3 copy is
+    removed once the build is complete."""
+
+    def __init__(self, path, s3_uri=None):
+        self.path = path
+        self.s3_uri = s3_uri.rstrip("/") if s3_uri else None
+        self.s3 = boto3.client('s3') if s3_uri else None
+        self.state = None
+
+    def _s3_location(self, file_name):
+        bucket, _, prefix = self.s3_uri[len("s3://"):].partition("/")
+        return bucket, f'{prefix}/{file_name}' if prefix else file_name
+
+    def load(self):
+        """Returns the saved state or None. Restores the checkpoint and its
+        CSVs from S3 if there is no local checkpoint."""
+
+        if not os.path.isfile(self.path) and self.s3:
+            self._download()
+
+        if not os.path.isfile(self.path):
+            return None
+
+        with open(self.path) as f:
+            self.state = json.load(f)
+
+        return self.state
+
+    def save(self, index, dat_offset, files, errors, complete=False):
+        """Saves progress after `index` alleles. `files` maps each CSV path to
+        its size in bytes, all rows up to that size must be flushed."""
+
+        segments = (self.state or {}).get("segments", {})
+
+        # Segments first, so an uploaded checkpoint never points past its files
+        if self.s3 and not complete:
+            segments = self._upload_segments(files, segments)
+
+        self.state = {
+            "timestamp": datetime.utcnow().isoformat()[:-3],
+            "index": index,
+            "dat_offset": dat_offset,
+            "files": files,
+            "segments": segments,
+            "errors": errors,
+            "complete": complete,
+        }
+
+        # Write to a temporary file so a crash never leaves a partial checkpoint
+        with open(f'{self.path}.tmp', "w") as f:
+            json.dump(self.state, f, default=str)
+        os.replace(f'{self.path}.tmp', self.path)
+
+        # A finished build is uploaded by run.sh, its S3 copy is removed so
+        # the next build of the release starts over
+        if self.s3 and complete:
+            self._delete()
+        elif self.s3:
+            self.s3.upload_file(self.path, *self._s3_location(os.path.basename(self.path)))
+
+    def _upload_segments(self, files, segments):
+        """Uploads the bytes of each CSV after its last uploaded segment and
+        returns the segments, {CSV path: [[start, end], ...]}"""
+
+        segments = {file_path: list(segments.get(file_path, [])) for file_path in files}
+
+        for file_path, size in files.items():
+            start = segments[file_path][-1][1] if segments[file_path] else 0
+            if size <= start:
+                continue
+
+            with open(file_path, "rb") as f:
+                f.seek(start)
+                body = f.read(size - start)
+
+            bucket, key = self._s3_location(f'{os.path.basename(file_path)}.{start}')
+            self.s3.put_object(Bucket=bucket, Key=key, Body=body)
+            segments[file_path].append([start, size])
+
+        return segments
+
+    def _delete(self):
+        file_names = [os.path.basename(self.path)]
+        for file_path, file_segments in self.state["segments"].items():
+            file_names += [f'{os.path.basename(file_path)}.{start}' for start, _ in file_segments]
+
+        for file_name in file_names:
+            bucket, key = self._s3_location(file_name)
+            self.s3.delete_object(Bucket=bucket, Key=key)
+
+    def _download(self):
+        bucket, key = self._s3_location(os.path.basename(self.path))
+
+        try:
+            self.s3.download_file(bucket, key, self.path)
+        except Exception as e:
+            logging.info(f'No checkpoint found at s3://{bucket}/{key}: {e}')
+            return
+
+        with open(self.path) as f:
+            segments = json.load(f)["segments"]
+
+        # Each CSV is rebuilt from its segments in order
+        for file_path, file_segments in segments.items():
+            with open(file_path, "wb") as f:
+                for start, _ in file_segments:
+                    bucket, key = self._s3_location(f'{os.path.basename(file_path)}.{start}')
+                    body = self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+                    for chunk in body.iter_chunks(chunk_size=8 * 1024 ** 2):
+                        f.write(chunk)
+
+        logging.info(f'Restored checkpoint and {len(segments)} CSVs from {self.s3_uri}')
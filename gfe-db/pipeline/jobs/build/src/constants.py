@@ -29,6 +29,9 @@ load_loci = hla_loci + kir_loci if kir else hla_loci
 
 ard_groups = ['G', 'lg', 'lgx']
 
+# pyard database of the release, shared by the build processes on a host
+pyard_data_dir = "/tmp/gfe-pyard"
+
 imgt_hla = 'https://www.ebi.ac.uk/ipd/imgt/hla/docs/release.html'
 imgt_hla_media_url = 'https://media.githubusercontent.com/media/ANHIG/IMGTHLA/'
 imgt_hla_raw_url = 'https://raw.githubusercontent.com/ANHIG/IMGTHLA/'
@@ -36,6 +39,62 @@ imgt_hla_raw_url = 'https://raw.githubusercontent.com/ANHIG/IMGTHLA/'
 imgt_kir = 'https://www.ebi.ac.uk/ipd/kir/docs/version.html'
 kir_url = 'ftp://ftp.ebi.ac.uk/pub/databases/ipd/kir/KIR.dat'
 
+# Column types of the build output, in CSV column order. Matches csv_headers
+# in validate_build_output. IDs are hashes or accessions and stay strings.
+csv_schemas = {
+    "gfe_sequences": {
+        "gfe_name": "string",
+        "acc_name": "string",
+        "locus": "string",
+        "hla_name": "string",
+        "seq_id": "string",
+        "length": "int64",
+        "imgt_release": "string",
+    },
+    "all_features": {
+        "accession": "string",
+        "hash_code": "string",
+        "locus": "string",
+        "rank": "int64",
+        "seq_id": "string",
+        "term": "string",
+        "gfe_name": "string",
+        "allele_id": "string",
+        "hla_name": "string",
+        "imgt_release": "string",
+        "feature_id": "string",
+    },
+    "all_alignments": {
+        "label": "string",
+        "seq_id": "string",
+        "gfe_name": "string",
+        "hla_name": "string",
+        "length": "int64",
+        "rank": "int64",
+        "imgt_release": "string",
+        "bp_sequence": "string",
+        "aa_sequence": "string",
+    },
+    "all_groups": {
+        "gfe_name": "string",
+        "allele_id": "string",
+        "hla_name": "string",
+        "ard_id": "string",
+        "ard_name": "string",
+        "locus": "string",
+        "imgt_release": "string",
+    },
+    "all_cds": {
+        "gfe_name": "string",
+        "bp_seq_id": "string",
+        "aa_seq_id": "string",
+    },
+    "sequences": {
+        "seq_id": "string",
+        "sequence": "string",
+    },
+}
+
 # dbversion = 
 
 
@@ -0,0 +1,201 @@
+import os
+import logging
+import sqlite3
+import hashlib
+import json
+from seqann.feature_client.models.feature import Feature
+
+logger = logging.getLogger()
+
+
+def _seq_hash(seq):
+    return hashlib.sha1(seq.encode('utf-8')).hexdigest()
+
+
+def _feature_key(term, rank):
+    # Feature requests and feature responses do not always agree on
+    # the case of the term or the type of the rank
+    term = str(term).lower()
+    rank = str(rank)
+    return term, str(int(rank)) if rank.isdigit() else rank
+
+
+def checkpoint(db_path):
+    """Moves the committed transactions of the write-ahead log into the
+    database file and truncates the log, so the database file alone holds
+    the cache. Called once no other process has the cache open, for example
+    after the workers of a parallel build exited without closing it."""
+
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            logger.warning(f'Could not checkpoint feature cache {db_path}, it is still in use')
+    finally:
+        conn.close()
+
+
+def _annotation_hash(annotation):
+    """Hashes a `get_features` annotation, {feature name: SeqRecord}"""
+
+    m = hashlib.sha1()
+    for feat, record in annotation.items():
+        m.update(f'{feat}:{str(record.seq)}\n'.encode('utf-8'))
+    return m.hexdigest()
+
+
+class FeatureCache:
+    """Persistent sqlite cache of Feature Service accessions and GFE names.
+
+    Maps (locus, term, rank, sequence hash) to the feature returned by the
+    Feature Service and (locus, annotation hash) to the GFE name, so features
+    and GFEs computed in a previous run or release are not requested again.
+    Each process must open its own instance."""
+
+    def __init__(self, db_path, feature_service_url):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.feature_hits = 0
+        self.feature_misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS features (
+                locus TEXT,
+                term TEXT,
+                rank TEXT,
+                seq_hash TEXT,
+                accession,
+                hash_code,
+                feature_term,
+                feature_rank,
+                sequence TEXT,
+                PRIMARY KEY (locus, term, rank, seq_hash)
+            );
+            CREATE TABLE IF NOT EXISTS gfes (
+                locus TEXT,
+                annotation_hash TEXT,
+                gfe_name TEXT,
+                feature_keys TEXT,
+                PRIMARY KEY (locus, annotation_hash)
+            );
+        """)
+
+        # Accessions are assigned by the Feature Service, so a cache built
+        # against a different service cannot be reused
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'feature_service_url'").fetchone()
+        if row is not None and row[0] != feature_service_url:
+            logger.warning(f'Feature cache {db_path} was built with {row[0]}, clearing it for {feature_service_url}')
+            self.conn.execute("DELETE FROM features")
+            self.conn.execute("DELETE FROM gfes")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('feature_service_url', ?)",
+            (feature_service_url,))
+        self.conn.commit()
+
+    def _get_feature(self, locus, term, rank, seq_hash):
+        term, rank = _feature_key(term, rank)
+        row = self.conn.execute(
+            "SELECT accession, hash_code, feature_term, feature_rank, sequence FROM features "
+            "WHERE locus = ? AND term = ? AND rank = ? AND seq_hash = ?",
+            (locus, term, rank, seq_hash)).fetchone()
+
+        if row is None:
+            return None
+
+        accession, hash_code, feature_term, feature_rank, sequence = row
+        return Feature(
+            accession=accession,
+            hash_code=hash_code,
+            locus=locus,
+            rank=feature_rank,
+            sequence=sequence,
+            term=feature_term)
+
+    def _put_feature(self, locus, term, rank, feature):
+        term, rank = _feature_key(term, rank)
+        seq_hash = _seq_hash(feature.sequence)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (locus, term, rank, seq_hash, feature.accession, feature.hash_code,
+             feature.term, feature.rank, feature.sequence))
+        return [term, rank, seq_hash]
+
+    def get_gfe(self, locus, annotation):
+        """Returns the cached (features, gfe_name) for an annotation or None"""
+
+        row = self.conn.execute(
+            "SELECT gfe_name, feature_keys FROM gfes WHERE locus = ? AND annotation_hash = ?",
+            (locus, _annotation_hash(annotation))).fetchone()
+
+        if row is not None:
+            gfe_name, feature_keys = row
+            features = [
+                self._get_feature(locus, term, rank, seq_hash)
+                for term, rank, seq_hash in json.loads(feature_keys)]
+            if all(features):
+                self.hits += 1
+                return features, gfe_name
+
+        self.misses += 1
+        return None
+
+    def put_gfe(self, locus, annotation, features, gfe_name):
+        feature_keys = [self._put_feature(locus, feature.term, feature.rank, feature) for feature in features]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO gfes VALUES (?, ?, ?, ?)",
+            (locus, _annotation_hash(annotation), gfe_name, json.dumps(feature_keys)))
+        self.conn.commit()
+
+    def wrap_feature_api(self, gfe_maker):
+        """Serves `create_feature` requests made by `GFE.get_gfe` from the
+        cache, so alleles with only some new features still skip the
+        Feature Service round trip for the known ones"""
+
+        api = getattr(gfe_maker, "api", None)
+        if api is None or not hasattr(api, "create_feature"):
+            logger.warning('GFE has no Feature Service client, feature requests will not be cached')
+            return
+
+        create_feature = api.create_feature
+
+        def cached_create_feature(body, **kwargs):
+            feature = self._get_feature(body.locus, body.term, body.rank, _seq_hash(body.sequence))
+            if feature is not None:
+                self.feature_hits += 1
+                return feature
+
+            self.feature_misses += 1
+            feature = create_feature(body=body, **kwargs)
+            self._put_feature(body.locus, body.term, body.rank, feature)
+            self.conn.commit()
+            return feature
+
+        api.create_feature = cached_create_feature
+
+    def pop_stats(self):
+        """Returns and resets the hit/miss counters"""
+
+        stats = {
+            "gfe_hits": self.hits,
+            "gfe_misses": self.misses,
+            "feature_hits": self.feature_hits,
+            "feature_misses": self.feature_misses,
+        }
+        self.hits = self.misses = self.feature_hits = self.feature_misses = 0
+        return stats
+
+    def close(self):
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self.conn.close()
@@ -0,0 +1,82 @@
+import time
+import logging
+from constants import ard_groups
+
+logger = logging.getLogger()
+
+
+class GroupResolver:
+    """Resolves the ARD groups of alleles with pyard. Each redux is computed
+    once per (allele, group) and kept for the whole run. The table for a
+    release can be filled up front with `precompute`, after which building
+    all_groups rows is a lookup. Tracks the time spent resolving groups."""
+
+    def __init__(self, ard, groups=ard_groups, table=None):
+        self.ard = ard
+        self.groups = groups
+        self.table = table if table is not None else {}
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+
+    def redux(self, a_name, grp):
+        key = (a_name, grp)
+
+        if key in self.table:
+            self.hits += 1
+            return self.table[key]
+
+        self.misses += 1
+        self.table[key] = self.ard.redux(a_name, grp)
+
+        return self.table[key]
+
+    def get_groups(self, hla_name):
+        """Returns [["HLA-<redux>", group] or None] for each group, None when
+        the allele is its own group"""
+
+        start = time.time()
+        a_name = hla_name.split("-")[1]
+
+        groups = []
+        for grp in self.groups:
+            group_name = self.redux(a_name, grp)
+            groups.append(["HLA-" + group_name, grp] if group_name != a_name else None)
+
+        self.seconds += time.time() - start
+
+        return groups
+
+    def precompute(self, hla_names):
+        """Fills the table for all `hla_names` and returns it. Alleles that
+        pyard cannot reduce are left to fail in `get_groups` so the error is
+        reported for the allele."""
+
+        start = time.time()
+        num_failed = 0
+
+        for hla_name in hla_names:
+            a_name = hla_name.split("-")[1]
+            for grp in self.groups:
+                if (a_name, grp) in self.table:
+                    continue
+                try:
+                    self.table[(a_name, grp)] = self.ard.redux(a_name, grp)
+                except Exception:
+                    num_failed += 1
+
+        logging.info(f'Precomputed {len(self.table)} groups in {round(time.time() - start, 2)} seconds ({num_failed} failed)')
+
+        return self.table
+
+    def pop_stats(self):
+        """Returns and resets the lookup counters and timing"""
+
+        stats = {
+            "group_hits": self.hits,
+            "group_misses": self.misses,
+            "group_seconds": self.seconds,
+        }
+        self.hits = self.misses = 0
+        self.seconds = 0.0
+        return stats
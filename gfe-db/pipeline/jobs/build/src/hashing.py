@@ -0,0 +1,53 @@
+import hashlib
+from functools import lru_cache
+
+# Number of distinct sequences memoized. Sequences repeat within an allele
+# (GFE lookup and gfe_sequences row) and across alleles (features and CDS
+# translations)
+SEQ_HASH_CACHE_SIZE = 8192
+
+# Longest sequence memoized, in bytes. Genomic sequences and alignments are
+# hashed without the cache, so it holds at most SEQ_HASH_CACHE_SIZE *
+# SEQ_HASH_CACHE_MAX_LENGTH bytes (16 MB) of sequences.
+SEQ_HASH_CACHE_MAX_LENGTH = 2048
+
+
+def md5_id(data, n=32):
+    """Decimal digits of the MD5 of `data`, truncated to `n`"""
+
+    return str(int(hashlib.md5(data).hexdigest(), 16))[:n]
+
+
+cached_md5_id = lru_cache(maxsize=SEQ_HASH_CACHE_SIZE)(md5_id)
+
+
+def seq_hasher(seq, n=32):
+    """Takes a nucleotide or amino acid sequence and returns a reproducible
+    integer UUID. Used to create shorter unique IDs since Neo4j cannot index
+    a full sequence. Can be also be used for any string.
+
+    Sequences up to SEQ_HASH_CACHE_MAX_LENGTH bytes are memoized, repeated
+    sequences are then not hashed again. Hashing itself is unchanged."""
+
+    if len(seq) <= SEQ_HASH_CACHE_MAX_LENGTH:
+        return cached_md5_id(seq, n)
+
+    return md5_id(seq, n)
+
+
+@lru_cache(maxsize=SEQ_HASH_CACHE_SIZE)
+def feature_id(locus, rank, term, accession, n=32):
+    """Reproducible ID of a feature from the properties that identify it,
+    hashed the same way as `seq_hasher`. Used as the Feature key in Neo4j."""
+
+    return md5_id(f'{locus}|{rank}|{term}|{accession}'.encode("utf-8"), n)
+
+
+def seq_hasher_batch(seqs, n=32):
+    """Hashes a list of sequences, computing each distinct sequence once"""
+
+    hashes = {}
+    for seq in seqs:
+        if seq not in hashes:
+            hashes[seq] = seq_hasher(seq, n)
+    return [hashes[seq] for seq in seqs]
@@ -0,0 +1,226 @@
+import re
+import logging
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation, \
+    ExactPosition, BeforePosition, AfterPosition
+
+logger = logging.getLogger()
+
+# Qualifiers that are wrapped over several lines without separating spaces
+remove_space_keys = ["translation"]
+
+# IMGT/HLA writes partial ranges as <1..546> as well as <1..>546
+_range = re.compile(r"^(<?)(\d+)(?:\.\.(>?)(\d+)(>?))?$")
+
+
+def record_offsets(dat_file):
+    """Returns the byte offset of every record (ID line) in a DAT file, used to
+    split the file into ranges that can be parsed independently"""
+
+    offsets = []
+    offset = 0
+
+    with open(dat_file, "rb") as f:
+        for line in f:
+            if line.startswith(b"ID   "):
+                offsets.append(offset)
+            offset += len(line)
+
+    return offsets
+
+
+def parse(dat_file, start=0, end=None):
+    """Streams the records of an IMGT/HLA DAT file as Biopython `SeqRecord`
+    objects. Only the fields used by the build are read: id, name,
+    description, accessions, sequence and the feature table. Parses the records
+    whose ID line starts at a byte offset in [start, end)."""
+
+    with open(dat_file, "rb") as f:
+        offset = _seek_line(f, start)
+        lines = None
+
+        for line in f:
+            if line.startswith(b"ID   "):
+                if end is not None and offset >= end:
+                    break
+                lines = [line]
+                record_start = offset
+            elif lines is not None:
+                lines.append(line)
+                if line.startswith(b"//"):
+                    yield _to_record(lines, record_start)
+                    lines = None
+
+            offset += len(line)
+
+
+def allele_names(dat_file, start=0, end=None):
+    """Yields the HLA name of every record whose ID line starts in
+    [start, end), reading only the ID and DE lines"""
+
+    with open(dat_file, "rb") as f:
+        offset = _seek_line(f, start)
+        in_record = False
+
+        for line in f:
+            if line.startswith(b"ID   "):
+                if end is not None and offset >= end:
+                    break
+                in_record = True
+            elif in_record and line.startswith(b"DE   "):
+                yield line[5:].decode('ascii').split(",")[0].strip()
+                in_record = False
+
+            offset += len(line)
+
+
+def _seek_line(f, start):
+    """Seeks to the first line boundary at or after start, returns its offset"""
+
+    if start == 0:
+        return 0
+
+    f.seek(start - 1)
+    return start - 1 + len(f.readline())
+
+
+def _to_record(lines, offset=None):
+
+    # ID   HLA00001; SV 1; standard; DNA; HUM; 3503 BP.
+    id_fields = [field.strip() for field in lines[0][5:].decode('ascii').split(";")]
+    name = id_fields[0]
+    version = id_fields[1][3:] if len(id_fields) > 1 and id_fields[1].startswith("SV ") else None
+    accessions = []
+    description = []
+    features = []
+    sequence = []
+    in_sequence = False
+
+    for line in lines[1:]:
+        line = line.decode('ascii').rstrip("\r\n")
+        code = line[:2]
+
+        if in_sequence:
+            if code == "//":
+                break
+            sequence.append("".join(c for c in line if c.isalpha()))
+        elif code == "AC":
+            accessions.extend(acc.strip() for acc in line[5:].split(";") if acc.strip())
+        elif code == "DE":
+            description.append(line[5:].strip())
+        elif code == "FT":
+            _feed_feature_line(features, line)
+        elif code == "SQ":
+            in_sequence = True
+
+    record = SeqRecord(
+        Seq("".join(sequence).upper()),
+        # Versioned accession like Biopython, e.g. HLA00001.1
+        id=f'{accessions[0] if accessions else name}{"." + version if version else ""}',
+        name=name,
+        description=" ".join(description),
+        features=[_to_feature(*feature) for feature in features])
+    record.annotations["accessions"] = accessions
+
+    if offset is not None:
+        record.annotations["offset"] = offset
+
+    return record
+
+
+def _feed_feature_line(features, line):
+    """Accumulates FT lines as [key, location, [[qualifier, value lines]]]"""
+
+    key = line[5:21].strip()
+    content = line[21:].strip()
+
+    if key:
+        features.append([key, content, []])
+    elif not features:
+        return
+    elif content.startswith("/"):
+        qualifier, _, value = content[1:].partition("=")
+        features[-1][2].append([qualifier, [value] if value else []])
+    elif features[-1][2]:
+        features[-1][2][-1][1].append(content)
+    else:
+        # Location wrapped over several lines
+        features[-1][1] += content
+
+
+def _to_feature(key, location, qualifiers):
+
+    try:
+        location = _parse_location(location)
+    except ValueError:
+        logging.warning(f'Could not parse {key} location "{location}"')
+        location = None
+
+    feature = SeqFeature(location, type=key)
+
+    for qualifier, value in qualifiers:
+        value = " ".join(value)
+        if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1].replace('""', '"')
+        if qualifier in remove_space_keys:
+            value = value.replace(" ", "")
+        feature.qualifiers.setdefault(qualifier, []).append(value)
+
+    return feature
+
+
+def _parse_location(text):
+
+    text = text.replace(" ", "")
+    operator = "join"
+
+    for op in ["join", "order"]:
+        if text.startswith(op + "(") and text.endswith(")"):
+            operator = op
+
+    parts = [FeatureLocation(start, end, strand=strand) for start, end, strand in _parse_parts(text)]
+
+    return parts[0] if len(parts) == 1 else CompoundLocation(parts, operator=operator)
+
+
+def _parse_parts(text):
+
+    if text.startswith("complement(") and text.endswith(")"):
+        return [(start, end, -strand) for start, end, strand in reversed(_parse_parts(text[11:-1]))]
+
+    for op in ["join(", "order("]:
+        if text.startswith(op) and text.endswith(")"):
+            return [part for item in _split_top_level(text[len(op):-1]) for part in _parse_parts(item)]
+
+    m = _range.match(text)
+    if m is None:
+        raise ValueError(f'Unsupported location: {text}')
+
+    start = int(m.group(2)) - 1
+    end = int(m.group(4)) if m.group(4) else int(m.group(2))
+
+    return [(
+        BeforePosition(start) if m.group(1) else ExactPosition(start),
+        AfterPosition(end) if m.group(3) or m.group(5) else ExactPosition(end),
+        1
+    )]
+
+
+def _split_top_level(text):
+
+    items = []
+    depth = 0
+    current = ""
+
+    for c in text:
+        if c == "," and depth == 0:
+            items.append(current)
+            current = ""
+            continue
+        depth += (c == "(") - (c == ")")
+        current += c
+
+    items.append(current)
+
+    return items
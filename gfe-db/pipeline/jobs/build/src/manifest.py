@@ -0,0 +1,105 @@
+import os
+import json
+import logging
+from glob import glob
+from hashlib import sha256
+from datetime import datetime
+
+logger = logging.getLogger()
+
+# Allele counters that are summed when shard manifests are combined
+allele_counts = ["dat_records", "alleles_processed", "alleles_failed"]
+
+
+def describe_csv(csv_path):
+    """Row count, size and SHA-256 of a build CSV in one read. The build CSVs
+    have no line breaks inside fields."""
+
+    num_lines = 0
+    num_bytes = 0
+    last_byte = b""
+    digest = sha256()
+
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 ** 2), b""):
+            num_lines += chunk.count(b"\n")
+            num_bytes += len(chunk)
+            last_byte = chunk[-1:]
+            digest.update(chunk)
+
+    if last_byte and last_byte != b"\n":
+        num_lines += 1
+
+    return {
+        "file": os.path.basename(csv_path),
+        "rows": max(num_lines - 1, 0),
+        "bytes": num_bytes,
+        "sha256": digest.hexdigest(),
+    }
+
+
+def csv_name(csv_path):
+    return os.path.basename(csv_path).split(".")[0]
+
+
+def build_manifest(release, csv_paths, part=None, limit=None, groups=None, **counts):
+    """Describes the output of a build: the allele counters of the build,
+    the ARD groups written to all_groups for each allele and the row count,
+    size and checksum of each CSV. The state machine reads it to decide
+    whether an existing build can be reused and validate_build_output
+    reconciles the files against it. It is written last, so its presence
+    means the build completed."""
+
+    files = {csv_name(csv_path): describe_csv(csv_path) for csv_path in sorted(csv_paths)}
+
+    manifest = {
+        "release": release,
+        "part": part,
+        "limit": limit,
+        "groups": groups,
+        "complete": True,
+        "created_utc": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + "Z",
+        **{k: counts.get(k, 0) for k in allele_counts},
+        "files": files,
+    }
+
+    # Every built allele has exactly one gfe_sequences row
+    manifest["alleles_built"] = files.get("gfe_sequences", {}).get("rows", 0)
+
+    return manifest
+
+
+def write_manifest(path, manifest):
+
+    with open(f'{path}.tmp', "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+    logging.info(f'Wrote manifest for {len(manifest["files"])} files to {path}')
+
+    return manifest
+
+
+def combine_manifests(manifest_paths, release, csv_paths):
+    """Builds the manifest of merged shard output, summing the allele
+    counters of the shard manifests and counting the merged CSV rows"""
+
+    counts = {k: 0 for k in allele_counts}
+    limit = None
+    groups = None
+
+    for path in manifest_paths:
+        with open(path) as f:
+            part_manifest = json.load(f)
+        for k in allele_counts:
+            counts[k] += part_manifest.get(k, 0)
+        limit = part_manifest.get("limit") or limit
+        groups = part_manifest.get("groups") or groups
+
+    return build_manifest(release, csv_paths, limit=limit, groups=groups, **counts)
+
+
+def release_csv_paths(csv_dir, release):
+    """Paths of the full release CSVs in csv_dir"""
+
+    return glob(f'{csv_dir}/*.{release}.csv')
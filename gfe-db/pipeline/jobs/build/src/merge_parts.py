@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import os
+import re
+import sys
+import shutil
+import logging
+import argparse
+from glob import glob
+from manifest import combine_manifests, write_manifest
+from sequences import SEQUENCES_CSV, SequenceTable
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO)
+
+
+def find_parts(parts_dir, release):
+    """Returns {csv_name: [part paths]} for the part files written by a
+    sharded build, in part order"""
+
+    pattern = re.compile(rf'^(.+)\.{re.escape(release)}\.(part.*)\.csv$')
+    parts = {}
+
+    for path in sorted(glob(f'{parts_dir}/*.{release}.part*.csv')):
+        m = pattern.match(os.path.basename(path))
+        if m:
+            parts.setdefault(m.group(1), []).append(path)
+
+    return parts
+
+
+def copy_new_sequences(f, out, sequence_table):
+    """Copies the rows of a sequences part whose seq_id, the first column,
+    has not been written yet"""
+
+    for line in f:
+        if sequence_table.add(line.split(b",", 1)[0]):
+            out.write(line)
+
+
+def merge_parts(parts_dir, csv_dir, release):
+    """Concatenates the part files of each CSV into {csv_name}.{release}.csv,
+    keeping only the first header, and writes the release manifest next to
+    csv_dir. Sequences shared by several shards are kept once. Returns the
+    merged file paths."""
+
+    parts = find_parts(parts_dir, release)
+
+    if not parts:
+        raise FileNotFoundError(f'No part files found for release {release} in {parts_dir}')
+
+    os.makedirs(csv_dir, exist_ok=True)
+    merged = []
+
+    for csv_name, paths in parts.items():
+        out_path = f'{csv_dir}/{csv_name}.{release}.csv'
+        header = None
+        sequence_table = SequenceTable()
+
+        with open(out_path, 'wb') as out:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    part_header = f.readline()
+
+                    # Empty part files have no header
+                    if not part_header:
+                        continue
+
+                    if header is None:
+                        header = part_header
+                        out.write(header)
+                    elif part_header != header:
+                        raise ValueError(f'Header of {path} does not match {paths[0]}')
+
+                    if csv_name == SEQUENCES_CSV:
+                        copy_new_sequences(f, out, sequence_table)
+                    else:
+                        shutil.copyfileobj(f, out)
+
+        logging.info(f'Merged {len(paths)} parts into {out_path}')
+        merged.append(out_path)
+
+    # The release manifest sums the shard counters and counts the merged rows
+    manifest_paths = sorted(glob(f'{parts_dir}/manifest.{release}.part*.json'))
+    if manifest_paths:
+        write_manifest(
+            f'{os.path.dirname(os.path.abspath(csv_dir))}/manifest.json',
+            combine_manifests(manifest_paths, release, merged))
+    else:
+        logging.warning(f'No shard manifests found in {parts_dir}, not writing a release manifest')
+
+    return merged
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--parts_dir",
+                        required=True,
+                        help="Directory of part files written by sharded builds",
+                        type=str)
+
+    parser.add_argument("-o", "--out_dir",
+                        required=True,
+                        help="Directory for the merged CSVs",
+                        type=str)
+
+    parser.add_argument("-r", "--release",
+                        required=True,
+                        help="IMGT/HLA release version",
+                        type=str)
+
+    args = parser.parse_args()
+
+    try:
+        merge_parts(args.parts_dir, args.out_dir, args.release)
+    except Exception as e:
+        logging.error(f'Failed to merge parts: {e}')
+        sys.exit(1)
@@ -0,0 +1,123 @@
+import math
+import time
+import json
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+
+class StageTimer:
+    """Accumulates the wall time of named stages for the current allele.
+    `pop` returns {stage: seconds} and starts the next allele."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def pop(self):
+        timings = self.timings
+        self.timings = {}
+        return timings
+
+
+def timed(iterable, timer, name):
+    """Yields from `iterable`, adding the time spent producing each item to
+    stage `name` of `timer`"""
+
+    iterator = iter(iterable)
+
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timer.add(name, time.perf_counter() - start)
+        yield item
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+
+    if not sorted_values:
+        return None
+
+    k = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+class BuildMetrics:
+    """Collects the stage timings of every allele in a build and summarizes
+    them as percentiles per stage and throughput per locus"""
+
+    percentiles = [50, 90, 99]
+
+    def __init__(self, release):
+        self.release = release
+        self.start = time.time()
+        self.stages = {}
+        self.loci = {}
+
+    def add(self, locus, timings):
+        for stage, seconds in timings.items():
+            self.stages.setdefault(stage, []).append(seconds)
+
+        counts = self.loci.setdefault(locus or "unknown", {"alleles": 0, "seconds": 0.0})
+        counts["alleles"] += 1
+        counts["seconds"] += sum(timings.values())
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        num_alleles = sum(counts["alleles"] for counts in self.loci.values())
+
+        stages = {}
+        for stage, values in self.stages.items():
+            values = sorted(values)
+            stages[stage] = {
+                "count": len(values),
+                "total_seconds": round(sum(values), 3),
+                "mean_seconds": round(sum(values) / len(values), 6),
+                **{f'p{p}_seconds': round(percentile(values, p), 6) for p in self.percentiles},
+                "max_seconds": round(values[-1], 6),
+            }
+
+        loci = {
+            locus: {
+                "alleles": counts["alleles"],
+                "seconds": round(counts["seconds"], 3),
+                "alleles_per_second": round(counts["alleles"] / counts["seconds"], 3) if counts["seconds"] else None,
+            }
+            for locus, counts in sorted(self.loci.items())
+        }
+
+        return {
+            "release": self.release,
+            "elapsed_seconds": round(elapsed, 3),
+            "alleles": num_alleles,
+            "alleles_per_second": round(num_alleles / elapsed, 3) if elapsed else None,
+            "stages": stages,
+            "loci": loci,
+        }
+
+    def write(self, path, **extra):
+        summary = self.summary()
+        summary.update(extra)
+
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+        logging.info(f'Wrote build metrics to {path}')
+
+        return summary
@@ -0,0 +1,107 @@
+import os
+import time
+import json
+import logging
+import resource
+import tracemalloc
+
+logger = logging.getLogger()
+
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes(pid="self"):
+    """Current resident set size of a process, None if it cannot be read"""
+
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _page_size
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def child_pids():
+    """PIDs of the direct children of this process, such as pool workers"""
+
+    pid = os.getpid()
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+class MemoryProfiler:
+    """Sampling memory profiler for the build.
+
+    Every `interval` alleles it appends a line to the RSS timeline
+    (mem_profile_rss.ndjson) with the RSS of the build process and its
+    workers, the peak RSS and the tracemalloc totals. It also appends the
+    `top_n` allocation sites that grew the most since the previous sample
+    to mem_profile_diff.txt. Only the main process is traced, and only
+    `frames` frames are kept per allocation, to keep the overhead low
+    enough for release builds."""
+
+    def __init__(self, log_dir, interval=100, top_n=10, frames=1, part=None):
+        self.interval = max(interval, 1)
+        self.top_n = top_n
+        suffix = f'.{part}' if part else ''
+        self.rss_path = f'{log_dir}/mem_profile_rss{suffix}.ndjson'
+        self.diff_path = f'{log_dir}/mem_profile_diff{suffix}.txt'
+        self.start = time.time()
+        self.num_samples = 0
+
+        tracemalloc.start(frames)
+        self.snapshot = self._take_snapshot()
+
+        logging.info(f'Memory profiling every {self.interval} alleles to {self.rss_path} and {self.diff_path}')
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+    def step(self, num_alleles):
+        """Takes a sample if `num_alleles` falls on the interval"""
+
+        if num_alleles % self.interval == 0:
+            self.sample(num_alleles)
+
+    def sample(self, num_alleles):
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        workers_rss = [rss_bytes(pid) for pid in child_pids()]
+
+        with open(self.rss_path, "a") as f:
+            f.write(json.dumps({
+                "seconds": round(time.time() - self.start, 3),
+                "alleles": num_alleles,
+                "rss_mb": _mb(rss_bytes()),
+                # ru_maxrss is in kilobytes on Linux
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "workers_rss_mb": _mb(sum(rss for rss in workers_rss if rss)) if workers_rss else None,
+                "traced_mb": _mb(traced_current),
+                "traced_peak_mb": _mb(traced_peak),
+            }) + "\n")
+
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self.snapshot, "lineno")[:self.top_n]
+        self.snapshot = snapshot
+
+        with open(self.diff_path, "a") as f:
+            f.write(f'# {num_alleles} alleles, {round(time.time() - self.start, 1)} seconds\n')
+            for stat in stats:
+                f.write(f'{stat}\n')
+            f.write("\n")
+
+        self.num_samples += 1
+
+    def close(self, num_alleles):
+        self.sample(num_alleles)
+        tracemalloc.stop()
+        logging.info(f'Wrote {self.num_samples} memory profile samples')
+
+
+def _mb(num_bytes):
+    return round(num_bytes / 1024 ** 2, 1) if num_bytes is not None else None
@@ -0,0 +1,66 @@
+class FeatureRecord:
+    """Row of all_features.RELEASE.csv. Built directly from the attributes of
+    a seqann feature instead of parsing its string representation. The
+    sequence is kept on the record but written to sequences.RELEASE.csv,
+    the row references it by `seq_id`."""
+
+    # Column order of all_features.RELEASE.csv
+    fields = (
+        "accession",
+        "hash_code",
+        "locus",
+        "rank",
+        "seq_id",
+        "term",
+        "gfe_name",
+        "allele_id",
+        "hla_name",
+        "imgt_release",
+        "feature_id",
+    )
+
+    __slots__ = fields + ("sequence",)
+
+    def __init__(self, accession, hash_code, locus, rank, sequence, term,
+                 gfe_name=None, allele_id=None, hla_name=None, imgt_release=None, feature_id=None,
+                 seq_id=None):
+        self.accession = accession
+        self.hash_code = hash_code
+        self.locus = locus
+        self.rank = rank
+        self.sequence = sequence
+        self.term = term
+        self.gfe_name = gfe_name
+        self.allele_id = allele_id
+        self.hla_name = hla_name
+        self.imgt_release = imgt_release
+        self.feature_id = feature_id
+        self.seq_id = seq_id
+
+    @classmethod
+    def from_seqann(cls, feature):
+        """Converts a feature returned by `GFE.get_gfe`"""
+        return cls(
+            feature.accession,
+            feature.hash_code,
+            feature.locus,
+            feature.rank,
+            feature.sequence,
+            feature.term)
+
+    def __reduce__(self):
+        # Rows are pickled from the build workers to the writer. Pickling
+        # the constructor arguments is about twice as fast as the default
+        # state of a slotted object.
+        return (type(self), (self.accession, self.hash_code, self.locus, self.rank, self.sequence, self.term,
+                             self.gfe_name, self.allele_id, self.hla_name, self.imgt_release, self.feature_id,
+                             self.seq_id))
+
+    def values(self):
+        return [getattr(self, field) for field in self.fields]
+
+    def to_dict(self):
+        return dict(zip(self.fields, self.values()))
+
+    def __repr__(self):
+        return f'FeatureRecord({self.to_dict()})'
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""Parallel S3 transfers of build files, shared by run.sh and the database
+load_db.sh.
+
+Files are transferred concurrently and each file uses multipart uploads or
+ranged downloads. Uploads record the SHA-256 of the uncompressed content in
+the object metadata and downloads verify it. With --gzip, files are
+compressed while they are streamed to S3 as {name}.gz. With --decompress,
+.gz objects are decompressed while they are downloaded.
+
+    python3 s3_transfer.py upload <dir> s3://<bucket>/<prefix>/ [--exclude 'checkpoint.*'] [--gzip]
+    python3 s3_transfer.py download s3://<bucket>/<prefix>/ <dir> [--decompress]
+
+Use --endpoint-url (or S3_ENDPOINT_URL) to run against a local S3 stand-in.
+"""
+import os
+import sys
+import gzip
+import fnmatch
+import logging
+import argparse
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO)
+
+MB = 1024 ** 2
+
+# Object metadata key of the uncompressed content checksum
+CHECKSUM_KEY = "sha256"
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def parse_s3_uri(uri):
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def file_sha256(path, chunk_size=8 * MB, decompress=False):
+    """SHA-256 of a file, or of its uncompressed content for gzip files with
+    decompress=True"""
+
+    digest = sha256()
+    with (gzip.open(path, "rb") if decompress else open(path, "rb")) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_selected(name, include=None, exclude=None):
+    if include and not any(fnmatch.fnmatch(name, pattern) for pattern in include):
+        return False
+    return not any(fnmatch.fnmatch(name, pattern) for pattern in (exclude or []))
+
+
+class GzipStream:
+    """Readable file object of the gzip compressed content of a file, so it
+    can be uploaded without writing the compressed file to disk"""
+
+    def __init__(self, path, chunk_size=8 * MB):
+        self.f = open(path, "rb")
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.writer = gzip.GzipFile(fileobj=self, mode="wb", mtime=0)
+        self.eof = False
+        # Number of compressed bytes read, the size of the uploaded object
+        self.size = 0
+
+    def write(self, data):
+        # Called by GzipFile with compressed bytes
+        self.buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.f.read(self.chunk_size)
+            if chunk:
+                self.writer.write(chunk)
+            else:
+                self.writer.close()
+                self.eof = True
+
+        size = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class S3Transfer:
+    """Transfers files between a local directory and an S3 prefix.
+    `workers` files are transferred at once, each with up to `concurrency`
+    threads for its parts."""
+
+    def __init__(self, workers=4, concurrency=10, chunk_size=16 * MB, endpoint_url=None):
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+        self.workers = workers
+        self.config = TransferConfig(
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size,
+            max_concurrency=concurrency)
+
+    def upload_file(self, path, bucket, key, compress=False):
+        """Uploads a file with its checksum in the object metadata. Returns
+        the key of the object."""
+
+        checksum = file_sha256(path)
+        extra_args = {"Metadata": {CHECKSUM_KEY: checksum}}
+
+        if compress:
+            key = f'{key}.gz'
+            stream = GzipStream(path)
+            try:
+                self.s3.upload_fileobj(stream, bucket, key, ExtraArgs=extra_args, Config=self.config)
+            finally:
+                stream.close()
+            expected_size = stream.size
+        else:
+            self.s3.upload_file(path, bucket, key, ExtraArgs=extra_args, Config=self.config)
+            expected_size = os.path.getsize(path)
+
+        # Objects must have the size of the uploaded content, compressed
+        # objects the number of compressed bytes streamed, and the checksum
+        # that downloads verify
+        head = self.s3.head_object(Bucket=bucket, Key=key)
+        if head["ContentLength"] != expected_size:
+            raise ChecksumError(f'Size of s3://{bucket}/{key} ({head["ContentLength"]}) does not match {path} ({expected_size})')
+        if head["Metadata"].get(CHECKSUM_KEY) != checksum:
+            raise ChecksumError(f'Checksum of s3://{bucket}/{key} was not recorded')
+
+        logging.info(f'Uploaded {path} to s3://{bucket}/{key}')
+        return key
+
+    def download_file(self, bucket, key, path, decompress=False):
+        """Downloads an object and verifies its checksum if it has one.
+        Returns the path of the file."""
+
+        expected = self.s3.head_object(Bucket=bucket, Key=key)["Metadata"].get(CHECKSUM_KEY)
+
+        if decompress and key.endswith(".gz"):
+            path = path[:-len(".gz")]
+            digest = sha256()
+            body = self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+            with gzip.GzipFile(fileobj=body, mode="rb") as stream, open(f'{path}.tmp', "wb") as f:
+                for chunk in iter(lambda: stream.read(8 * MB), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            actual = digest.hexdigest()
+        else:
+            self.s3.download_file(bucket, key, f'{path}.tmp', Config=self.config)
+
+            # The checksum of compressed uploads is of the uncompressed content
+            actual = file_sha256(f'{path}.tmp', decompress=key.endswith(".gz")) if expected else None
+
+        if expected and actual != expected:
+            os.remove(f'{path}.tmp')
+            raise ChecksumError(f'Checksum of s3://{bucket}/{key} does not match: expected {expected}, found {actual}')
+
+        os.replace(f'{path}.tmp', path)
+        logging.info(f'Downloaded s3://{bucket}/{key} to {path}')
+        return path
+
+    def list_keys(self, bucket, prefix):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith("/"):
+                    yield obj["Key"]
+
+    def upload(self, local_dir, s3_uri, include=None, exclude=None, compress=False):
+        """Uploads the files of local_dir to the S3 prefix. Returns the keys."""
+
+        bucket, prefix = parse_s3_uri(s3_uri)
+        prefix = prefix.rstrip("/")
+        paths = sorted(
+            os.path.join(local_dir, name) for name in os.listdir(local_dir)
+            if os.path.isfile(os.path.join(local_dir, name)) and is_selected(name, include, exclude))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self.upload_file, path, bucket,
+                    f'{prefix}/{os.path.basename(path)}' if prefix else os.path.basename(path), compress)
+                for path in paths]
+            return [future.result() for future in futures]
+
+    def download(self, s3_uri, local_dir, include=None, exclude=None, decompress=False):
+        """Downloads the objects under the S3 prefix to local_dir. Returns
+        the file paths."""
+
+        bucket, prefix = parse_s3_uri(s3_uri)
+        os.makedirs(local_dir, exist_ok=True)
+        keys = [
+            key for key in self.list_keys(bucket, prefix)
+            if is_selected(os.path.basename(key), include, exclude)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self.download_file, bucket, key,
+                    os.path.join(local_dir, os.path.basename(key)), decompress)
+                for key in keys]
+            return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("command",
+                        choices=["upload", "download"],
+                        help="Upload a directory to an S3 prefix or download an S3 prefix to a directory")
+
+    parser.add_argument("source",
+                        help="Local directory to upload or S3 URI to download",
+                        type=str)
+
+    parser.add_argument("destination",
+                        help="S3 URI to upload to or local directory to download to",
+                        type=str)
+
+    parser.add_argument("--include",
+                        help="Only transfer file names matching this pattern, can be repeated",
+                        action="append")
+
+    parser.add_argument("--exclude",
+                        help="Skip file names matching this pattern, can be repeated",
+                        action="append")
+
+    parser.add_argument("--gzip",
+                        help="Compress files while uploading them as {name}.gz",
+                        action="store_true")
+
+    parser.add_argument("--decompress",
+                        help="Decompress .gz objects while downloading them",
+                        action="store_true")
+
+    parser.add_argument("-w", "--workers",
+                        help="Number of files transferred at once",
+                        type=int,
+                        default=4)
+
+    parser.add_argument("-c", "--concurrency",
+                        help="Number of threads for the parts of each file",
+                        type=int,
+                        default=10)
+
+    parser.add_argument("--chunk-size",
+                        help="Part size in MB for multipart uploads and ranged downloads",
+                        type=int,
+                        default=16)
+
+    parser.add_argument("--endpoint-url",
+                        help="S3 endpoint, for example a local S3 stand-in",
+                        type=str,
+                        default=os.environ.get("S3_ENDPOINT_URL"))
+
+    args = parser.parse_args()
+
+    transfer = S3Transfer(
+        workers=args.workers,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size * MB,
+        endpoint_url=args.endpoint_url)
+
+    try:
+        if args.command == "upload":
+            transfer.upload(args.source, args.destination, args.include, args.exclude, compress=args.gzip)
+        else:
+            transfer.download(args.source, args.destination, args.include, args.exclude, decompress=args.decompress)
+    except Exception as e:
+        logging.error(f'Failed to {args.command} files: {e}')
+        sys.exit(1)
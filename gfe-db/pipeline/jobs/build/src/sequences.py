@@ -0,0 +1,71 @@
+import os
+import csv
+import logging
+
+logger = logging.getLogger()
+
+# Sequences are longer than the default field size limit
+csv.field_size_limit(2 ** 31 - 1)
+
+# Name and columns of the content-addressed sequence table. Other CSVs
+# reference its rows by `seq_id`.
+SEQUENCES_CSV = "sequences"
+sequence_fields = ["seq_id", "sequence"]
+
+
+def build_sequence(seq_id, sequence):
+    """Row of sequences.RELEASE.csv"""
+    return {
+        "seq_id": seq_id,
+        "sequence": sequence
+    }
+
+
+class SequenceTable:
+    """IDs of the sequences already written to sequences.RELEASE.csv, so that
+    each distinct sequence is written once however many alleles, features or
+    CDS rows reference it."""
+
+    def __init__(self):
+        self.seq_ids = set()
+
+    def __len__(self):
+        return len(self.seq_ids)
+
+    def add(self, seq_id):
+        """Returns True if the sequence has not been written yet"""
+
+        if seq_id in self.seq_ids:
+            return False
+
+        self.seq_ids.add(seq_id)
+        return True
+
+    def load(self, csv_path):
+        """Adds the IDs of an existing sequences CSV, used to resume a build
+        from a checkpoint after the CSV was truncated"""
+
+        if not os.path.isfile(csv_path):
+            return self
+
+        with open(csv_path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.seq_ids.add(row["seq_id"])
+
+        logging.info(f'Loaded {len(self.seq_ids)} sequence IDs from {csv_path}')
+
+        return self
+
+
+def read_sequences(csv_path, seq_ids=None):
+    """Returns {seq_id: sequence} of a sequences CSV, only for `seq_ids` if
+    given"""
+
+    sequences = {}
+
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            if seq_ids is None or row["seq_id"] in seq_ids:
+                sequences[row["seq_id"]] = row["sequence"]
+
+    return sequences
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+import os
+import sys
+import csv
+import logging
+import argparse
+from datetime import date, datetime
+from hashing import feature_id
+from constants import ard_groups
+from sequences import SEQUENCES_CSV
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO)
+
+# Sequences are longer than the default field size limit
+csv.field_size_limit(2 ** 31 - 1)
+
+# Submitter of all IPD-IMGT/HLA data, same as load.cyp
+submitter = {
+    "institution": "IPD",
+    "name": "IPD-IMGT",
+    "url": "https://www.ebi.ac.uk/ipd/imgt/hla/",
+    "email": "<email>",
+}
+
+# neo4j-admin import headers of the node and relationship files. The ID
+# columns are also stored as properties. Properties match load.cyp.
+import_headers = {
+    "gfe_nodes": ["name:ID(GFE)", "locus", ":LABEL"],
+    "sequence_nodes": ["seq_id:ID(Sequence)", "name", "locus", "sequence", "length", ":LABEL"],
+    "feature_nodes": ["feature_id:ID(Feature)", "locus", "rank", "term", "accession", "seq_id", "sequence", ":LABEL"],
+    "ipd_allele_nodes": ["name:ID(IPD_Allele)", "gene", *ard_groups, ":LABEL"],
+    "ipd_accession_nodes": ["name:ID(IPD_Accession)", ":LABEL"],
+    "submitter_nodes": ["email:ID(Submitter)", "institution", "name", "url", ":LABEL"],
+    "release_stats_nodes": [
+        "release:ID(ReleaseStats)", "imgt_release", "gfes:long", "alleles:long", "accessions:long", "updated:datetime", ":LABEL"],
+    "has_ipd_allele_rels": [":START_ID(GFE)", ":END_ID(IPD_Allele)", "releases:string[]", ":TYPE"],
+    "has_ipd_accession_rels": [":START_ID(GFE)", ":END_ID(IPD_Accession)", "release", ":TYPE"],
+    "submitted_rels": [":START_ID(Submitter)", ":END_ID(GFE)", "submit_date:date", ":TYPE"],
+    "has_sequence_rels": [":START_ID(GFE)", ":END_ID(Sequence)", ":TYPE"],
+    "has_feature_rels": [":START_ID(GFE)", ":END_ID(Feature)", ":TYPE"],
+}
+
+
+def read_rows(csv_path):
+    with open(csv_path, newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def allele_groups(csv_path):
+    """Returns {hla_name: {ard_name: ard_id}} of the G, lg and lgx groups in
+    all_groups"""
+
+    groups = {}
+    for row in read_rows(csv_path):
+        if row["ard_name"] in ard_groups:
+            groups.setdefault(row["hla_name"], {})[row["ard_name"]] = row["ard_id"]
+    return groups
+
+
+def convert_release(csv_dir, import_dir, release):
+    """Streams the release CSVs into node and relationship files for
+    `neo4j-admin database import` in {import_dir}/{name}.{release}.csv.
+    Nodes and relationships are written once, as load.cyp would MERGE them.
+    Sequence and Feature nodes are written from sequences.RELEASE.csv once
+    their properties are known, so memory holds the IDs already written and
+    the properties of those nodes but no sequences. Returns the file paths."""
+
+    os.makedirs(import_dir, exist_ok=True)
+
+    paths = {name: f'{import_dir}/{name}.{release}.csv' for name in import_headers}
+    files = {name: open(path, "w", newline="") for name, path in paths.items()}
+    writers = {name: csv.writer(f) for name, f in files.items()}
+
+    try:
+        for name, header in import_headers.items():
+            writers[name].writerow(header)
+
+        writers["submitter_nodes"].writerow([
+            submitter["email"], submitter["institution"], submitter["name"], submitter["url"], "Submitter"])
+
+        groups = allele_groups(f'{csv_dir}/all_groups.{release}.csv')
+        submit_date = date.today().isoformat()
+
+        # The first allele of each GFE owns its HAS_FEATURE relationships,
+        # alleles with the same GFE have the same features
+        feature_owner = {}
+        sequence_nodes = {}
+        alleles = set()
+        accessions = set()
+        imgt_release = None
+        num_allele_rels = 0
+        num_accession_rels = 0
+
+        for row in read_rows(f'{csv_dir}/gfe_sequences.{release}.csv'):
+            gfe_name = row["gfe_name"]
+
+            if gfe_name not in feature_owner:
+                feature_owner[gfe_name] = row["hla_name"]
+                writers["gfe_nodes"].writerow([gfe_name, row["locus"], "GFE"])
+                writers["submitted_rels"].writerow([submitter["email"], gfe_name, submit_date, "SUBMITTED"])
+
+                if row["seq_id"] not in sequence_nodes:
+                    sequence_nodes[row["seq_id"]] = (gfe_name, row["locus"], row["length"])
+                writers["has_sequence_rels"].writerow([gfe_name, row["seq_id"], "HAS_SEQUENCE"])
+
+            if row["hla_name"] not in alleles:
+                alleles.add(row["hla_name"])
+                allele_group = groups.get(row["hla_name"], {})
+                writers["ipd_allele_nodes"].writerow([
+                    row["hla_name"], row["locus"], *[allele_group.get(grp, "") for grp in ard_groups], "IPD_Allele"])
+                writers["has_ipd_allele_rels"].writerow([
+                    gfe_name, row["hla_name"], row["imgt_release"].replace(".", ""), "HAS_IPD_ALLELE"])
+                num_allele_rels += 1
+
+            if row["acc_name"] not in accessions:
+                accessions.add(row["acc_name"])
+                writers["ipd_accession_nodes"].writerow([row["acc_name"], "IPD_Accession"])
+            writers["has_ipd_accession_rels"].writerow([gfe_name, row["acc_name"], row["imgt_release"], "HAS_IPD_ACCESSION"])
+            num_accession_rels += 1
+            imgt_release = row["imgt_release"]
+
+        # Same statistics as the last statement of load.cyp
+        if imgt_release:
+            writers["release_stats_nodes"].writerow([
+                imgt_release.replace(".", ""), imgt_release, len(feature_owner), num_allele_rels, num_accession_rels,
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), "ReleaseStats"])
+
+        features = set()
+        feature_nodes = {}
+
+        for row in read_rows(f'{csv_dir}/all_features.{release}.csv'):
+            # Builds before feature_id was added to all_features
+            f_id = row.get("feature_id") or feature_id(row["locus"], row["rank"], row["term"], row["accession"])
+
+            if f_id not in features:
+                features.add(f_id)
+                feature_nodes.setdefault(row["seq_id"], []).append(
+                    (f_id, row["locus"], row["rank"], row["term"], row["accession"]))
+
+            if feature_owner.get(row["gfe_name"]) == row["hla_name"]:
+                writers["has_feature_rels"].writerow([row["gfe_name"], f_id, "HAS_FEATURE"])
+
+        for row in read_rows(f'{csv_dir}/{SEQUENCES_CSV}.{release}.csv'):
+            seq_id, sequence = row["seq_id"], row["sequence"]
+
+            if seq_id in sequence_nodes:
+                name, locus, length = sequence_nodes.pop(seq_id)
+                writers["sequence_nodes"].writerow([seq_id, name, locus, sequence, length, "Sequence"])
+
+            for f_id, locus, rank, term, accession in feature_nodes.pop(seq_id, []):
+                writers["feature_nodes"].writerow([f_id, locus, rank, term, accession, seq_id, sequence, "Feature"])
+
+        if sequence_nodes or feature_nodes:
+            raise ValueError(
+                f'{len(sequence_nodes) + len(feature_nodes)} sequence IDs are missing from '
+                f'{csv_dir}/{SEQUENCES_CSV}.{release}.csv')
+
+    finally:
+        for f in files.values():
+            f.close()
+
+    logging.info(f'Wrote {len(feature_owner)} GFEs, {len(alleles)} alleles and {len(features)} features to {import_dir}')
+
+    return list(paths.values())
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--csv_dir",
+                        required=True,
+                        help="Directory of the release CSVs",
+                        type=str)
+
+    parser.add_argument("-o", "--out_dir",
+                        required=True,
+                        help="Directory for the neo4j-admin import files",
+                        type=str)
+
+    parser.add_argument("-r", "--release",
+                        required=True,
+                        help="IMGT/HLA release version",
+                        type=str)
+
+    args = parser.parse_args()
+
+    try:
+        convert_release(args.csv_dir, args.out_dir, args.release)
+    except Exception as e:
+        logging.error(f'Failed to write import files: {e}')
+        sys.exit(1)
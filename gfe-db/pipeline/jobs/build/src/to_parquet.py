@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import os
+import sys
+import logging
+import argparse
+from constants import csv_schemas
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO)
+
+# Sequences can be several kilobases, a block must hold whole rows
+block_size = 64 * 1024 ** 2
+
+
+def to_parquet(csv_path, parquet_path, schema, compression="zstd"):
+    """Streams a build CSV into a Parquet file typed with `schema`, a map of
+    column name to Arrow type name. Returns the number of rows written."""
+
+    arrow_schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in schema.items()])
+    num_rows = 0
+
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=arrow_schema,
+            include_columns=list(schema.keys())))
+
+    with pq.ParquetWriter(parquet_path, arrow_schema, compression=compression) as writer:
+        for batch in reader:
+            writer.write_table(pa.Table.from_batches([batch]).select(arrow_schema.names).cast(arrow_schema))
+            num_rows += batch.num_rows
+
+    return num_rows
+
+
+def convert_release(csv_dir, parquet_dir, release):
+    """Converts the CSVs of a release that have a schema in `csv_schemas` to
+    {parquet_dir}/{csv_name}.{release}.parquet. Returns the Parquet paths."""
+
+    if pa is None:
+        raise ImportError("pyarrow is required to write Parquet output")
+
+    os.makedirs(parquet_dir, exist_ok=True)
+    paths = []
+
+    for csv_name, schema in csv_schemas.items():
+        csv_path = f'{csv_dir}/{csv_name}.{release}.csv'
+
+        if not os.path.isfile(csv_path):
+            logging.info(f'No {csv_name} CSV for release {release}, skipping')
+            continue
+
+        parquet_path = f'{parquet_dir}/{csv_name}.{release}.parquet'
+        num_rows = to_parquet(csv_path, parquet_path, schema)
+
+        logging.info(f'Wrote {num_rows} rows to {parquet_path}')
+        paths.append(parquet_path)
+
+    return paths
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--csv_dir",
+                        required=True,
+                        help="Directory of the release CSVs",
+                        type=str)
+
+    parser.add_argument("-o", "--out_dir",
+                        required=True,
+                        help="Directory for the Parquet files",
+                        type=str)
+
+    parser.add_argument("-r", "--release",
+                        required=True,
+                        help="IMGT/HLA release version",
+                        type=str)
+
+    args = parser.parse_args()
+
+    try:
+        convert_release(args.csv_dir, args.out_dir, args.release)
+    except Exception as e:
+        logging.error(f'Failed to write Parquet files: {e}')
+        sys.exit(1)
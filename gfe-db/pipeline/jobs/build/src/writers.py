@@ -0,0 +1,113 @@
+import os
+import logging
+import csv
+from glob import glob
+
+logger = logging.getLogger()
+
+
+class CsvWriterRegistry:
+    """Keeps one open handle and CSV writer per output CSV for the whole
+    build. Rows are buffered and written in batches, the header is written
+    once when a file is first created. Rows are dicts or records with `fields`
+    and `values()`, such as `FeatureRecord`. Use as a context manager so that
+    all buffered rows are flushed and the files closed on exit, including
+    when the build is aborted. Sharded builds pass a `part` name so each
+    shard writes its own part files, see merge_parts.py."""
+
+    def __init__(self, csv_dir, release, batch_size=1000, part=None):
+        self.csv_dir = csv_dir[:-1] if csv_dir[-1] == "/" else csv_dir
+        self.release = release
+        self.part = part
+        self.batch_size = batch_size
+        self._files = {}
+        self._writers = {}
+        self._headers = {}
+        self._buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def path(self, csv_name):
+        if self.part:
+            return f'{self.csv_dir}/{csv_name}.{self.release}.{self.part}.csv'
+        return f'{self.csv_dir}/{csv_name}.{self.release}.csv'
+
+    def _open(self, csv_name, header):
+        file_path = self.path(csv_name)
+        is_new_file = not os.path.isfile(file_path) or os.path.getsize(file_path) == 0
+
+        write_obj = open(file_path, 'a', newline='')
+        writer = csv.writer(write_obj)
+
+        # Appending to an existing file must not repeat the header
+        if is_new_file:
+            writer.writerow(header)
+
+        self._files[csv_name] = write_obj
+        self._writers[csv_name] = writer
+        self._headers[csv_name] = header
+        self._buffers[csv_name] = []
+
+    def write(self, csv_name, row):
+        """Buffers a row for `csv_name`, opening the file on first use"""
+
+        if not row:
+            return
+
+        is_dict = isinstance(row, dict)
+
+        if csv_name not in self._writers:
+            self._open(csv_name, list(row.keys()) if is_dict else list(row.fields))
+
+        buffer = self._buffers[csv_name]
+        buffer.append([row.get(k) for k in self._headers[csv_name]] if is_dict else row.values())
+
+        if len(buffer) >= self.batch_size:
+            self._flush(csv_name)
+
+    def _flush(self, csv_name):
+        try:
+            self._writers[csv_name].writerows(self._buffers[csv_name])
+            self._buffers[csv_name].clear()
+            self._files[csv_name].flush()
+        except Exception as e:
+            logging.error(f'Could not write rows to {self.path(csv_name)}: {e}')
+            raise e
+
+    def flush(self):
+        for csv_name in self._writers:
+            self._flush(csv_name)
+
+    def sizes(self):
+        """Flushes all buffered rows and returns {path: size in bytes} of
+        every open CSV"""
+
+        self.flush()
+        return {self.path(csv_name): write_obj.tell() for csv_name, write_obj in self._files.items()}
+
+    def truncate(self, sizes):
+        """Truncates the CSVs of this release to the sizes recorded by
+        `sizes`, removing CSVs that are not recorded. Used to resume a build
+        from a checkpoint, before any file is opened."""
+
+        for file_path in glob(self.path("*")):
+            if file_path in sizes:
+                with open(file_path, 'r+b') as f:
+                    f.truncate(sizes[file_path])
+            else:
+                os.remove(file_path)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for write_obj in self._files.values():
+                write_obj.close()
+            self._files.clear()
+            self._writers.clear()
+            self._headers.clear()
+            self._buffers.clear()
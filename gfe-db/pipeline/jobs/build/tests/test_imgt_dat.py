@@ -0,0 +1,110 @@
+"""Fails if the lean DAT parser does not produce the same records as the
+Biopython IMGT parser for the fields used by the build: id, name,
+description, accessions, sequence and the feature table.
+
+Runs on fixtures/hla_3260_sample.imgt, a sample of IPD-IMGT/HLA 3.26.0 from
+the Biopython test suite with complete and partial (<1..546>) CDS records.
+Pass a DAT file to compare a release instead:
+
+    python3 test_imgt_dat.py [hla.RELEASE.dat]
+"""
+import sys
+import logging
+from pathlib import Path
+from Bio import SeqIO
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+import imgt_dat
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+FIXTURE_DAT = Path(__file__).parent / "fixtures" / "hla_3260_sample.imgt"
+
+
+def location_parts(location):
+    """Positions, position types and strands of a location"""
+
+    if location is None:
+        return None
+
+    return [
+        (int(part.start), type(part.start).__name__, int(part.end), type(part.end).__name__, part.strand)
+        for part in location.parts]
+
+
+def record_fields(record):
+    """Fields of a record used by the build"""
+
+    return {
+        "id": record.id,
+        "name": record.name,
+        "description": record.description,
+        "accessions": record.annotations.get("accessions"),
+        "sequence": str(record.seq),
+        "features": [
+            {
+                "type": feature.type,
+                "location": location_parts(feature.location),
+                "operator": getattr(feature.location, "operator", None),
+                "qualifiers": {k: list(v) for k, v in feature.qualifiers.items()},
+            }
+            for feature in record.features
+        ],
+    }
+
+
+def compare_parsers(dat_file):
+    """Parses a DAT file with both parsers and returns the differences"""
+
+    differences = []
+    expected_records = SeqIO.parse(str(dat_file), "imgt")
+    actual_records = imgt_dat.parse(str(dat_file))
+    num_records = 0
+
+    for num_records, (expected, actual) in enumerate(zip(expected_records, actual_records), start=1):
+        expected, actual = record_fields(expected), record_fields(actual)
+
+        for field in expected:
+            if expected[field] != actual[field]:
+                differences.append({"record": expected["id"], "field": field})
+                logger.error(f'{expected["id"]} {field}:\n\tBiopython: {expected[field]}\n\tLean: {actual[field]}')
+
+    # Both parsers must also yield the same number of records
+    remaining = sum(1 for _ in expected_records) - sum(1 for _ in actual_records)
+    if remaining:
+        differences.append({"record": None, "field": "records", "difference": remaining})
+        logger.error(f'Biopython parsed {remaining} more records than the lean parser')
+
+    logger.info(f'Compared {num_records} records of {dat_file}')
+
+    return differences
+
+
+def test_parity():
+    assert compare_parsers(FIXTURE_DAT) == []
+
+
+def test_offsets():
+    """Parsing from each record offset yields the same records as a full parse"""
+
+    offsets = imgt_dat.record_offsets(str(FIXTURE_DAT))
+    ids = [record.id for record in imgt_dat.parse(str(FIXTURE_DAT))]
+
+    assert len(offsets) == len(ids)
+
+    for i, offset in enumerate(offsets):
+        end = offsets[i + 1] if i + 1 < len(offsets) else None
+        assert [record.id for record in imgt_dat.parse(str(FIXTURE_DAT), start=offset, end=end)] == [ids[i]]
+
+
+if __name__ == "__main__":
+    dat_file = sys.argv[1] if len(sys.argv) > 1 else FIXTURE_DAT
+    differences = compare_parsers(dat_file)
+
+    if differences:
+        logger.error(f"Found {len(differences)} differences between the parsers")
+        sys.exit(1)
+
+    logger.info("The parsers produced the same records")
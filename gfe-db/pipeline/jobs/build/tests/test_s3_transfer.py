@@ -0,0 +1,154 @@
+"""Transfers build files to and from a moto S3 stand-in and checks that the
+checksums recorded on upload are verified on download, for compressed and
+uncompressed objects.
+
+    pip install -r requirements.txt
+    python3 -m pytest test_s3_transfer.py
+"""
+import os
+import sys
+import gzip
+from pathlib import Path
+import boto3
+import pytest
+from moto import mock_aws
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from s3_transfer import S3Transfer, ChecksumError, CHECKSUM_KEY, MB, file_sha256
+
+BUCKET = "gfe-bucket"
+PREFIX = "data/3510/csv"
+
+rows = "gfe_name,seq_id\n" + "".join(f'HLA-Aw{i}-1-1,{i * 7919}\n' for i in range(5000))
+
+
+@pytest.fixture
+def s3():
+    os.environ.update(
+        AWS_DEFAULT_REGION="us-east-1",
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing")
+
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def csv_dir(tmp_path):
+    csv_dir = tmp_path / "csv"
+    csv_dir.mkdir()
+    (csv_dir / "gfe_sequences.3510.csv").write_text(rows)
+    (csv_dir / "checkpoint.3510.json").write_text("{}")
+    return csv_dir
+
+
+def test_gzip_round_trip(s3, csv_dir, tmp_path):
+    """Compressed uploads are downloaded as is or decompressed, both verified
+    against the checksum of the uncompressed file"""
+
+    transfer = S3Transfer()
+    keys = transfer.upload(str(csv_dir), f's3://{BUCKET}/{PREFIX}/', exclude=["checkpoint.*"], compress=True)
+    assert keys == [f'{PREFIX}/gfe_sequences.3510.csv.gz']
+
+    compressed = transfer.download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path / "compressed"))
+    assert [os.path.basename(path) for path in compressed] == ["gfe_sequences.3510.csv.gz"]
+    assert gzip.open(compressed[0], "rt").read() == rows
+
+    decompressed = transfer.download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path / "decompressed"), decompress=True)
+    assert [os.path.basename(path) for path in decompressed] == ["gfe_sequences.3510.csv"]
+    assert Path(decompressed[0]).read_text() == rows
+
+
+def test_gzip_upload_verification(s3, csv_dir):
+    """Compressed uploads are checked against the number of compressed bytes
+    streamed and the recorded checksum"""
+
+    transfer = S3Transfer(chunk_size=5 * MB)
+    path = str(csv_dir / "gfe_sequences.3510.csv")
+    key = transfer.upload_file(path, BUCKET, f'{PREFIX}/gfe_sequences.3510.csv', compress=True)
+
+    # Multipart, the hex digits of random bytes compress to about 6 MB
+    large = csv_dir / "sequences.3510.csv"
+    large.write_bytes(os.urandom(6 * MB).hex().encode("ascii"))
+    large_key = transfer.upload_file(str(large), BUCKET, f'{PREFIX}/sequences.3510.csv', compress=True)
+    assert s3.head_object(Bucket=BUCKET, Key=large_key)["ContentLength"] > 5 * MB
+
+    for uploaded_path, uploaded_key in [(path, key), (str(large), large_key)]:
+        head = s3.head_object(Bucket=BUCKET, Key=uploaded_key)
+        assert head["ContentLength"] == len(s3.get_object(Bucket=BUCKET, Key=uploaded_key)["Body"].read())
+        assert head["Metadata"][CHECKSUM_KEY] == file_sha256(uploaded_path)
+
+    head = s3.head_object(Bucket=BUCKET, Key=key)
+
+    # An object truncated or replaced during the upload is rejected
+    head_object = transfer.s3.head_object
+    transfer.s3.head_object = lambda **kwargs: {**head_object(**kwargs), "ContentLength": head["ContentLength"] - 1}
+    with pytest.raises(ChecksumError):
+        transfer.upload_file(path, BUCKET, f'{PREFIX}/gfe_sequences.3510.csv', compress=True)
+
+    transfer.s3.head_object = lambda **kwargs: {**head_object(**kwargs), "Metadata": {}}
+    with pytest.raises(ChecksumError):
+        transfer.upload_file(path, BUCKET, f'{PREFIX}/gfe_sequences.3510.csv', compress=True)
+
+
+@pytest.mark.parametrize("decompress", [False, True])
+def test_gzip_checksum_mismatch(s3, tmp_path, decompress):
+    """A compressed object whose content does not match its checksum is
+    rejected and no file is left behind"""
+
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f'{PREFIX}/gfe_sequences.3510.csv.gz',
+        Body=gzip.compress(rows.encode("utf-8")[:-10]),
+        Metadata={CHECKSUM_KEY: "0" * 64})
+
+    with pytest.raises(ChecksumError):
+        S3Transfer().download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path), decompress=decompress)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_round_trip(s3, csv_dir, tmp_path):
+    """Uncompressed multipart uploads record the checksum of the file and
+    ranged downloads reproduce it"""
+
+    large = csv_dir / "sequences.3510.csv"
+    large.write_bytes(os.urandom(6 * MB).hex().encode("ascii"))
+
+    transfer = S3Transfer(chunk_size=5 * MB)
+    keys = transfer.upload(str(csv_dir), f's3://{BUCKET}/{PREFIX}/', exclude=["checkpoint.*"])
+    assert keys == [f'{PREFIX}/gfe_sequences.3510.csv', f'{PREFIX}/sequences.3510.csv']
+
+    for key in keys:
+        path = csv_dir / os.path.basename(key)
+        assert s3.head_object(Bucket=BUCKET, Key=key)["Metadata"][CHECKSUM_KEY] == file_sha256(str(path))
+
+    paths = transfer.download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path / "download"), include=["*.csv"])
+    for path in paths:
+        assert Path(path).read_bytes() == (csv_dir / os.path.basename(path)).read_bytes()
+
+
+def test_checksum_mismatch(s3, tmp_path):
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f'{PREFIX}/gfe_sequences.3510.csv',
+        Body=rows.encode("utf-8"),
+        Metadata={CHECKSUM_KEY: "0" * 64})
+
+    with pytest.raises(ChecksumError):
+        S3Transfer().download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_without_checksum(s3, tmp_path):
+    """Objects uploaded by other tools have no checksum and are downloaded
+    without verification"""
+
+    s3.put_object(Bucket=BUCKET, Key=f'{PREFIX}/gfe_sequences.3510.csv', Body=rows.encode("utf-8"))
+
+    paths = S3Transfer().download(f's3://{BUCKET}/{PREFIX}/', str(tmp_path))
+    assert Path(paths[0]).read_text() == rows
@@ -0,0 +1,82 @@
+"""Builds fixtures/hla_3260_sample.imgt as 2 shards with
+scripts/build_shards_local.sh, which merges the parts with merge_parts.py,
+and fails if the merged CSVs and manifest differ from a single process
+build of the same DAT file.
+
+Needs the build dependencies (py-ard, py-gfe) and access to the feature
+service, it is skipped when they are not installed.
+
+    pip install -r ../requirements.txt -r requirements.txt
+    python3 -m pytest test_shards.py
+"""
+import os
+import json
+import shutil
+import subprocess
+from pathlib import Path
+import pytest
+
+pytest.importorskip("pyard")
+pytest.importorskip("seqann")
+
+BUILD_DIR = Path(__file__).parents[1]
+FIXTURE_DAT = Path(__file__).parent / "fixtures" / "hla_3260_sample.imgt"
+RELEASE = "3260"
+
+# Manifest fields that do not depend on how the build was run
+manifest_fields = ["files", "dat_records", "alleles_processed", "alleles_failed", "alleles_built"]
+
+
+def data_dir(root):
+    release_dir = root / RELEASE
+    release_dir.mkdir(parents=True)
+    shutil.copy(FIXTURE_DAT, release_dir / f'hla.{RELEASE}.dat')
+    (release_dir / "csv").mkdir()
+    return root
+
+
+def build_env(root):
+    (root / "logs").mkdir()
+    return {
+        **os.environ,
+        "DATA_DIR": str(root),
+        "LOGS_DIR": str(root / "logs"),
+        "AWS_REGION": os.environ.get("AWS_REGION", "us-east-1"),
+    }
+
+
+def read_build(root):
+    csv_dir = root / RELEASE / "csv"
+    csvs = {path.name: path.read_bytes() for path in sorted(csv_dir.glob(f'*.{RELEASE}.csv'))}
+    with open(root / RELEASE / "manifest.json") as f:
+        manifest = json.load(f)
+    return csvs, {k: manifest[k] for k in manifest_fields}
+
+
+def test_sharded_build_matches_single_build(tmp_path):
+    single = data_dir(tmp_path / "single")
+    # Exit code 2 means some alleles failed to build, they fail in both builds
+    result = subprocess.run(
+        ["python3", str(BUILD_DIR / "src" / "app.py"),
+         "-o", str(single / RELEASE / "csv"), "-r", RELEASE, "--dat-parser", "lean"],
+        env=build_env(single))
+    assert result.returncode in [0, 2]
+
+    sharded = data_dir(tmp_path / "sharded")
+    subprocess.run(
+        ["bash", str(BUILD_DIR / "scripts" / "build_shards_local.sh"), RELEASE, "2"],
+        env=build_env(sharded), check=True)
+
+    single_csvs, single_manifest = read_build(single)
+    sharded_csvs, sharded_manifest = read_build(sharded)
+
+    assert single_manifest["dat_records"] == 8
+    assert sharded_csvs.keys() == single_csvs.keys()
+    for name in single_csvs:
+        assert sharded_csvs[name] == single_csvs[name], name
+    assert sharded_manifest == single_manifest
+
+    # Each shard logged to its own file
+    for part in ["part0000", "part0001"]:
+        assert (sharded / "logs" / f'gfeBuildLogs.{part}.txt').exists()
+        assert (sharded / "logs" / f'gfeBuildMetrics.{part}.json').exists()